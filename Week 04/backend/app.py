@@ -1,7 +1,12 @@
-from app import app
 import os
 
+debug_mode = os.environ.get("FLASK_ENV", "development") == "development"
+if __name__ == "__main__" and debug_mode and os.environ.get("WERKZEUG_RUN_MAIN") != "true":
+    # This process only runs the reloader; the child it starts serves requests
+    os.environ["VERIFICATION_PROCESS_POOL_AUTOSTART"] = "false"
+
+from app import app
+
 if __name__ == "__main__":
-    debug_mode = os.environ.get("FLASK_ENV", "development") == "development"
     # Binding to 0.0.0.0 allows connections from any IP
     app.run(host="0.0.0.0", port=5002, debug=debug_mode)
\ No newline at end of file
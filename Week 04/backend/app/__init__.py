@@ -1,10 +1,9 @@
 import os
 import logging
-from flask import Flask, current_app
+from flask import Flask
 from flask_jwt_extended import JWTManager
 from flask_cors import CORS
 from dotenv import load_dotenv
-import jwt  # Import PyJWT library directly
 
 # Load environment variables from .env file
 load_dotenv()
@@ -41,9 +40,9 @@ def create_app(config_class=None):
                 "http://10.1.149.171:3001"  # Your local IP with frontend port
             ],
             "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-            "allow_headers": ["Content-Type", "Authorization"],
+            "allow_headers": ["Content-Type", "Authorization", "X-MFA-TOKEN", "X-MFA-GRANT"],
             "supports_credentials": True,
-            "expose_headers": ["Content-Type", "Authorization"]
+            "expose_headers": ["Content-Type", "Authorization", "X-MFA-GRANT"]
         }
     })
     
@@ -52,10 +51,31 @@ def create_app(config_class=None):
     security = SecurityMiddleware()
     security.init_app(app)
     
+    # Initialize background verification workers
+    from app.utils.verification_jobs import verification_jobs
+    verification_jobs.init_app(app)
+    
+    from app.utils.result_cache import verification_result_cache
+    verification_result_cache.init_app(app)
+    
+    from app.utils.duplicate_index import perceptual_hash_index
+    perceptual_hash_index.init_app(app)
+    
+    # Fork verification worker processes before Firestore starts its gRPC threads
+    from app.utils.verification_pool import verification_pool
+    verification_pool.init_app(app)
+    
     # Initialize Firestore
     from app.firebase import get_firestore
     app.firestore = get_firestore()
     
+    # Revoked tokens are checked in memory, synced from Firestore in the background
+    from app.utils.token_blocklist import token_blocklist
+    token_blocklist.init_app(app)
+    
+    from app.utils.firestore_cache import document_cache
+    document_cache.init_app(app)
+    
     # Register blueprints
     from app.routes import register_blueprints
     register_blueprints(app)
@@ -65,6 +85,10 @@ def create_app(config_class=None):
     def not_found(error):
         return {"error": "Not found"}, 404
         
+    @app.errorhandler(413)
+    def request_too_large(error):
+        return {"error": "Request body too large"}, 413
+    
     @app.errorhandler(500)
     def server_error(error):
         logger.error(f"Server error: {error}")
@@ -85,32 +109,7 @@ def create_app(config_class=None):
     
     @jwt_manager.token_in_blocklist_loader
     def check_if_token_is_revoked(jwt_header, jwt_payload):
-        jti = jwt_payload["jti"]
-        db = get_firestore()
-        
-        # First try to find by JTI (new format)
-        token_ref = db.collection('blacklisted_tokens').document(jti)
-        token_doc = token_ref.get()
-        if token_doc.exists:
-            return True
-            
-        # If not found by JTI, check the old way (for backwards compatibility)
-        try:
-            # Use the imported PyJWT library, not the JWTManager instance
-            encoded_token = jwt.encode(
-                jwt_payload, 
-                current_app.config['JWT_SECRET_KEY'],
-                algorithm=jwt_header['alg']
-            )
-            raw_token_query = db.collection('blacklisted_tokens').where(
-                'token', '==', encoded_token
-            ).limit(1).get()
-            
-            return len(raw_token_query) > 0
-        except Exception as e:
-            logger.error(f"Error checking token in blocklist: {str(e)}")
-            # If there's an error, better to assume the token is valid than block legitimate requests
-            return False
+        return token_blocklist.is_revoked(jwt_payload["jti"], get_firestore())
     
     @jwt_manager.revoked_token_loader
     def revoked_token_callback(jwt_header, jwt_payload):
@@ -105,8 +105,11 @@ AUDIT_LOG_SCHEMA = {
 }
 
 BLACKLISTED_TOKEN_SCHEMA = {
-    'token': str,
-    'blacklisted_on': datetime
+    'jti': str,  # Also the document ID
+    'user_id': str,
+    'reason': str,
+    'blacklisted_at': datetime,
+    'expires_at': datetime  # Token expiry; the entry can be deleted after it
 }
 
 # Helper functions for document operations
@@ -176,9 +179,14 @@ def create_audit_log_document(data):
     
     return document
 
-def create_blacklisted_token_document(token):
-    """Create a new blacklisted token document."""
-    return {
-        'token': token,
-        'blacklisted_on': datetime.utcnow()
+def create_blacklisted_token_document(jti, user_id, expires_at, reason=None):
+    """Create a new blacklisted token document, stored under the token's JTI."""
+    document = {
+        'jti': jti,
+        'user_id': user_id,
+        'blacklisted_at': datetime.utcnow(),
+        'expires_at': expires_at
     }
+    if reason:
+        document['reason'] = reason
+    return document
@@ -5,6 +5,8 @@ from app.firebase import get_firestore
 from app.utils.auth_utils import role_required
 from app.utils.security_utils import log_audit_event, require_mfa
 from app.models import RoleEnum
+from app.utils.token_blocklist import token_blocklist
+from app.utils.firestore_cache import document_cache
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -89,6 +91,18 @@ def admin_dashboard():
         logger.error(f"Error in admin dashboard: {e}")
         return jsonify({"error": "Failed to load admin dashboard data"}), 500
 
+@admin_bp.route('/token-blocklist', methods=['GET'])
+@jwt_required()
+@role_required('admin')
+def token_blocklist_metrics():
+    """Size of the revoked token blocklist and the state of its cache and sweeper."""
+    try:
+        return jsonify(token_blocklist.metrics(get_firestore_client())), 200
+    
+    except Exception as e:
+        logger.error(f"Error reading token blocklist metrics: {e}")
+        return jsonify({"error": "Failed to load token blocklist metrics"}), 500
+
 @admin_bp.route('/users/<string:user_id>', methods=['PUT'])
 @jwt_required()
 @role_required('admin')
@@ -104,7 +118,7 @@ def update_user(user_id):
     try:
         db = get_firestore_client()
         user_ref = db.collection('users').document(user_id)
-        user_doc = user_ref.get()
+        user_doc = document_cache.get(user_ref)
         
         if not user_doc.exists:
             log_audit_event(
@@ -180,7 +194,7 @@ def update_user(user_id):
         
         # Apply updates
         if updates:
-            user_ref.update(updates)
+            document_cache.update(user_ref, updates)
         
         log_audit_event(
             user_id=current_admin_id,
@@ -189,8 +203,8 @@ def update_user(user_id):
             resource_id=user_id
         )
         
-        # Get updated user data
-        updated_user = user_ref.get().to_dict()
+        # The stored document is the one read above plus our changes
+        updated_user = {**user_data, **updates}
         return jsonify({"message": "User updated successfully", "user": updated_user}), 200
     
     except Exception as e:
@@ -218,7 +232,7 @@ def delete_user(user_id):
     try:
         db = get_firestore_client()
         user_ref = db.collection('users').document(user_id)
-        user_doc = user_ref.get()
+        user_doc = document_cache.get(user_ref)
         
         if not user_doc.exists:
             log_audit_event(
@@ -261,7 +275,7 @@ def delete_user(user_id):
             verification.reference.delete()
         
         # Delete user
-        user_ref.delete()
+        document_cache.delete(user_ref)
         
         # Log successful deletion
         log_audit_event(
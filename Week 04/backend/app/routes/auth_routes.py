@@ -10,6 +10,8 @@ from app.utils.auth_utils import (
 )
 from app.utils.security_utils import log_audit_event
 from app.utils.mfa_utils import create_mfa_session
+from app.utils.token_blocklist import token_blocklist
+from app.utils.firestore_cache import document_cache
 import bcrypt
 import secrets
 import re
@@ -96,7 +98,7 @@ def verify_mfa():
             # Get user data
             db = get_firestore()
             user_ref = db.collection('users').document(user_id)
-            user_doc = user_ref.get()
+            user_doc = document_cache.get(user_ref)
             
             if not user_doc.exists:
                 return jsonify({"error": "User not found"}), 404
@@ -118,7 +120,7 @@ def verify_mfa():
                 return jsonify({"error": "Invalid verification code"}), 400
             
             # Enable MFA for the user
-            user_ref.update({
+            document_cache.update(user_ref, {
                 'mfa_enabled': True,
                 'mfa_verified': True
             })
@@ -190,7 +192,7 @@ def verify_mfa():
     
     # Get user
     user_ref = db.collection('users').document(mfa_session['user_id'])
-    user_doc = user_ref.get()
+    user_doc = document_cache.get(user_ref)
     if not user_doc.exists:
         return jsonify({'error': 'User not found'}), 404
     
@@ -249,32 +251,14 @@ def logout():
             logger.warning("No Authorization header in logout request")
             return jsonify({'error': 'No token provided'}), 401
         
-        # Add token to blacklist
-        db = get_firestore()
-        
-        # Extract JWT token from Authorization header
-        if token.startswith('Bearer '):
-            token = token[7:]  # Remove 'Bearer ' prefix
-        
         # Get JWT claims and user ID
         claims = get_jwt()
         user_id = get_jwt_identity()
-        jti = claims.get('jti', '')
         
-        logger.info(f"Processing logout for user_id: {user_id}, jti: {jti}")
+        logger.info(f"Processing logout for user_id: {user_id}, jti: {claims.get('jti', '')}")
         
-        # Add token to blacklist using JTI as the document ID
-        blacklisted_token = {
-            'token': token,
-            'jti': jti,
-            'blacklisted_at': datetime.utcnow(),
-            'user_id': user_id
-        }
-        
-        if jti:
-            db.collection('blacklisted_tokens').document(jti).set(blacklisted_token)
-        else:
-            db.collection('blacklisted_tokens').document().set(blacklisted_token)
+        # Add token to blacklist, keyed by its JTI
+        token_blocklist.revoke(claims, user_id, get_firestore())
         
         # Log logout event
         log_audit_event(
@@ -302,7 +286,7 @@ def refresh():
     try:
         current_user_id = get_jwt_identity()
         db = get_firestore()
-        user_doc = db.collection('users').document(current_user_id).get()
+        user_doc = document_cache.get(db.collection('users').document(current_user_id))
         
         if not user_doc.exists:
             return jsonify({"error": "User not found"}), 404
@@ -350,7 +334,7 @@ def update_profile():
         
         db = get_firestore()
         user_ref = db.collection('users').document(current_user_id)
-        user_doc = user_ref.get()
+        user_doc = document_cache.get(user_ref)
         
         if not user_doc.exists:
             return jsonify({"error": "User not found"}), 404
@@ -444,7 +428,7 @@ def update_profile():
             # Add timestamp for when the profile was last updated
             update_data['updated_at'] = datetime.utcnow()
             
-            user_ref.update(update_data)
+            document_cache.update(user_ref, update_data)
             
             # Log the profile update event
             log_audit_event(
@@ -456,9 +440,8 @@ def update_profile():
                 status='success'
             )
             
-            # Get updated user data to return
-            updated_user_doc = user_ref.get()
-            updated_user_data = updated_user_doc.to_dict()
+            # The stored document is the one read above plus our changes
+            updated_user_data = {**user_data, **update_data}
             
             return jsonify({
                 "message": "Profile updated successfully",
@@ -494,7 +477,7 @@ def delete_account():
         # Get the user from database
         db = get_firestore()
         user_ref = db.collection('users').document(current_user_id)
-        user_doc = user_ref.get()
+        user_doc = document_cache.get(user_ref)
         
         if not user_doc.exists:
             return jsonify({"error": "User not found"}), 404
@@ -545,28 +528,10 @@ def delete_account():
             session.reference.delete()
             
         # 3. Finally, delete the user account
-        user_ref.delete()
+        document_cache.delete(user_ref)
         
         # Add token to blacklist to force logout
-        token = request.headers.get('Authorization')
-        if token and token.startswith('Bearer '):
-            token = token[7:]  # Remove 'Bearer ' prefix
-            
-            claims = get_jwt()
-            jti = claims.get('jti', '')
-            
-            blacklisted_token = {
-                'token': token,
-                'jti': jti,
-                'blacklisted_at': datetime.utcnow(),
-                'user_id': current_user_id,
-                'reason': 'account_deletion'
-            }
-            
-            if jti:
-                db.collection('blacklisted_tokens').document(jti).set(blacklisted_token)
-            else:
-                db.collection('blacklisted_tokens').document().set(blacklisted_token)
+        token_blocklist.revoke(get_jwt(), current_user_id, db, reason='account_deletion')
         
         return jsonify({"success": True, "message": "Your account has been permanently deleted"}), 200
         
@@ -4,16 +4,26 @@ Routes for secure document handling and validation.
 import logging
 import base64
 import hashlib
-from flask import Blueprint, request, jsonify, current_app
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask import Blueprint, request, jsonify, current_app, url_for, g
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from datetime import datetime
 import uuid
 import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from app.firebase import get_firestore
 from app.utils.auth_utils import role_required
 from app.utils.security_utils import log_audit_event, require_mfa, compute_document_hash, verify_document_integrity
-from app.utils.verification_utils import verify_document, detect_nadra_pattern, decode_base64_image
+from app.utils.middleware import max_content_length
+from app.utils.verification_utils import (
+    detect_nadra_pattern, decode_base64_image, decode_base64_payload,
+    check_image_dimensions, PIPELINE_VERSION
+)
+from app.utils.result_cache import verification_result_cache
+from app.utils.duplicate_index import perceptual_hash_index, id_number_key
+from app.utils.verification_pool import verification_pool
+from app.utils.verification_jobs import verification_jobs, QueueFullError, JOB_QUEUED, JOB_COMPLETED, JOB_FAILED
 from app.models import encrypt_data, decrypt_data
 
 # Configure logging
@@ -22,10 +32,150 @@ logger = logging.getLogger(__name__)
 # Create blueprint
 doc_bp = Blueprint('documents', __name__, url_prefix='/api/documents')
 
+# Binary uploads are read in chunks of this size, never past the size limit
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Batch statuses from worst to best: the worst document decides the batch
+BATCH_STATUS_ORDER = ['error', 'invalid', 'potentially valid', 'verified']
+
+# Worker pool for batch uploads, created on first use
+_batch_executor = None
+_batch_executor_lock = threading.Lock()
+
 def get_firestore_client():
     """Get Firestore client instance."""
     return get_firestore()
 
+def _get_batch_executor():
+    """Return the thread pool batch uploads verify their documents on."""
+    global _batch_executor
+    with _batch_executor_lock:
+        if _batch_executor is None:
+            _batch_executor = ThreadPoolExecutor(
+                max_workers=current_app.config.get('VERIFICATION_BATCH_WORKERS', 4),
+                thread_name_prefix='verification-batch'
+            )
+        return _batch_executor
+
+def _too_large_response(document_size=None):
+    """Build the 413 response for an upload over MAX_DOCUMENT_SIZE."""
+    max_size = current_app.config.get('MAX_DOCUMENT_SIZE', 1000000)
+    logger.warning(f"Document size too large: {document_size or 'over limit'} bytes (max: {max_size})")
+    received = f", received {document_size/1000000:.1f}MB" if document_size else ""
+    return jsonify({
+        "error": f"Document too large. Maximum size is {max_size/1000000:.1f}MB{received}",
+        "details": "Please compress the image or reduce its resolution before uploading"
+    }), 413  # Payload Too Large
+
+def _document_too_large(document):
+    """
+    Check an uploaded document against MAX_DOCUMENT_SIZE.
+    
+    Returns:
+        Tuple[Response, int]: 413 error response, or None if the size is fine
+    """
+    # Base64 is ASCII, so the string length is its size in bytes
+    document_size = len(document) if isinstance(document, (str, bytes, bytearray)) else 0
+    if document_size <= current_app.config.get('MAX_DOCUMENT_SIZE', 1000000):
+        return None
+    return _too_large_response(document_size)
+
+def _flag(value):
+    """Interpret a JSON boolean or a form/query string flag."""
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+def _read_limited(stream, limit):
+    """
+    Read a binary upload in chunks, stopping as soon as it exceeds limit.
+    
+    Args:
+        stream: File-like object to read from
+        limit (int): Maximum number of bytes accepted
+        
+    Returns:
+        bytearray: The uploaded bytes, or None if there were more than limit
+    """
+    buffer = bytearray()
+    while True:
+        chunk = stream.read(min(UPLOAD_CHUNK_SIZE, limit + 1 - len(buffer)))
+        if not chunk:
+            return buffer
+        buffer.extend(chunk)
+        if len(buffer) > limit:
+            return None
+
+def _parse_upload_request():
+    """
+    Read the document and options of an upload.
+    
+    Three encodings are accepted:
+    
+    - ``application/json``: ``{"document": "<base64>", "document_type": ...}``
+      (kept for older clients)
+    - ``multipart/form-data``: the image as the ``document`` file field and
+      the options as form fields
+    - ``application/octet-stream`` or ``image/*``: the raw image as the body
+      and the options in the query string
+    
+    The declared Content-Length is checked before anything is parsed, and
+    binary bodies are read in bounded chunks, so an oversized upload is
+    rejected without being buffered. Bodies without a Content-Length are
+    cut off at MAX_CONTENT_LENGTH while they are read (see LimitedRequest). Binary documents are returned as bytes
+    and go to the decoder without any base64 round trip.
+    
+    Returns:
+        Tuple[dict, Tuple[Response, int]]: (upload data, None) or (None, error response)
+    """
+    required_fields = ['document', 'document_type']
+    
+    def missing_fields():
+        return jsonify({
+            "error": "Missing required fields",
+            "required": required_fields
+        }), 400
+    
+    max_size = current_app.config.get('MAX_DOCUMENT_SIZE', 1000000)
+    content_length = request.content_length
+    if content_length is not None and content_length > request.max_content_length:
+        return None, _too_large_response(content_length)
+    
+    mimetype = request.mimetype
+    if mimetype == 'multipart/form-data':
+        upload = request.files.get('document')
+        if upload is None:
+            return None, missing_fields()
+        data = request.form.to_dict()
+        document = _read_limited(upload.stream, max_size)
+    elif mimetype == 'application/octet-stream' or mimetype.startswith('image/'):
+        data = request.args.to_dict()
+        document = _read_limited(request.stream, max_size)
+    else:
+        data = request.get_json()
+        if not data:
+            return None, (jsonify({"error": "No input data provided"}), 400)
+        
+        # Validate required fields
+        if not all(field in data for field in required_fields):
+            return None, missing_fields()
+        
+        # Check document size
+        size_error = _document_too_large(data['document'])
+        if size_error:
+            return None, size_error
+        return data, None
+    
+    if document is None:
+        return None, _too_large_response()
+    if not document:
+        return None, (jsonify({"error": "Empty document"}), 400)
+    if 'document_type' not in data:
+        return None, missing_fields()
+    
+    data['document'] = document
+    return data, None
+
 @doc_bp.route('/upload', methods=['POST'])
 @jwt_required()
 @require_mfa
@@ -36,154 +186,511 @@ def upload_documents():
     This endpoint accepts document images and performs AI-based verification
     using OCR and OpenCV for real document analysis. The document is not stored
     in the database for privacy and security reasons.
+    
+    The image can be sent as base64 in JSON or, cheaper, as raw bytes in a
+    multipart form or request body; see _parse_upload_request.
+    
+    With ``"async": true`` in the body (or ``?async=true``, or when
+    VERIFICATION_ASYNC_DEFAULT is set) the document is queued on the
+    verification worker pool and a job ID is returned immediately; poll
+    ``/status/<job_id>`` for the stage and final result.
+    
+    Admins also get the pipeline's per-stage timings and counters in the
+    response under ``metrics``.
     """
     current_user_id = get_jwt_identity()
-    data = request.get_json()
+    data, error_response = _parse_upload_request()
+    if error_response:
+        return error_response
+    
+    run_async = data.get('async', request.args.get('async'))
+    if run_async is None:
+        run_async = current_app.config.get('VERIFICATION_ASYNC_DEFAULT', False)
+    else:
+        run_async = _flag(run_async)
     
+    # Captured here: queued jobs run outside this request
+    options = {
+        "include_ocr_text": _flag(data.get('include_ocr_text', False)),
+        "request_id": getattr(g, 'request_id', None),
+        "include_metrics": get_jwt().get('role') == 'admin'
+    }
+    
+    if run_async:
+        try:
+            job_id = verification_jobs.submit(
+                current_user_id,
+                process_document_verification,
+                current_user_id,
+                data['document'],
+                data['document_type'],
+                **options
+            )
+        except QueueFullError:
+            logger.warning("Verification queue is full, rejecting upload")
+            return jsonify({"error": "Verification service is busy, please retry shortly"}), 503
+        
+        log_audit_event(
+            action="document_verification_queued",
+            user_id=current_user_id,
+            resource_type="verification_job",
+            resource_id=job_id,
+            details={"document_type": data['document_type']}
+        )
+        
+        return jsonify({
+            "message": "Document queued for verification",
+            "job_id": job_id,
+            "status": JOB_QUEUED,
+            "status_url": url_for('documents.get_document_status', document_id=job_id)
+        }), 202
+    
+    try:
+        return jsonify(process_document_verification(
+            current_user_id,
+            data['document'],
+            data['document_type'],
+            **options
+        )), 200
+        
+    except ValueError as ve:
+        # Handle validation errors
+        logger.error(f"Validation error: {ve}")
+        return jsonify({"error": str(ve)}), 400
+        
+    except Exception as e:
+        # Handle general errors
+        logger.error(f"Error verifying document: {e}")
+        return jsonify({"error": "Failed to verify document"}), 500
+
+@doc_bp.route('/upload/batch', methods=['POST'])
+@max_content_length('VERIFICATION_BATCH_MAX_CONTENT_LENGTH')
+@jwt_required()
+@require_mfa
+def upload_documents_batch():
+    """
+    Verify several documents of one user in a single request.
+    
+    Accepts ``{"documents": [{"document", "document_type", "label"}, ...]}``
+    (for example the front and back of an ID card and a selfie). The
+    documents are verified in parallel on the batch worker pool and the
+    response holds a result per document, in request order, plus an
+    aggregate decision. One consolidated audit event is written for the batch.
+    """
+    current_user_id = get_jwt_identity()
+    
+    # Reject oversized bodies before parsing the JSON
+    max_documents = current_app.config.get('VERIFICATION_BATCH_MAX_DOCUMENTS', 5)
+    if request.content_length and request.content_length > request.max_content_length:
+        return _too_large_response(request.content_length)
+    
+    data = request.get_json()
     if not data:
         return jsonify({"error": "No input data provided"}), 400
     
-    # Validate required fields
-    required_fields = ['document', 'document_type']
-    if not all(field in data for field in required_fields):
+    documents = data.get('documents')
+    if not isinstance(documents, list) or not documents:
+        return jsonify({"error": "documents must be a non-empty list"}), 400
+    
+    if len(documents) > max_documents:
         return jsonify({
-            "error": "Missing required fields",
-            "required": required_fields
+            "error": f"Too many documents. A batch can hold at most {max_documents} documents"
         }), 400
     
-    # Check document size
-    MAX_DOCUMENT_SIZE = 1000000  # 1MB
-    document_size = len(data['document'].encode('utf-8')) if isinstance(data['document'], str) else 0
+    # Validate every document before verifying any of them
+    required_fields = ['document', 'document_type']
+    for index, item in enumerate(documents):
+        if not isinstance(item, dict) or not all(field in item for field in required_fields):
+            return jsonify({
+                "error": f"Missing required fields in document {index}",
+                "required": required_fields
+            }), 400
+        size_error = _document_too_large(item['document'])
+        if size_error:
+            return size_error
     
-    if document_size > MAX_DOCUMENT_SIZE:
-        logger.warning(f"Document size too large: {document_size} bytes (max: {MAX_DOCUMENT_SIZE})")
-        return jsonify({
-            "error": f"Document too large. Maximum size is {MAX_DOCUMENT_SIZE/1000000:.1f}MB, received {document_size/1000000:.1f}MB",
-            "details": "Please compress the image or reduce its resolution before uploading"
-        }), 413  # Payload Too Large
+    include_ocr_text = _flag(data.get('include_ocr_text', False))
+    request_id = getattr(g, 'request_id', None)
+    include_metrics = get_jwt().get('role') == 'admin'
+    batch_id = str(uuid.uuid4())
     
     try:
-        # Handle document type mapping for special types
-        document_type = data['document_type']
+        executor = _get_batch_executor()
+        futures = [
+            executor.submit(run_document_verification, item['document'], item['document_type'],
+                            include_ocr_text=include_ocr_text, request_id=request_id,
+                            user_id=current_user_id)
+            for item in documents
+        ]
         
-        # Map 'drivers_license' to 'e_license' if it appears to be digital
-        if document_type == 'drivers_license' and is_likely_digital_license(data['document']):
-            logger.info("Document appears to be a digital license, using specialized verification rules")
-            document_type = 'e_license'
+        results = []
+        audit_documents = []
+        for index, (item, future) in enumerate(zip(documents, futures)):
+            entry = {"index": index, "label": item.get('label'), "document_type": item['document_type']}
+            try:
+                outcome = future.result()
+            except ValueError as ve:
+                logger.error(f"Validation error in batch {batch_id}, document {index}: {ve}")
+                entry["error"] = str(ve)
+            except Exception as e:
+                logger.error(f"Error verifying batch {batch_id}, document {index}: {e}")
+                entry["error"] = "Failed to verify document"
+            else:
+                entry.update({
+                    "document_id": outcome['document_id'],
+                    "verification_result": outcome['verification_result'],
+                    "cached": outcome['cache_hit']
+                })
+                if include_metrics:
+                    entry["metrics"] = outcome['metrics']
+            
+            results.append(entry)
+            if "error" in entry:
+                audit_documents.append({"index": index, "label": entry['label'], "error": entry['error']})
+                continue
+            
+            audit_document = dict(_audit_summary(outcome), index=index, label=entry['label'])
+            if outcome['possible_reuse']:
+                # Reported in the batch event rather than as separate events
+                logger.warning(f"Document {outcome['document_id']} in batch {batch_id} from user "
+                               f"{current_user_id} matches {len(outcome['possible_reuse'])} "
+                               f"document(s) uploaded by other accounts")
+                audit_document.update(
+                    perceptual_hash=outcome['perceptual_hash'],
+                    reuse_matches=_reuse_matches(outcome)
+                )
+            audit_documents.append(audit_document)
         
-        # Log the document type before verification
-        logger.info(f"Processing document of type: {document_type}")
+        decision = aggregate_batch_decision(results)
         
-        # Perform document verification with real OCR and security feature detection
-        verification_result = verify_document(
-            document_data=data['document'],
-            document_type=document_type
+        # One audit event for the whole batch (never the documents themselves)
+        log_audit_event(
+            action="document_batch_verification",
+            user_id=current_user_id,
+            resource_type="document_verification_batch",
+            resource_id=batch_id,
+            details={
+                "request_id": request_id,
+                "decision": decision['status'],
+                "possible_reuse": any(document.get('reuse_matches') for document in audit_documents),
+                "documents": audit_documents
+            }
         )
         
-        # Extract ID number from verification_result (determined by OCR)
-        id_number = verification_result.get('id_number')
+        return jsonify({
+            "message": "Documents verified",
+            "batch_id": batch_id,
+            "decision": decision,
+            "results": results
+        }), 200
         
-        # Get or generate readable document ID (not stored, just for response)
-        if id_number and document_type == 'id_card':
-            # Use actual OCR-extracted ID for ID cards
-            readable_doc_id = id_number
-            logger.info(f"Using OCR-extracted ID number: {id_number}")
-            # Add ID card specific data to verification result
-            verification_result['id_card_data'] = {
-                "id_number": id_number,
-                "card_type": "National Identity Card",
-                "issuing_authority": "National Database and Registration Authority"
-            }
-        else:
-            # For other documents, generate a UUID
-            readable_doc_id = str(uuid.uuid4())
-            logger.info(f"Generated document ID: {readable_doc_id}")
+    except Exception as e:
+        logger.error(f"Error verifying document batch {batch_id}: {e}")
+        log_audit_event(
+            action="document_batch_verification",
+            user_id=current_user_id,
+            resource_type="document_verification_batch",
+            resource_id=batch_id,
+            status="failure",
+            details={"error": str(e), "request_id": request_id}
+        )
+        return jsonify({"error": "Failed to verify documents"}), 500
+
+def aggregate_batch_decision(results):
+    """
+    Combine per-document results into one decision for the batch.
+    
+    The batch gets the worst status of its documents (a document that
+    could not be verified counts as 'error') and the lowest confidence score.
+    
+    Args:
+        results (list): Per-document entries built by upload_documents_batch
         
-        # Compute document hash for verification purposes only
-        doc_hash = compute_document_hash(data['document'])
+    Returns:
+        dict: status, confidence_score, documents and status_counts
+    """
+    statuses = []
+    scores = []
+    for entry in results:
+        result = entry.get('verification_result') or {}
+        status = result.get('status', 'error') if "error" not in entry else 'error'
+        statuses.append(status if status in BATCH_STATUS_ORDER else 'error')
+        scores.append(result.get('confidence_score', 0))
+    
+    status_counts = {}
+    for status in statuses:
+        status_counts[status] = status_counts.get(status, 0) + 1
+    
+    return {
+        "status": min(statuses, key=BATCH_STATUS_ORDER.index),
+        "confidence_score": min(scores),
+        "documents": len(results),
+        "status_counts": status_counts
+    }
+
+def process_document_verification(current_user_id, document, requested_type,
+                                  include_ocr_text=False, on_stage=None,
+                                  request_id=None, include_metrics=False):
+    """
+    Verify one uploaded document and build the upload response.
+    
+    Used inline by the upload endpoint and as the task of queued
+    verification jobs, so it only needs an application context.
+    
+    Args:
+        current_user_id (str): User who uploaded the document
+        document (str | bytes): Base64 encoded document image or raw image bytes
+        requested_type (str): Document type selected by the client
+        include_ocr_text (bool): Run full-page OCR and return a text preview
+        on_stage (callable, optional): Progress callback, see verify_document
+        request_id (str, optional): ID of the originating request, for logs and audit
+        include_metrics (bool): Return the pipeline metrics (admins only)
+        
+    Returns:
+        dict: Response data with document_id and verification_result
+    """
+    try:
+        outcome = run_document_verification(
+            document, requested_type,
+            include_ocr_text=include_ocr_text,
+            on_stage=on_stage,
+            request_id=request_id,
+            user_id=current_user_id
+        )
         
         # Log verification action (but not the document itself)
         log_audit_event(
             action="document_verification",
             user_id=current_user_id,
             resource_type="document_verification",
-            resource_id=readable_doc_id,
-            details={
-                "document_type": data['document_type'],
-                "actual_document_type": document_type,
-                "verification_status": verification_result.get('status', 'processed'),
-                "readable_id": readable_doc_id,
-                "id_extracted": bool(id_number)  # Log whether ID extraction was successful
-            }
+            resource_id=outcome['document_id'],
+            details=dict(_audit_summary(outcome), request_id=request_id)
         )
-        
-        # Remove OCR text from the response to reduce size
-        if 'ocr_text' in verification_result:
-            # Replace full OCR text with a preview in the response
-            verification_result['ocr_preview'] = verification_result['ocr_text'][:100] + '...'
-            del verification_result['ocr_text']
-        
-        # Debug: Log the verification result being returned
-        logger.info(f"Verification result: {verification_result}")
+        _log_possible_reuse(current_user_id, outcome, request_id)
         
         # Prepare response with verification results
         response_data = {
             "message": "Document verified successfully",
-            "document_id": readable_doc_id,
-            "verification_result": verification_result
+            "document_id": outcome['document_id'],
+            "verification_result": outcome['verification_result'],
+            "cached": outcome['cache_hit']
         }
+        if include_metrics:
+            response_data["metrics"] = outcome['metrics']
         
         # Additional debug logging
         logger.info(f"Full response data: {response_data}")
         
-        return jsonify(response_data), 200
-        
-    except ValueError as ve:
-        # Handle validation errors
-        logger.error(f"Validation error: {ve}")
-        log_audit_event(
-            action="document_verification",
-            user_id=current_user_id,
-            status="failure",
-            details={"error": str(ve)}
-        )
-        return jsonify({"error": str(ve)}), 400
+        return response_data
         
     except Exception as e:
-        # Handle general errors
-        logger.error(f"Error verifying document: {e}")
         log_audit_event(
             action="document_verification",
             user_id=current_user_id,
             status="failure",
-            details={"error": str(e)}
+            details={"error": str(e), "request_id": request_id}
         )
-        return jsonify({"error": "Failed to verify document"}), 500
+        raise
 
-def is_likely_digital_license(document_data: str) -> bool:
+def run_document_verification(document, requested_type, include_ocr_text=False,
+                              on_stage=None, request_id=None, user_id=None):
     """
-    Determine if a document is likely a digital license.
+    Verify one document without writing audit events.
+    
+    The result cache is consulted before any image analysis, keyed by the
+    SHA-256 of the image bytes, the document type and PIPELINE_VERSION.
+    Needs no application context, so batch uploads can run it on worker threads.
+    
+    Near-duplicates are looked up by perceptual hash as well, but only to
+    flag possible reuse: a hash match cannot tell a re-photo of a card from
+    another card of the same template, so its result is never reused. The
+    document is verified in full, and documents other accounts uploaded
+    that match it are returned under possible_reuse, unless OCR read a
+    different ID number from them. Each match's id_match is True when both
+    ID numbers were read and agree, and None when one of them is unknown;
+    matches with id_match None are a weak, noisy signal.
     
     Args:
-        document_data (str): Base64 encoded document image
+        document (str | bytes): Base64 encoded document image or raw image bytes
+        requested_type (str): Document type selected by the client
+        include_ocr_text (bool): Run full-page OCR and return a text preview
+        on_stage (callable, optional): Progress callback, see verify_document
+        request_id (str, optional): ID of the originating request, for logs
+        user_id (str, optional): Uploading account, for near-duplicate checks
         
     Returns:
-        bool: True if document appears to be a digital license
+        dict: requested_type, document_type, document_id, verification_result,
+            cache_hit, possible_reuse (matches from other accounts),
+            id_extracted and metrics (None on a cache hit)
     """
-    try:
-        # More reliable detection for digital licenses
-        # For now, be more permissive with driver's licenses - assume they're digital
-        # unless proven otherwise
+    # Cache and index entries are keyed by the type the client selected; the
+    # pipeline reports the type it actually verified as (see verify_document)
+    document_type = requested_type
+    
+    # Log the document type before verification
+    logger.info(f"Processing document of type: {document_type}")
+    
+    # Decode the transport encoding once; the hash and the pipeline share the bytes
+    image_bytes = decode_base64_payload(document) if isinstance(document, str) else document
+    
+    # Reject unreadable or oversized images from their header, before any decoding
+    check_image_dimensions(image_bytes)
+    
+    # Compute document hash for cache lookup and verification purposes only
+    doc_hash = compute_document_hash(image_bytes)
+    variant = 'ocr_text' if include_ocr_text else ''
+    cache_key = verification_result_cache.make_key(doc_hash, document_type, PIPELINE_VERSION, variant=variant)
+    
+    verification_result = verification_result_cache.get(cache_key)
+    cache_hit = verification_result is not None
+    
+    metrics = None
+    if cache_hit:
+        logger.info(f"Verification result for document {doc_hash[:12]} served from cache")
+    else:
+        # Perform document verification with real OCR and security feature detection,
+        # in a worker process so a pathological image cannot stall the API
+        verification_result = verification_pool.verify(
+            image_bytes,
+            document_type,
+            include_ocr_text=include_ocr_text,
+            on_stage=on_stage,
+            request_id=request_id
+        )
         
-        # This is a simplified approach for the demo
-        # In a production system, this would use computer vision to detect
-        # screen capture artifacts, digital watermarks, etc.
+        # Metrics describe this run only, so they are kept out of the cache
+        metrics = verification_result.pop('metrics', None)
         
-        logger.info("Assuming driver's license is digital for better verification outcome")
-        return True
-    except Exception as e:
-        logger.error(f"Error checking if license is digital: {e}")
-        return True  # Default to digital for better user experience
+        # Remove OCR text from the result to reduce size
+        if 'ocr_text' in verification_result:
+            # Replace full OCR text with a preview in the response
+            verification_result['ocr_preview'] = verification_result['ocr_text'][:100] + '...'
+            del verification_result['ocr_text']
+        
+        # Errors are not cached so a retry gets a fresh attempt
+        if verification_result.get('status') != 'error':
+            verification_result_cache.put(cache_key, verification_result)
+    
+    # Earlier uploads that look the same, even if their bytes differ. The worker
+    # hashes the decoded image, so the API process never decodes the upload
+    perceptual_hash = verification_result.pop('perceptual_hash', None)
+    matches = []
+    if perceptual_hash is not None and perceptual_hash_index.enabled:
+        perceptual_hash = int(perceptual_hash, 16)
+        matches = perceptual_hash_index.lookup(perceptual_hash)
+        # Only documents that made it through the pipeline are worth matching later
+        if (not cache_hit and user_id
+                and verification_result.get('status') not in ('error', 'invalid')):
+            perceptual_hash_index.add(perceptual_hash, doc_hash, document_type, user_id,
+                                      id_number=verification_result.get('id_number'))
+    
+    possible_reuse = _possible_reuse(matches, user_id, verification_result.get('id_number'))
+    
+    # The pipeline verifies digital licenses as e_license
+    document_type = (verification_result.get('classification') or {}).get('verified_as') or requested_type
+    
+    # Extract ID number from verification_result (determined by OCR)
+    id_number = verification_result.get('id_number')
+    
+    # Get or generate readable document ID (not stored, just for response)
+    if id_number and document_type == 'id_card':
+        # Use actual OCR-extracted ID for ID cards
+        readable_doc_id = id_number
+        logger.info(f"Using OCR-extracted ID number: {id_number}")
+        # Add ID card specific data to verification result
+        verification_result['id_card_data'] = {
+            "id_number": id_number,
+            "card_type": "National Identity Card",
+            "issuing_authority": "National Database and Registration Authority"
+        }
+    else:
+        # For other documents, generate a UUID
+        readable_doc_id = str(uuid.uuid4())
+        logger.info(f"Generated document ID: {readable_doc_id}")
+    
+    # Debug: Log the verification result being returned
+    logger.info(f"Verification result: {verification_result}")
+    
+    return {
+        "requested_type": requested_type,
+        "document_type": document_type,
+        "document_id": readable_doc_id,
+        "verification_result": verification_result,
+        "cache_hit": cache_hit,
+        "perceptual_hash": f"{perceptual_hash:016x}" if perceptual_hash is not None else None,
+        "possible_reuse": possible_reuse,
+        "id_extracted": bool(id_number),
+        "metrics": metrics
+    }
+
+def _possible_reuse(matches, user_id, id_number):
+    """
+    Near-duplicate matches from other accounts that may be the same document.
+    
+    Matches whose ID number differs from the upload's are other documents of
+    the same template and are dropped. The rest get id_match: True if the ID
+    numbers agree, None if either is unknown.
+    """
+    if not user_id:
+        return []
+    key = id_number_key(id_number)
+    possible = []
+    for match in matches:
+        if match['owner_id'] == user_id:
+            continue
+        id_match = None
+        if key and match['id_key']:
+            if match['id_key'] != key:
+                continue
+            id_match = True
+        possible.append(dict(match, id_match=id_match))
+    return possible
+
+def _audit_summary(outcome):
+    """Audit details for one verified document (never the document itself)."""
+    return {
+        "document_type": outcome['requested_type'],
+        "actual_document_type": outcome['document_type'],
+        "verification_status": outcome['verification_result'].get('status', 'processed'),
+        "readable_id": outcome['document_id'],
+        "id_extracted": outcome['id_extracted'],  # Log whether ID extraction was successful
+        "cache_hit": outcome['cache_hit'],
+        "possible_reuse": bool(outcome['possible_reuse']),
+        "reuse_confirmed": any(match['id_match'] for match in outcome['possible_reuse']),
+        "metrics": outcome['metrics']
+    }
+
+def _log_possible_reuse(current_user_id, outcome, request_id=None):
+    """Flag a document that other accounts have already uploaded."""
+    if not outcome['possible_reuse']:
+        return
+    logger.warning(f"Document {outcome['document_id']} from user {current_user_id} matches "
+                   f"{len(outcome['possible_reuse'])} document(s) uploaded by other accounts")
+    log_audit_event(
+        action="possible_document_reuse",
+        user_id=current_user_id,
+        resource_type="document_verification",
+        resource_id=outcome['document_id'],
+        details={
+            "request_id": request_id,
+            "document_type": outcome['document_type'],
+            "perceptual_hash": outcome['perceptual_hash'],
+            "matches": _reuse_matches(outcome)
+        }
+    )
+
+def _reuse_matches(outcome):
+    """Audit details of the other accounts' documents a document matches."""
+    return [
+        {
+            "user_id": match['owner_id'],
+            "document_type": match['document_type'],
+            "document_hash": match['document_hash'][:12],
+            "distance": match['distance'],
+            "id_match": match['id_match']
+        }
+        for match in outcome['possible_reuse']
+    ]
 
 @doc_bp.route('/verify/<string:document_id>', methods=['POST'])
 @jwt_required()
@@ -217,27 +724,34 @@ def verify_document_manual(document_id):
 @jwt_required()
 def get_document_status(document_id):
     """
-    Get document status endpoint.
+    Get the status of a queued document verification job.
     
-    This endpoint is no longer functional as documents are not stored in the database.
-    It returns a message indicating that documents are processed in real-time and not stored.
+    Returns the job's current stage and, once it has finished, the
+    verification result. Jobs are only visible to the user who created them
+    and are kept for VERIFICATION_JOB_TTL seconds after finishing.
     """
     current_user_id = get_jwt_identity()
     
-    log_audit_event(
-        action="document_status_check_attempt",
-        user_id=current_user_id,
-        resource_type="document",
-        resource_id=document_id,
-        status="failure",
-        details={"reason": "Documents are no longer stored in the system"}
-    )
+    job = verification_jobs.get(document_id, user_id=current_user_id)
+    if job is None:
+        return jsonify({
+            "error": "Verification job not found",
+            "message": "The job does not exist, belongs to another user or its result has expired."
+        }), 404
     
-    return jsonify({
-        "error": "This functionality is no longer available",
-        "message": "Documents are now processed in real-time for verification and are not stored in our system for privacy and security reasons.",
-        "status": "feature_disabled"
-    }), 404
+    response_data = {
+        "job_id": job['job_id'],
+        "status": job['status'],
+        "stage": job['stage'],
+        "created_at": datetime.utcfromtimestamp(job['created_at']).isoformat() + 'Z',
+        "updated_at": datetime.utcfromtimestamp(job['updated_at']).isoformat() + 'Z'
+    }
+    if job['status'] == JOB_COMPLETED:
+        response_data['result'] = job['result']
+    elif job['status'] == JOB_FAILED:
+        response_data['error'] = job['error']
+    
+    return jsonify(response_data), 200
 
 @doc_bp.route('/retrieve/<string:document_id>', methods=['GET'])
 @jwt_required()
@@ -2,12 +2,13 @@
 Routes for multi-factor authentication (MFA) functionality.
 """
 from flask import Blueprint, request, jsonify, current_app
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from app.firebase import get_firestore
 from app.utils.mfa_utils import (
-    generate_totp_qr_code, verify_totp, create_mfa_session
+    generate_totp_qr_code, verify_totp, create_mfa_session, issue_mfa_grant
 )
 from app.utils.security_utils import log_audit_event
+from app.utils.firestore_cache import document_cache
 from app.models import encrypt_data, decrypt_data
 
 # Blueprint registration
@@ -47,7 +48,7 @@ def setup_mfa():
             
         db = get_firestore_client()
         user_ref = db.collection('users').document(current_user_id)
-        user_doc = user_ref.get()
+        user_doc = document_cache.get(user_ref)
         
         if not user_doc.exists:
             print("User not found")
@@ -67,7 +68,7 @@ def setup_mfa():
         qr_code = generate_totp_qr_code(uri)
 
         # Update but don't enable MFA yet (requires verification)
-        user_ref.update({
+        document_cache.update(user_ref, {
             'mfa_secret': encrypt_data(secret),
             'mfa_enabled': False,
             'mfa_verified': False
@@ -117,7 +118,7 @@ def setup_mfa_for_new_user():
         # This is a simplified approach - production systems should use a more secure method
         db = get_firestore_client()
         user_ref = db.collection('users').document(user_id)
-        user_doc = user_ref.get()
+        user_doc = document_cache.get(user_ref)
         
         if not user_doc.exists:
             print(f"User not found: {user_id}")
@@ -137,7 +138,7 @@ def setup_mfa_for_new_user():
         qr_code = generate_totp_qr_code(uri)
 
         # Update but don't enable MFA yet (requires verification)
-        user_ref.update({
+        document_cache.update(user_ref, {
             'mfa_secret': encrypt_data(secret),
             'mfa_enabled': False,
             'mfa_verified': False
@@ -179,7 +180,7 @@ def verify_mfa_setup():
     current_user_id = get_jwt_identity()
     db = get_firestore_client()
     user_ref = db.collection('users').document(current_user_id)
-    user_doc = user_ref.get()
+    user_doc = document_cache.get(user_ref)
     
     if not user_doc.exists:
         return jsonify({"error": "User not found"}), 404
@@ -222,7 +223,7 @@ def verify_mfa_setup():
         updates['mfa_backup_codes'] = [{'code': code, 'used': False} for code in codes]
     
     # Save changes
-    user_ref.update(updates)
+    document_cache.update(user_ref, updates)
     
     # Log the successful setup
     log_audit_event(
@@ -260,7 +261,7 @@ def disable_mfa():
     current_user_id = get_jwt_identity()
     db = get_firestore_client()
     user_ref = db.collection('users').document(current_user_id)
-    user_doc = user_ref.get()
+    user_doc = document_cache.get(user_ref)
     
     if not user_doc.exists:
         return jsonify({"error": "User not found"}), 404
@@ -296,7 +297,7 @@ def disable_mfa():
         }), 403
     
     # Disable MFA
-    user_ref.update({
+    document_cache.update(user_ref, {
         'mfa_enabled': False,
         'mfa_verified': False,
         'mfa_secret': None,
@@ -322,7 +323,9 @@ def verify_mfa_token():
     """
     Verify a TOTP token for MFA and create a session.
     
-    This endpoint is used during the login flow when MFA is enabled.
+    This endpoint is used during the login flow when MFA is enabled. The
+    response also carries an MFA grant (body and X-MFA-GRANT header) to
+    send as X-MFA-GRANT to MFA-protected endpoints.
     """
     data = request.get_json()
     if not data or 'token' not in data:
@@ -331,7 +334,7 @@ def verify_mfa_token():
     current_user_id = get_jwt_identity()
     db = get_firestore_client()
     user_ref = db.collection('users').document(current_user_id)
-    user_doc = user_ref.get()
+    user_doc = document_cache.get(user_ref)
     
     if not user_doc.exists:
         return jsonify({"error": "User not found"}), 404
@@ -362,7 +365,7 @@ def verify_mfa_token():
                 verified = True
                 # Mark backup code as used
                 code['used'] = True
-                user_ref.update({'mfa_backup_codes': backup_codes})
+                document_cache.update(user_ref, {'mfa_backup_codes': backup_codes})
                 break
     
     if not verified:
@@ -379,6 +382,9 @@ def verify_mfa_token():
     # Create MFA session
     mfa_token = create_mfa_session(current_user_id)
     
+    # Step-up grant for MFA-protected endpoints, bound to this access token
+    mfa_grant = issue_mfa_grant(current_user_id, get_jwt().get('jti'))
+    
     # Log successful verification
     log_audit_event(
         user_id=current_user_id,
@@ -388,11 +394,15 @@ def verify_mfa_token():
         details={"token_type": token_type}
     )
     
-    return jsonify({
+    response = jsonify({
         "success": True,
         "mfa_token": mfa_token,
+        "mfa_grant": mfa_grant,
         "message": "MFA verification successful"
-    }), 200
+    })
+    if mfa_grant:
+        response.headers['X-MFA-GRANT'] = mfa_grant
+    return response, 200
 
 @mfa_bp.route('/status', methods=['GET'])
 @jwt_required()
@@ -401,7 +411,7 @@ def mfa_status():
     current_user_id = get_jwt_identity()
     db = get_firestore_client()
     user_ref = db.collection('users').document(current_user_id)
-    user_doc = user_ref.get()
+    user_doc = document_cache.get(user_ref)
     
     if not user_doc.exists:
         return jsonify({"error": "User not found"}), 404
@@ -4,6 +4,7 @@ from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from app.firebase import get_firestore
 from app.utils.auth_utils import validate_password, role_required
 from app.utils.security_utils import log_audit_event, require_mfa
+from app.utils.firestore_cache import document_cache
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -20,7 +21,7 @@ def dashboard():
     
     try:
         # Get user document
-        user_doc = db.collection('users').document(current_user_id).get()
+        user_doc = document_cache.get(db.collection('users').document(current_user_id), shared=True)
         if not user_doc.exists:
             return jsonify({"error": "User not found"}), 404
         
@@ -62,7 +63,7 @@ def update_profile():
     try:
         # Get user document
         user_ref = db.collection('users').document(current_user_id)
-        user_doc = user_ref.get()
+        user_doc = document_cache.get(user_ref)
         if not user_doc.exists:
             return jsonify({"error": "User not found"}), 404
         
@@ -154,7 +155,7 @@ def update_profile():
             )
         
         # Update user document
-        user_ref.update(update_data)
+        document_cache.update(user_ref, update_data)
         
         log_audit_event(
             action="profile_updated",
@@ -162,8 +163,8 @@ def update_profile():
             status="success"
         )
         
-        # Get updated user data
-        updated_user = user_ref.get().to_dict()
+        # The stored document is the one read above plus our changes
+        updated_user = {**user_data, **update_data}
         return jsonify({"message": "Profile updated successfully", "user": updated_user}), 200
     
     except Exception as e:
@@ -220,7 +221,7 @@ def get_user(user_id):
         return jsonify({"error": "Unauthorized access"}), 403
     
     try:
-        user_doc = db.collection('users').document(user_id).get()
+        user_doc = document_cache.get(db.collection('users').document(user_id), shared=True)
         if not user_doc.exists:
             return jsonify({"error": "User not found"}), 404
         
@@ -4,6 +4,7 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from app.firebase import get_firestore
 from app.utils.auth_utils import role_required
+from app.utils.firestore_cache import document_cache
 from app.utils.verification_utils import simulate_ai_verification
 from app.models import create_verification_profile_document
 
@@ -198,7 +199,7 @@ def get_verification_profile(profile_id):
         
         # Get user data
         user_ref = db.collection('users').document(profile_data['user_id'])
-        user_doc = user_ref.get()
+        user_doc = document_cache.get(user_ref, shared=True)
         
         response_data = profile_data
         response_data['user'] = user_doc.to_dict() if user_doc.exists else None
@@ -1,10 +1,11 @@
 import re
 import logging
 from functools import wraps
-from flask import jsonify, current_app
-from flask_jwt_extended import get_jwt
+from flask import jsonify, current_app, g
+from flask_jwt_extended import get_jwt, get_jwt_identity
 from datetime import datetime, timedelta
 from app.firebase import get_firestore
+from app.utils.firestore_cache import document_cache
 from werkzeug.security import generate_password_hash, check_password_hash
 import jwt
 import bcrypt
@@ -65,38 +66,75 @@ def validate_username(username):
     username_pattern = r'^[a-zA-Z0-9_]{3,64}$'
     return bool(re.match(username_pattern, username))
 
+def get_auth_context():
+    """
+    Authenticated identity of the current request, resolved once.
+    
+    The access token is decoded, checked against the blocklist and turned
+    into an identity and role the first time this is called in a request;
+    later calls (and every auth decorator) read the result from ``g``. When
+    ``@jwt_required()`` has already verified the token its claims are
+    reused instead of verifying again.
+    
+    Returns:
+        dict: {"identity", "role", "jti", "claims"}
+    
+    Raises:
+        flask_jwt_extended / PyJWT exceptions if the request carries no
+        valid, unrevoked access token
+    """
+    context = g.get('auth_context')
+    if context is not None:
+        return context
+    
+    from flask_jwt_extended import verify_jwt_in_request
+    
+    try:
+        claims = get_jwt()
+    except RuntimeError:
+        claims = None
+    if not claims:
+        # No decorator has verified the token yet: verify it once, here
+        verify_jwt_in_request()
+        claims = get_jwt()
+    
+    context = {
+        "identity": get_jwt_identity(),
+        "role": claims.get('role', 'user'),
+        "jti": claims.get('jti'),
+        "claims": claims
+    }
+    g.auth_context = context
+    return context
+
 def role_required(required_roles):
     """
     Decorator to check if user has required role.
     
+    Reads the request's auth context, so stacking it under
+    ``@jwt_required()`` does not verify the token a second time.
+    
     Args:
         required_roles: String or list of strings representing required roles
     """
+    # Convert required_roles to list if it's a string
+    roles = [required_roles] if isinstance(required_roles, str) else required_roles
+    
     def decorator(fn):
         @wraps(fn)
         def wrapper(*args, **kwargs):
-            from flask_jwt_extended import verify_jwt_in_request
-            
-            # First verify the JWT is present and valid
             try:
-                verify_jwt_in_request()
-                
-                # Now it's safe to get the claims
-                claims = get_jwt()
-                user_role = claims.get('role', 'user')
-                
-                # Convert required_roles to list if it's a string
-                roles = [required_roles] if isinstance(required_roles, str) else required_roles
-                
-                # Check if user has required role
-                if user_role not in roles:
-                    logger.warning(f"Role access denied. User role: {user_role}, Required roles: {roles}")
-                    return jsonify({"error": "Insufficient permissions"}), 403
-                
-                return fn(*args, **kwargs)
+                user_role = get_auth_context()["role"]
             except Exception as e:
                 logger.error(f"JWT verification error: {str(e)}")
                 return jsonify({"error": "Authentication required"}), 401
+            
+            # Check if user has required role
+            if user_role not in roles:
+                logger.warning(f"Role access denied. User role: {user_role}, Required roles: {roles}")
+                return jsonify({"error": "Insufficient permissions"}), 403
+            
+            return fn(*args, **kwargs)
                 
         return wrapper
     return decorator
@@ -333,14 +371,14 @@ def login_user(data):
             if not password_valid:
                 # Increment login attempts
                 login_attempts = user_data.get('login_attempts', 0) + 1
-                user_doc.reference.update({
+                document_cache.update(user_doc.reference, {
                     'login_attempts': login_attempts,
                     'last_login_attempt': datetime.utcnow()
                 })
                 
                 # Lock account if too many attempts
                 if login_attempts >= MAX_LOGIN_ATTEMPTS:
-                    user_doc.reference.update({
+                    document_cache.update(user_doc.reference, {
                         'account_locked_until': datetime.utcnow() + LOCKOUT_DURATION
                     })
                     logger.warning(f"Account locked due to too many failed attempts: {data['email']}")
@@ -356,7 +394,7 @@ def login_user(data):
                 'login_attempts': 0,
                 'last_login': datetime.utcnow()
             }
-            user_doc.reference.update(update_data)
+            document_cache.update(user_doc.reference, update_data)
             logger.debug(f"Login attempts reset for user: {data['email']}")
             
             # Check if MFA is required
@@ -436,7 +474,7 @@ def get_user_info(user_id):
     """
     try:
         db = get_firestore()
-        user_doc = db.collection('users').document(user_id).get()
+        user_doc = document_cache.get(db.collection('users').document(user_id), shared=True)
         
         if not user_doc.exists:
             return {"error": "User not found"}, 404
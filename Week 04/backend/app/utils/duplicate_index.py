@@ -0,0 +1,274 @@
+"""
+Perceptual-hash index of verified documents, for near-duplicate lookups.
+
+Every document that passes verification is recorded with its 64-bit
+perceptual hash (see compute_perceptual_hash), the SHA-256 of its bytes,
+its document type, the account that uploaded it and a digest of the ID
+number OCR read from it. A new upload is then matched against all of them
+by Hamming distance, which finds re-photographed or re-compressed copies
+that an exact hash misses.
+
+Lookups use multi-index hashing: the hash is split into four 16-bit chunks
+and, by the pigeonhole principle, any entry within distance d agrees with
+the query to within d // 4 bits in at least one chunk. Each chunk has a
+bucket table over all entries, so a lookup probes a handful of buckets and
+checks only their members instead of scanning the index. Entries live in
+flat NumPy arrays (about 60 bytes each) so millions fit in memory.
+
+At 64 bits the hash describes the layout of a document more than its
+printed details: another card of the same template is often only 0-2 bits
+from a re-photo of the first one. A hash match alone therefore says little
+and is never used to reuse a verification result. Matches are compared on
+their ID number digest as well (see id_number_key): only a match with the
+same ID number is the same document, and one with a different ID number is
+a different document of the same template.
+
+New entries are scanned linearly until REBUILD_AFTER of them accumulate;
+the bucket tables are then rebuilt on a background thread.
+"""
+import time
+import hashlib
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+HASH_CHUNKS = 4
+CHUNK_BITS = HASH_BITS // HASH_CHUNKS
+
+# Entries appended since the last rebuild, scanned linearly by every lookup
+REBUILD_AFTER = 4096
+
+_POPCOUNT_8 = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+_POPCOUNT_16 = (_POPCOUNT_8[np.arange(1 << CHUNK_BITS) >> 8]
+                + _POPCOUNT_8[np.arange(1 << CHUNK_BITS) & 0xFF])
+
+
+def hamming_distances(hashes, value):
+    """
+    Hamming distance from value to every hash.
+
+    Args:
+        hashes (numpy.ndarray): uint64 hashes
+        value (int): 64-bit hash
+
+    Returns:
+        numpy.ndarray: Distance per hash
+    """
+    differing = np.ascontiguousarray(np.bitwise_xor(hashes, np.uint64(value)))
+    return _POPCOUNT_8[differing.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def id_number_key(id_number):
+    """
+    64-bit digest of an OCR'd ID number, so the index never holds the number itself.
+
+    Args:
+        id_number (str): ID number as read from the document, or None
+
+    Returns:
+        int: Digest of the number's letters and digits, 0 if there is none
+    """
+    normalized = ''.join(character for character in (id_number or '') if character.isalnum()).upper()
+    if not normalized:
+        return 0
+    return int.from_bytes(hashlib.sha256(normalized.encode()).digest()[:8], 'big') or 1
+
+
+def _chunk(hashes, index):
+    # uint16 so argsort can use radix sort
+    return ((hashes >> np.uint64(index * CHUNK_BITS)) & np.uint64((1 << CHUNK_BITS) - 1)).astype(np.uint16)
+
+
+class PerceptualHashIndex:
+    """In-memory multi-index hash table of verified documents."""
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.max_distance = 6
+        self.max_entries = 2000000
+        self._hashes = np.zeros(1024, dtype=np.uint64)
+        self._digests = np.zeros((1024, 32), dtype=np.uint8)  # Raw SHA-256
+        self._owners = np.zeros(1024, dtype=np.uint32)
+        self._types = np.zeros(1024, dtype=np.uint8)
+        self._id_keys = np.zeros(1024, dtype=np.uint64)  # id_number_key, 0 if unknown
+        self._count = 0
+        self._owner_ids = []  # Interned account IDs, entries hold their position
+        self._owner_codes = {}
+        self._type_names = []
+        self._type_codes = {}
+        self._indexed = 0  # Entries covered by the bucket tables
+        self._offsets = None  # Per chunk: bucket start positions into _positions
+        self._positions = None  # Per chunk: entry positions grouped by chunk value
+        self._generation = 0  # Bumped when entries move, invalidating running rebuilds
+        self._rebuilding = False
+        self._masks = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize the index with a Flask application."""
+        self.enabled = app.config.get('DUPLICATE_INDEX_ENABLED', True)
+        self.max_distance = app.config.get('DUPLICATE_MAX_DISTANCE', 6)
+        self.max_entries = app.config.get('DUPLICATE_INDEX_MAX_ENTRIES', 2000000)
+        app.extensions['perceptual_hash_index'] = self
+
+    def __len__(self):
+        return self._count
+
+    def add(self, perceptual_hash, document_hash, document_type, owner_id, id_number=None):
+        """
+        Record a verified document.
+
+        Args:
+            perceptual_hash (int): 64-bit perceptual hash of the image
+            document_hash (str): Hex SHA-256 of the raw image bytes
+            document_type (str): Document type it was verified as
+            owner_id (str): Account that uploaded it
+            id_number (str, optional): ID number OCR read from it (only its digest is kept)
+        """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            if self._count >= self.max_entries:
+                self._drop_oldest(max(1, self.max_entries // 4))
+            if self._count == len(self._hashes):
+                self._grow()
+
+            position = self._count
+            self._hashes[position] = perceptual_hash
+            self._digests[position] = np.frombuffer(bytes.fromhex(document_hash), dtype=np.uint8)
+            self._owners[position] = self._intern(self._owner_ids, self._owner_codes, owner_id)
+            self._types[position] = self._intern(self._type_names, self._type_codes, document_type)
+            self._id_keys[position] = id_number_key(id_number)
+            self._count += 1
+
+            rebuild = self._count - self._indexed >= REBUILD_AFTER and not self._rebuilding
+            if rebuild:
+                self._rebuilding = True
+                generation = self._generation
+                snapshot = self._hashes[:self._count].copy()
+
+        if rebuild:
+            threading.Thread(target=self._rebuild, args=(snapshot, generation),
+                             name='perceptual-index-rebuild', daemon=True).start()
+
+    def lookup(self, perceptual_hash, max_distance=None, limit=10):
+        """
+        Find recorded documents within a Hamming distance of a hash.
+
+        Args:
+            perceptual_hash (int): 64-bit perceptual hash to match
+            max_distance (int, optional): Largest distance to return; defaults
+                to DUPLICATE_MAX_DISTANCE
+            limit (int): Maximum number of matches
+
+        Returns:
+            list: Matches, closest first, as dicts with document_hash,
+                document_type, owner_id, distance and id_key (id_number_key
+                of the matched document, 0 if unknown)
+        """
+        if not self.enabled:
+            return []
+        if max_distance is None:
+            max_distance = self.max_distance
+
+        with self._lock:
+            if not self._count:
+                return []
+
+            candidates = [np.arange(self._indexed, self._count)]
+            if self._indexed:
+                masks = self._chunk_masks(max_distance // HASH_CHUNKS)
+                for index in range(HASH_CHUNKS):
+                    buckets = (((perceptual_hash >> (index * CHUNK_BITS)) & ((1 << CHUNK_BITS) - 1)) ^ masks)
+                    starts = self._offsets[index, buckets]
+                    ends = self._offsets[index, buckets + 1]
+                    positions = self._positions[index]
+                    for start, end in zip(starts[starts < ends], ends[starts < ends]):
+                        candidates.append(positions[start:end])
+
+            candidates = np.unique(np.concatenate(candidates)).astype(np.int64)
+            distances = hamming_distances(self._hashes[candidates], perceptual_hash)
+            close = distances <= max_distance
+            candidates, distances = candidates[close], distances[close]
+            order = np.argsort(distances, kind='stable')[:limit]
+
+            return [
+                {
+                    "document_hash": self._digests[position].tobytes().hex(),
+                    "document_type": self._type_names[self._types[position]],
+                    "owner_id": self._owner_ids[self._owners[position]],
+                    "distance": int(distance),
+                    "id_key": int(self._id_keys[position])
+                }
+                for position, distance in zip(candidates[order], distances[order])
+            ]
+
+    def _chunk_masks(self, radius):
+        """All chunk values with at most radius bits set."""
+        masks = self._masks.get(radius)
+        if masks is None:
+            masks = np.flatnonzero(_POPCOUNT_16 <= radius)
+            self._masks[radius] = masks
+        return masks
+
+    @staticmethod
+    def _intern(names, codes, name):
+        code = codes.get(name)
+        if code is None:
+            code = codes[name] = len(names)
+            names.append(name)
+        return code
+
+    def _grow(self):
+        """Double the entry arrays. Caller holds the lock."""
+        capacity = min(len(self._hashes) * 2, max(self.max_entries, len(self._hashes)))
+        for name in ('_hashes', '_digests', '_owners', '_types', '_id_keys'):
+            current = getattr(self, name)
+            grown = np.zeros((capacity,) + current.shape[1:], dtype=current.dtype)
+            grown[:self._count] = current[:self._count]
+            setattr(self, name, grown)
+
+    def _drop_oldest(self, count):
+        """Forget the count oldest entries. Caller holds the lock."""
+        remaining = self._count - count
+        for name in ('_hashes', '_digests', '_owners', '_types', '_id_keys'):
+            entries = getattr(self, name)
+            entries[:remaining] = entries[count:self._count]
+        self._count = remaining
+        # Positions have moved: everything is scanned linearly until the next rebuild
+        self._indexed = 0
+        self._offsets = self._positions = None
+        self._generation += 1
+        logger.info(f"Perceptual hash index full, dropped the {count} oldest entries")
+
+    def _rebuild(self, hashes, generation):
+        """Build bucket tables for a snapshot of the hashes and install them."""
+        start = time.perf_counter()
+        try:
+            offsets = np.zeros((HASH_CHUNKS, (1 << CHUNK_BITS) + 1), dtype=np.int64)
+            positions = np.empty((HASH_CHUNKS, len(hashes)), dtype=np.uint32)
+            for index in range(HASH_CHUNKS):
+                chunk = _chunk(hashes, index)
+                positions[index] = np.argsort(chunk, kind='stable')
+                np.cumsum(np.bincount(chunk, minlength=1 << CHUNK_BITS), out=offsets[index, 1:])
+
+            with self._lock:
+                if generation == self._generation:
+                    self._offsets, self._positions = offsets, positions
+                    self._indexed = len(hashes)
+        finally:
+            with self._lock:
+                self._rebuilding = False
+        logger.debug(f"Rebuilt perceptual hash index over {len(hashes)} entries "
+                     f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+# Shared index, initialized in create_app
+perceptual_hash_index = PerceptualHashIndex()
@@ -0,0 +1,139 @@
+"""
+Read caching for Firestore documents.
+
+Two tiers:
+
+- a request-scoped identity map on ``flask.g``, keyed by document path:
+  decorators and the route handler that read the same document in one
+  request share a single read
+- an optional process-level cache for user documents (USER_CACHE_TTL
+  seconds, 0 disables it) used by reads that pass ``shared=True``. It is
+  only invalidated by writes made in this process, so other processes may
+  see a change up to USER_CACHE_TTL seconds late. Only display reads may
+  use it; authentication and MFA checks (is_active, mfa_enabled,
+  mfa_secret, backup codes) must read through the request tier only
+
+Writes made through the app go through update/set/delete here, which drop
+the document from both tiers. Snapshots are immutable (``to_dict()``
+returns a copy), so cached ones can be handed to several callers.
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from flask import g, has_app_context
+
+logger = logging.getLogger(__name__)
+
+# Collections whose documents the process-level tier may hold
+SHARED_COLLECTIONS = ('users',)
+
+
+class DocumentCache:
+    """Request identity map plus optional short-lived process cache."""
+
+    def __init__(self, app=None):
+        self.ttl = 0
+        self.max_entries = 10000
+        self._entries = OrderedDict()  # path -> (stored_at, snapshot)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize the cache with a Flask application."""
+        self.ttl = app.config.get('USER_CACHE_TTL', 0)
+        self.max_entries = app.config.get('USER_CACHE_MAX_ENTRIES', 10000)
+        app.extensions['document_cache'] = self
+
+    def get(self, ref, shared=False):
+        """
+        Read a document, at most once per request.
+
+        Args:
+            ref: Firestore DocumentReference
+            shared (bool): Also use the process-level cache, for display
+                reads that tolerate data up to USER_CACHE_TTL seconds old.
+                Never for security decisions
+
+        Returns:
+            DocumentSnapshot: The document (check ``.exists``)
+        """
+        documents = self._request_documents()
+        path = ref.path
+        if documents is not None and path in documents:
+            return documents[path]
+
+        use_shared = shared and self.ttl > 0 and self._shareable(path)
+        snapshot = self._get_shared(path) if use_shared else None
+        if snapshot is None:
+            snapshot = ref.get()
+            if use_shared and snapshot.exists:
+                self._put_shared(path, snapshot)
+
+        if documents is not None:
+            documents[path] = snapshot
+        return snapshot
+
+    def update(self, ref, data):
+        """Update a document and drop it from the cache."""
+        ref.update(data)
+        self.invalidate(ref)
+
+    def set(self, ref, data, merge=False):
+        """Write a document and drop it from the cache."""
+        ref.set(data, merge=merge)
+        self.invalidate(ref)
+
+    def delete(self, ref):
+        """Delete a document and drop it from the cache."""
+        ref.delete()
+        self.invalidate(ref)
+
+    def invalidate(self, ref):
+        """Forget a document in this request and in the process cache."""
+        path = ref.path
+        documents = self._request_documents()
+        if documents is not None:
+            documents.pop(path, None)
+        with self._lock:
+            self._entries.pop(path, None)
+
+    @staticmethod
+    def _request_documents():
+        """The current request's identity map, or None outside an app context."""
+        if not has_app_context():
+            return None
+        documents = g.get('firestore_documents')
+        if documents is None:
+            documents = g.firestore_documents = {}
+        return documents
+
+    @staticmethod
+    def _shareable(path):
+        collection, _, document_id = path.partition('/')
+        return collection in SHARED_COLLECTIONS and '/' not in document_id
+
+    def _get_shared(self, path):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return None
+            stored_at, snapshot = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[path]
+                return None
+            self._entries.move_to_end(path)
+            return snapshot
+
+    def _put_shared(self, path, snapshot):
+        with self._lock:
+            self._entries[path] = (time.monotonic(), snapshot)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+# Shared cache, initialized in create_app
+document_cache = DocumentCache()
@@ -5,10 +5,12 @@ import io
 import base64
 import secrets
 from datetime import datetime, timedelta
+import jwt
 import pyotp
 import qrcode
 from flask import current_app
 from app.firebase import get_firestore
+from app.utils.firestore_cache import document_cache
 
 def generate_totp_secret():
     """Generate a new TOTP secret."""
@@ -50,7 +52,7 @@ def generate_totp_qr_code(uri):
 def is_valid_backup_code(user_id, code):
     """Check if a backup code is valid for a user."""
     db = get_firestore()
-    user_doc = db.collection('users').document(user_id).get()
+    user_doc = document_cache.get(db.collection('users').document(user_id))
     if not user_doc.exists:
         return False
         
@@ -63,7 +65,7 @@ def is_valid_backup_code(user_id, code):
             # Mark code as used
             backup_codes.remove(backup_code)
             backup_codes.append({'code': code, 'used': True})
-            user_doc.reference.update({'backup_codes': backup_codes})
+            document_cache.update(user_doc.reference, {'backup_codes': backup_codes})
             return True
             
     return False
@@ -132,6 +134,63 @@ def create_mfa_session(user_id):
     db.collection('mfa_sessions').add(session_data)
     return session_data['token']  # Return just the token, not the entire session data
 
+# Audience of MFA grants, so they can never be used as access tokens
+MFA_GRANT_AUDIENCE = 'mfa-grant'
+
+def issue_mfa_grant(user_id, access_jti):
+    """
+    Create a step-up MFA grant after a successful TOTP or backup code check.
+    
+    The grant is a short-lived JWT signed with JWT_SECRET_KEY and bound to
+    the access token it was issued for, so require_mfa can accept it
+    without reading the user or verifying TOTP again. It is valid for
+    MFA_GRANT_FRESHNESS seconds or until that access token stops working.
+    
+    Args:
+        user_id: User who passed MFA
+        access_jti: JTI of the access token used for the MFA check
+        
+    Returns:
+        Encoded grant, or None if grants are disabled (MFA_GRANT_FRESHNESS 0)
+    """
+    freshness = current_app.config.get('MFA_GRANT_FRESHNESS', 900)
+    if not freshness or not access_jti:
+        return None
+    
+    now = datetime.utcnow()
+    return jwt.encode(
+        {
+            'sub': user_id,
+            'access_jti': access_jti,
+            'aud': MFA_GRANT_AUDIENCE,
+            'iat': now,
+            'exp': now + timedelta(seconds=freshness)
+        },
+        current_app.config['JWT_SECRET_KEY'],
+        algorithm=current_app.config.get('JWT_ALGORITHM', 'HS256')
+    )
+
+def verify_mfa_grant(grant, user_id, access_jti):
+    """
+    Check an MFA grant locally (signature, expiry and binding).
+    
+    Returns:
+        True if the grant was issued for this user and access token and is
+        still fresh
+    """
+    if not grant or not access_jti:
+        return False
+    try:
+        claims = jwt.decode(
+            grant,
+            current_app.config['JWT_SECRET_KEY'],
+            algorithms=[current_app.config.get('JWT_ALGORITHM', 'HS256')],
+            audience=MFA_GRANT_AUDIENCE
+        )
+    except jwt.InvalidTokenError:
+        return False
+    return claims.get('sub') == user_id and claims.get('access_jti') == access_jti
+
 def verify_mfa_session(token):
     """Verify an MFA session token."""
     if not token:
@@ -3,9 +3,12 @@ Security middleware for Flask application.
 """
 import uuid
 from functools import wraps
-from flask import g, request, current_app, jsonify
-import jwt
+from flask import g, request, current_app, jsonify, Request
+from jwt import ExpiredSignatureError
+from flask_jwt_extended.exceptions import NoAuthorizationError, RevokedTokenError
 from app.firebase import db
+from app.utils.auth_utils import get_auth_context
+from app.utils.firestore_cache import document_cache
 
 class SecurityMiddleware:
     """
@@ -28,6 +31,7 @@ class SecurityMiddleware:
     
     def init_app(self, app):
         """Initialize the middleware with a Flask application."""
+        app.request_class = LimitedRequest
         app.before_request(self.before_request)
         app.after_request(self.after_request)
     
@@ -74,6 +78,38 @@ class SecurityMiddleware:
         return response
 
 
+class LimitedRequest(Request):
+    """
+    Request whose body limit can be raised for a single view.
+    
+    The limit is MAX_CONTENT_LENGTH unless the matched view was decorated
+    with @max_content_length. Werkzeug enforces it while reading the body,
+    with or without a Content-Length, and raises 413 once it is exceeded.
+    """
+    
+    @property
+    def max_content_length(self):
+        view = current_app.view_functions.get(self.endpoint) if self.url_rule else None
+        config_key = getattr(view, 'max_content_length_config', None) or 'MAX_CONTENT_LENGTH'
+        return current_app.config.get(config_key)
+
+
+def max_content_length(config_key):
+    """
+    Decorator that sets a view's request body limit from another config key.
+    
+    Must be the outermost decorator under the route, as the limit is looked
+    up on the registered view function.
+    
+    Args:
+        config_key (str): Config key holding the limit in bytes
+    """
+    def decorator(f):
+        f.max_content_length_config = config_key
+        return f
+    return decorator
+
+
 def rate_limit(limit=100, per=60):
     """
     Rate limiting decorator for API endpoints.
@@ -100,45 +136,33 @@ def rate_limit(limit=100, per=60):
 def token_required(f):
     """
     Decorator to protect routes that require authentication.
-    Verifies the JWT token in the Authorization header and
-    attaches the current user to the request.
+    Verifies the JWT token in the Authorization header (once per request,
+    through the shared auth context) and attaches the current user to the
+    request.
     """
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
-        
-        # Get token from Authorization header
-        auth_header = request.headers.get('Authorization')
-        if auth_header and auth_header.startswith('Bearer '):
-            token = auth_header.split(' ')[1]
-        
-        if not token:
-            return jsonify({'message': 'Authorization token is missing'}), 401
-            
         try:
-            # Decode the token using the secret key
-            payload = jwt.decode(
-                token, 
-                current_app.config['SECRET_KEY'],
-                algorithms=['HS256']
-            )
-            
-            # Get the user from Firebase
-            user_ref = db.collection('users').document(payload['uid'])
-            user_doc = user_ref.get()
-            
-            if not user_doc.exists:
-                return jsonify({'message': 'User not found'}), 401
-                
-            current_user = user_doc.to_dict()
-            current_user['uid'] = user_doc.id
-            
-        except jwt.ExpiredSignatureError:
+            auth = get_auth_context()
+        except NoAuthorizationError:
+            return jsonify({'message': 'Authorization token is missing'}), 401
+        except ExpiredSignatureError:
             return jsonify({'message': 'Token has expired'}), 401
-        except jwt.InvalidTokenError:
+        except RevokedTokenError:
+            return jsonify({'message': 'Token has been revoked'}), 401
+        except Exception:
             return jsonify({'message': 'Invalid token'}), 401
         
+        # Get the user from Firebase; never from the process cache, is_active must be current
+        user_doc = document_cache.get(db.collection('users').document(auth['identity']))
+        
+        if not user_doc.exists:
+            return jsonify({'message': 'User not found'}), 401
+            
+        current_user = user_doc.to_dict()
+        current_user['uid'] = user_doc.id
+        
         # Pass the current_user to the route function
         return f(current_user=current_user, *args, **kwargs)
         
-    return decorated
\ No newline at end of file
+    return decorated
@@ -0,0 +1,174 @@
+"""
+Content-addressed cache of document verification results.
+
+Results are keyed by the SHA-256 of the uploaded image bytes together with
+the document type and the verification pipeline version, so a retried or
+re-submitted upload is answered without running OCR again. Only the JSON
+verification result is cached, never the image.
+
+The memory tier is an LRU bounded by the serialized size of its entries.
+An optional on-disk tier (VERIFICATION_CACHE_DIR) survives restarts and is
+shared by every worker process on the host.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class VerificationResultCache:
+    """Two-tier (memory LRU + optional disk) verification result cache."""
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.max_bytes = 0
+        self.ttl = 0
+        self.disk_dir = None
+        self._entries = OrderedDict()  # key -> (stored_at, serialized result)
+        self._size = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize the cache with a Flask application."""
+        self.enabled = app.config.get('VERIFICATION_CACHE_ENABLED', True)
+        self.max_bytes = app.config.get('VERIFICATION_CACHE_MAX_BYTES', 16 * 1024 * 1024)
+        self.ttl = app.config.get('VERIFICATION_CACHE_TTL', 86400)
+        self.disk_dir = app.config.get('VERIFICATION_CACHE_DIR')
+        if self.enabled and self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+        app.extensions['verification_result_cache'] = self
+
+    @staticmethod
+    def make_key(document_hash, document_type, pipeline_version, variant=''):
+        """
+        Build the cache key for a document.
+
+        Args:
+            document_hash (str): SHA-256 of the raw image bytes
+            document_type (str): Document type the result was computed for
+            pipeline_version (str): Verification pipeline version
+            variant (str): Extra discriminator for options that change the result
+
+        Returns:
+            str: Cache key
+        """
+        return f"{pipeline_version}:{document_type}:{variant}:{document_hash}"
+
+    def get(self, key):
+        """
+        Look up a cached result.
+
+        Args:
+            key (str): Key from make_key
+
+        Returns:
+            dict: A fresh copy of the cached result, or None on a miss
+        """
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, serialized = entry
+                if now - stored_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    return json.loads(serialized)
+                self._evict(key)
+
+        serialized, stored_at = self._read_disk(key, now)
+        if serialized is None:
+            return None
+
+        # Promote disk hits into memory
+        self._store_memory(key, serialized, stored_at)
+        return json.loads(serialized)
+
+    def put(self, key, result):
+        """
+        Cache a verification result.
+
+        Args:
+            key (str): Key from make_key
+            result (dict): JSON-serializable verification result without image data
+        """
+        if not self.enabled:
+            return
+
+        try:
+            serialized = json.dumps(result)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Verification result not cacheable: {e}")
+            return
+
+        stored_at = time.time()
+        self._store_memory(key, serialized, stored_at)
+        self._write_disk(key, serialized, stored_at)
+
+    def _store_memory(self, key, serialized, stored_at):
+        size = len(serialized)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+            self._entries[key] = (stored_at, serialized)
+            self._size += size
+            # Evict least recently used entries until we are back under budget
+            while self._size > self.max_bytes:
+                self._evict(next(iter(self._entries)))
+
+    def _evict(self, key):
+        """Remove a memory entry. Caller holds the lock."""
+        _, serialized = self._entries.pop(key)
+        self._size -= len(serialized)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, hashlib.sha256(key.encode()).hexdigest() + '.json')
+
+    def _read_disk(self, key, now):
+        if not self.disk_dir:
+            return None, None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r') as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            return None, None
+        except Exception as e:
+            logger.warning(f"Unreadable verification cache entry {path}: {e}")
+            return None, None
+
+        if record.get('key') != key or now - record.get('stored_at', 0) > self.ttl:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None, None
+        return record['result'], record['stored_at']
+
+    def _write_disk(self, key, serialized, stored_at):
+        if not self.disk_dir:
+            return
+        record = json.dumps({'key': key, 'stored_at': stored_at, 'result': serialized})
+        try:
+            # Write then rename so concurrent readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                f.write(record)
+            os.replace(tmp_path, self._disk_path(key))
+        except Exception as e:
+            logger.warning(f"Failed to write verification cache entry: {e}")
+
+
+# Shared cache, initialized in create_app
+verification_result_cache = VerificationResultCache()
@@ -6,6 +6,7 @@ import json
 from datetime import datetime
 from flask import request, current_app, g
 from app.firebase import get_firestore
+from app.utils.firestore_cache import document_cache
 
 def log_audit_event(action, user_id=None, resource_type=None, resource_id=None,
                     details=None, status="success"):
@@ -98,19 +99,32 @@ def require_mfa(view_function):
     """
     Decorator to require MFA verification for sensitive endpoints.
     
+    A valid X-MFA-GRANT header (see issue_mfa_grant) is checked locally and
+    lets the request through without any I/O. Otherwise an X-MFA-TOKEN
+    TOTP code is verified against the user's secret, and the response
+    carries a fresh grant in its X-MFA-GRANT header for the following calls.
+    
     This should be used after the jwt_required decorator.
     """
     from functools import wraps
-    from flask_jwt_extended import get_jwt_identity
+    from flask import make_response
+    from app.utils.auth_utils import get_auth_context
+    from app.utils.mfa_utils import issue_mfa_grant, verify_mfa_grant
     
     @wraps(view_function)
     def decorated(*args, **kwargs):
-        # Get current user from JWT
-        current_user_id = get_jwt_identity()
+        # Get current user from the request's auth context
+        auth = get_auth_context()
+        current_user_id = auth["identity"]
+        
+        # A grant from an earlier MFA check on this access token needs no I/O
+        if verify_mfa_grant(request.headers.get('X-MFA-GRANT'), current_user_id, auth["jti"]):
+            return view_function(*args, **kwargs)
+        
         db = get_firestore()
         
-        # Get user document
-        user_doc = db.collection('users').document(current_user_id).get()
+        # Get user document; never from the process cache, MFA settings must be current
+        user_doc = document_cache.get(db.collection('users').document(current_user_id))
         if not user_doc.exists:
             return {"error": "User not found"}, 404
         
@@ -158,8 +172,15 @@ def require_mfa(view_function):
                 details="MFA verified for sensitive endpoint",
                 status="success"
             )
+            
+            # Hand out a grant so the next calls skip the TOTP check
+            response = make_response(view_function(*args, **kwargs))
+            grant = issue_mfa_grant(current_user_id, auth["jti"])
+            if grant:
+                response.headers['X-MFA-GRANT'] = grant
+            return response
         
-        # If MFA not required or verification successful, proceed
+        # If MFA not required, proceed
         return view_function(*args, **kwargs)
     
     return decorated
\ No newline at end of file
@@ -0,0 +1,506 @@
+"""
+In-process cache of revoked JWTs.
+
+flask_jwt_extended asks on every authenticated request whether the token
+has been revoked. Instead of reading ``blacklisted_tokens`` from Firestore
+each time, every process keeps the set of revoked token IDs (JTIs) in
+memory, each with the token's ``exp``, and answers from there:
+
+- the set is loaded and kept current by a Firestore snapshot listener
+  (TOKEN_BLOCKLIST_SYNC = 'listen'), or by polling for entries revoked
+  since the last sync (TOKEN_BLOCKLIST_SYNC = 'poll')
+- revocations made by this process are written through, so they apply
+  immediately here and reach other processes through the sync
+- entries are dropped once their token has expired, since an expired
+  token is rejected before the blocklist is consulted
+
+Each entry records its token's expiry as ``expires_at``. Expired entries
+are deleted from Firestore either by a TTL policy on that field
+(TOKEN_BLOCKLIST_TTL_POLICY) or by a background sweeper that deletes them
+in batches every TOKEN_BLOCKLIST_SWEEP_INTERVAL seconds, so the collection
+and the warm-up read stay bounded by the number of live revoked tokens.
+Every API process runs the sweeper loop, but only the holder of a lease
+document (``leases/token_blocklist_sweeper``) sweeps.
+
+Until the first sync completes, or when the cache is disabled, lookups
+read ``blacklisted_tokens/<jti>`` directly. They also go back to direct
+reads as soon as a sync is overdue: a poll or listener heartbeat is due
+every TOKEN_BLOCKLIST_SYNC_INTERVAL seconds, and the cache is not trusted
+once one has been missed. A listener that stops, or misses the newest
+revocation, is restarted at the next heartbeat.
+
+Entries written before tokens were keyed by JTI are still recognised by
+decoding their stored token; ``flask migrate-token-blocklist`` rewrites
+them in the current format.
+"""
+import os
+import time
+import socket
+import logging
+import threading
+from datetime import datetime
+
+import jwt
+from firebase_admin import firestore
+
+from app.models import create_blacklisted_token_document
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = 'blacklisted_tokens'
+
+# How often expired entries are dropped from memory, in seconds
+PRUNE_INTERVAL = 60
+
+# Seconds a sync may run late, and a revocation may take to reach the
+# listener, before the cache counts as stale
+SYNC_GRACE = 5
+
+# Firestore allows at most 500 writes per batch
+SWEEP_BATCH_SIZE = 500
+
+# Lease that elects the one process sweeping expired entries
+LEASE_COLLECTION = 'leases'
+SWEEP_LEASE = 'token_blocklist_sweeper'
+
+
+def _timestamp(value):
+    """Epoch seconds for a Firestore timestamp, datetime or number."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    return value.timestamp()
+
+
+class RevokedTokenCache:
+    """Per-process set of revoked JTIs, synced from Firestore."""
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.sync_mode = 'listen'
+        self.sync_interval = 30
+        self.max_token_lifetime = 604800
+        self.sweep_interval = 3600
+        self.ttl_policy = False
+        self._db = None
+        self._entries = {}  # jti -> token exp (epoch seconds)
+        self._ready = False
+        self._pid = None
+        self._watch = None
+        self._synced_until = None  # Poll mode: newest blacklisted_at seen
+        self._last_sync = 0.0
+        self._last_prune = 0.0
+        self._sweeps = {"holds_lease": False, "last_run": None, "last_deleted": 0,
+                        "last_duration_ms": None, "total_deleted": 0}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize the cache with a Flask application."""
+        self.enabled = app.config.get('TOKEN_BLOCKLIST_CACHE_ENABLED', True)
+        self.sync_mode = app.config.get('TOKEN_BLOCKLIST_SYNC', 'listen')
+        self.sync_interval = app.config.get('TOKEN_BLOCKLIST_SYNC_INTERVAL', 30)
+        self.sweep_interval = app.config.get('TOKEN_BLOCKLIST_SWEEP_INTERVAL', 3600)
+        self.ttl_policy = app.config.get('TOKEN_BLOCKLIST_TTL_POLICY', False)
+        # Entries whose token expiry cannot be determined are kept this long
+        self.max_token_lifetime = max(
+            app.config['JWT_ACCESS_TOKEN_EXPIRES'], app.config['JWT_REFRESH_TOKEN_EXPIRES']
+        ).total_seconds()
+        app.extensions['token_blocklist'] = self
+        app.cli.command('migrate-token-blocklist')(self._migrate_command)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def is_revoked(self, jti, db):
+        """
+        Check whether a token has been revoked.
+
+        Args:
+            jti (str): Token ID
+            db: Firestore client, used to start syncing and for direct reads
+                until the first sync has completed
+
+        Returns:
+            bool: True if the token is on the blocklist
+        """
+        if not self.enabled:
+            return db.collection(COLLECTION).document(jti).get().exists
+
+        self._ensure_started(db)
+        now = time.time()
+        if not self._ready or now - self._last_sync > self.sync_interval + SYNC_GRACE:
+            return db.collection(COLLECTION).document(jti).get().exists
+
+        if now - self._last_prune >= PRUNE_INTERVAL:
+            self._prune(now)
+        # Single dict lookup, safe without the lock
+        return jti in self._entries
+
+    def revoke(self, jwt_payload, user_id, db, reason=None):
+        """
+        Add a token to the blocklist, locally and in Firestore.
+
+        Args:
+            jwt_payload (dict): Decoded claims of the token to revoke
+            user_id (str): Account the token belongs to
+            db: Firestore client
+            reason (str, optional): Why the token was revoked
+        """
+        jti = jwt_payload['jti']
+        expires = jwt_payload.get('exp') or time.time() + self.max_token_lifetime
+        with self._lock:
+            self._entries[jti] = float(expires)
+
+        document = create_blacklisted_token_document(
+            jti, user_id, datetime.utcfromtimestamp(expires), reason=reason
+        )
+        db.collection(COLLECTION).document(jti).set(document)
+
+    def _ensure_started(self, db):
+        """Start syncing in this process (again after a fork)."""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            # Threads and listeners do not survive a fork: start from scratch
+            self._pid = pid
+            self._db = db
+            self._ready = False
+            self._watch = None
+            self._entries = {}
+            self._synced_until = None
+
+        if self.sweep_interval and not self.ttl_policy:
+            threading.Thread(target=self._sweep_loop, name='token-blocklist-sweep', daemon=True).start()
+
+        if self.sync_mode == 'listen':
+            try:
+                self._start_watch()
+                threading.Thread(target=self._watch_loop, name='token-blocklist-watch', daemon=True).start()
+                return
+            except Exception as e:
+                logger.error(f"Token blocklist listener failed to start, polling instead: {e}")
+        threading.Thread(target=self._poll_loop, name='token-blocklist-sync', daemon=True).start()
+
+    def _start_watch(self):
+        """Start the snapshot listener; its first snapshot loads the whole collection."""
+        self._watch = self._db.collection(COLLECTION).on_snapshot(self._on_snapshot)
+        # Counts as a sync so the listener gets the usual grace period to deliver it
+        self._last_sync = time.time()
+
+    def _on_snapshot(self, snapshot, changes, read_time):
+        """Snapshot listener callback: the first call carries the whole collection."""
+        with self._lock:
+            for change in changes:
+                jti, expires = self._entry_from_document(change.document)
+                if jti is None:
+                    continue
+                if change.type.name == 'REMOVED':
+                    self._entries.pop(jti, None)
+                else:
+                    self._entries[jti] = expires
+            if not self._ready:
+                logger.info(f"Token blocklist loaded: {len(self._entries)} revoked tokens")
+            self._ready = True
+            self._last_sync = time.time()
+
+    def _watch_loop(self):
+        """Listen mode: restart the listener as soon as a heartbeat finds it stale."""
+        while self._pid == os.getpid():
+            time.sleep(self.sync_interval)
+            try:
+                if self._heartbeat():
+                    continue
+            except Exception as e:
+                # Lookups read Firestore directly until a heartbeat succeeds again
+                logger.warning(f"Token blocklist heartbeat failed: {e}")
+                continue
+
+            logger.error("Token blocklist listener is stale, using direct reads until it is restarted")
+            self._ready = False
+            try:
+                self._watch.unsubscribe()
+            except Exception as e:
+                logger.warning(f"Could not stop the token blocklist listener: {e}")
+            with self._lock:
+                # Removals may have been missed; the new listener reloads everything
+                self._entries = {}
+            try:
+                self._start_watch()
+            except Exception as e:
+                logger.error(f"Token blocklist listener failed to restart: {e}")
+
+    def _heartbeat(self):
+        """
+        Record a sync if the listener is running and up to date.
+
+        A quiet collection produces no snapshots, so the newest entry is read
+        directly: the listener counts as current when it has that entry, or
+        when the entry was written less than SYNC_GRACE seconds ago.
+
+        Returns:
+            bool: False if the listener has stopped or fallen behind
+        """
+        if not getattr(self._watch, 'is_active', True):
+            return False
+        if not self._ready:
+            # Still waiting for the first snapshot
+            return time.time() - self._last_sync <= self.sync_interval + SYNC_GRACE
+        newest = list(self._db.collection(COLLECTION)
+                      .order_by('blacklisted_at', direction='DESCENDING')
+                      .limit(1)
+                      .stream())
+        if newest:
+            now = time.time()
+            jti, expires = self._entry_from_document(newest[0])
+            revoked_at = _timestamp((newest[0].to_dict() or {}).get('blacklisted_at'))
+            if (jti is not None and expires >= now and jti not in self._entries
+                    and (revoked_at is None or revoked_at < now - SYNC_GRACE)):
+                return False
+        self._last_sync = time.time()
+        return True
+
+    def _poll_loop(self):
+        while self._pid == os.getpid():
+            try:
+                self._sync()
+            except Exception as e:
+                # Lookups read Firestore directly until a sync succeeds again
+                logger.error(f"Token blocklist sync failed: {e}")
+            time.sleep(self.sync_interval)
+
+    def _sync(self):
+        """Fetch entries revoked since the last sync (everything on the first run)."""
+        query = self._db.collection(COLLECTION)
+        if self._synced_until is not None:
+            # >= so entries written in the same instant as the watermark are not missed
+            query = query.where('blacklisted_at', '>=', self._synced_until)
+
+        newest = self._synced_until
+        entries = {}
+        for document in query.stream():
+            jti, expires = self._entry_from_document(document)
+            if jti is not None:
+                entries[jti] = expires
+            revoked_at = (document.to_dict() or {}).get('blacklisted_at')
+            if revoked_at is not None and (newest is None or revoked_at > newest):
+                newest = revoked_at
+
+        with self._lock:
+            self._entries.update(entries)
+            self._synced_until = newest
+            if not self._ready:
+                logger.info(f"Token blocklist loaded: {len(self._entries)} revoked tokens")
+            self._ready = True
+            self._last_sync = time.time()
+
+    def _prune(self, now):
+        with self._lock:
+            self._last_prune = now
+            expired = [jti for jti, expires in self._entries.items() if expires < now]
+            for jti in expired:
+                del self._entries[jti]
+        if expired:
+            logger.debug(f"Dropped {len(expired)} expired tokens from the blocklist cache")
+
+    def sweep(self, db):
+        """
+        Delete blocklist entries whose token has expired, in batches.
+
+        Args:
+            db: Firestore client
+
+        Returns:
+            int: Number of entries deleted
+        """
+        start = time.perf_counter()
+        deleted = 0
+        while True:
+            expired = (db.collection(COLLECTION)
+                       .where('expires_at', '<', datetime.utcnow())
+                       .select([])  # Only the document references are needed
+                       .limit(SWEEP_BATCH_SIZE)
+                       .stream())
+            batch = db.batch()
+            count = 0
+            for document in expired:
+                batch.delete(document.reference)
+                count += 1
+            if not count:
+                break
+            batch.commit()
+            deleted += count
+            if count < SWEEP_BATCH_SIZE:
+                break
+
+        with self._lock:
+            self._sweeps.update(last_run=datetime.utcnow().isoformat() + 'Z', last_deleted=deleted,
+                                last_duration_ms=round((time.perf_counter() - start) * 1000, 1))
+            self._sweeps['total_deleted'] += deleted
+        if deleted:
+            logger.info(f"Deleted {deleted} expired entries from the token blocklist")
+        self._prune(time.time())
+        return deleted
+
+    def _sweep_loop(self):
+        while self._pid == os.getpid():
+            try:
+                holds_lease = self._hold_sweep_lease(self._db)
+                with self._lock:
+                    self._sweeps['holds_lease'] = holds_lease
+                if holds_lease:
+                    self.sweep(self._db)
+            except Exception as e:
+                logger.error(f"Token blocklist sweep failed: {e}")
+            time.sleep(self.sweep_interval)
+
+    def _hold_sweep_lease(self, db):
+        """
+        Take or renew the lease that makes this process the sweeper.
+
+        The lease lasts two sweep intervals and its holder renews it before
+        each sweep, so when the holder stops another process takes over
+        within that time.
+
+        Args:
+            db: Firestore client
+
+        Returns:
+            bool: True if this process holds the lease
+        """
+        reference = db.collection(LEASE_COLLECTION).document(SWEEP_LEASE)
+        holder = f"{socket.gethostname()}:{os.getpid()}"
+
+        @firestore.transactional
+        def claim(transaction):
+            snapshot = reference.get(transaction=transaction)
+            lease = (snapshot.to_dict() or {}) if snapshot.exists else {}
+            expires = _timestamp(lease.get('expires_at'))
+            if lease.get('holder') != holder and expires is not None and expires > time.time():
+                return False
+            transaction.set(reference, {
+                'holder': holder,
+                'expires_at': datetime.utcfromtimestamp(time.time() + 2 * self.sweep_interval)
+            })
+            return True
+
+        return claim(db.transaction())
+
+    def metrics(self, db):
+        """
+        Size and maintenance statistics of the blocklist.
+
+        Args:
+            db: Firestore client, used to count the stored entries
+
+        Returns:
+            dict: Collection size, cached entries, sync and sweeper state
+        """
+        try:
+            # Server-side count aggregation where the client supports it
+            stored = db.collection(COLLECTION).count().get()[0][0].value
+        except AttributeError:
+            stored = sum(1 for _ in db.collection(COLLECTION).select([]).stream())
+
+        with self._lock:
+            sweeps = dict(self._sweeps)
+        return {
+            "stored_entries": stored,
+            "cached_entries": len(self._entries),
+            "cache_enabled": self.enabled,
+            "sync": {
+                "mode": self.sync_mode,
+                "ready": self._ready,
+                "last_sync": datetime.utcfromtimestamp(self._last_sync).isoformat() + 'Z' if self._last_sync else None
+            },
+            "expiry": "ttl_policy" if self.ttl_policy else ("sweeper" if self.sweep_interval else "disabled"),
+            "sweeper": sweeps
+        }
+
+    def _entry_from_document(self, document):
+        """
+        Read (jti, expiry) from a blocklist document.
+
+        Entries without an ``expires_at`` field (written before it was
+        recorded) take it from ``exp`` or from the token they stored, or
+        are kept for the longest token lifetime after they were revoked.
+
+        Returns:
+            Tuple[str, float]: (jti, expiry in epoch seconds), or (None, None)
+                if the entry does not identify a token
+        """
+        data = document.to_dict() or {}
+        jti = data.get('jti')
+        expires = _timestamp(data.get('expires_at', data.get('exp')))
+
+        if (not jti or expires is None) and data.get('token'):
+            try:
+                claims = jwt.decode(data['token'], options={"verify_signature": False})
+                jti = jti or claims.get('jti')
+                expires = expires if expires is not None else claims.get('exp')
+            except jwt.InvalidTokenError:
+                pass
+
+        if not jti:
+            return None, None
+        if expires is None:
+            revoked_at = _timestamp(data.get('blacklisted_at')) or time.time()
+            expires = revoked_at + self.max_token_lifetime
+        return jti, float(expires)
+
+    def migrate(self, db):
+        """
+        Rewrite legacy blocklist entries as ``blacklisted_tokens/<jti>``.
+
+        Older entries were stored under generated IDs or without their
+        token's expiry. Each is rewritten under its JTI with ``expires_at``
+        and without the raw token; entries for expired tokens are deleted.
+
+        Returns:
+            dict: Counts of migrated, deleted and unreadable entries
+        """
+        counts = {'migrated': 0, 'deleted': 0, 'unreadable': 0}
+        now = time.time()
+
+        for document in db.collection(COLLECTION).stream():
+            data = document.to_dict() or {}
+            if data.get('jti') == document.id and 'expires_at' in data and 'token' not in data:
+                continue
+
+            jti, expires = self._entry_from_document(document)
+            if jti is None:
+                counts['unreadable'] += 1
+                logger.warning(f"Blocklist entry {document.id} does not identify a token, leaving it")
+                continue
+
+            if expires < now:
+                document.reference.delete()
+                counts['deleted'] += 1
+                continue
+
+            migrated = {key: value for key, value in data.items() if key not in ('token', 'exp')}
+            migrated.update(jti=jti, expires_at=datetime.utcfromtimestamp(expires))
+            migrated.setdefault('blacklisted_at', datetime.utcnow())
+            db.collection(COLLECTION).document(jti).set(migrated)
+            if document.id != jti:
+                document.reference.delete()
+            counts['migrated'] += 1
+
+        return counts
+
+    def _migrate_command(self):
+        """Rewrite legacy token blocklist entries so they are found by JTI and can expire."""
+        from app.firebase import get_firestore
+
+        counts = self.migrate(get_firestore())
+        print(f"Token blocklist: {counts['migrated']} entries migrated, {counts['deleted']} expired "
+              f"entries deleted, {counts['unreadable']} unreadable entries left in place")
+
+
+# Shared cache, initialized in create_app
+token_blocklist = RevokedTokenCache()
@@ -0,0 +1,152 @@
+"""
+Background document verification jobs.
+
+Uploads can be verified on a local worker pool instead of in the request
+thread. Each job records its current stage and, once finished, its result,
+for a limited time (VERIFICATION_JOB_TTL). Job records never hold the
+uploaded image: the document is only referenced by the running task.
+"""
+import uuid
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Job states
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+
+
+class QueueFullError(Exception):
+    """Raised when too many verification jobs are already waiting."""
+
+
+class VerificationJobQueue:
+    """
+    In-process verification job queue.
+
+    Jobs run on a bounded thread pool inside an application context, so
+    tasks can use Firestore and audit logging like a request handler would.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._executor = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.result_ttl = 900
+        self.max_pending = 100
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize the queue with a Flask application."""
+        self.app = app
+        self.result_ttl = app.config.get('VERIFICATION_JOB_TTL', 900)
+        self.max_pending = app.config.get('VERIFICATION_MAX_PENDING_JOBS', 100)
+        self._executor = ThreadPoolExecutor(
+            max_workers=app.config.get('VERIFICATION_WORKERS', 2),
+            thread_name_prefix='verification-job'
+        )
+        app.extensions['verification_jobs'] = self
+
+    def submit(self, user_id, task, *args, **kwargs):
+        """
+        Queue a verification task.
+
+        The task is called as ``task(*args, on_stage=callback, **kwargs)`` and
+        must return a JSON-serializable result that contains no image data.
+
+        Args:
+            user_id (str): Owner of the job; only they can read its status
+            task (callable): Verification function to run
+
+        Returns:
+            str: Job ID
+
+        Raises:
+            QueueFullError: If VERIFICATION_MAX_PENDING_JOBS jobs are already waiting
+        """
+        now = time.time()
+        job_id = uuid.uuid4().hex
+
+        with self._lock:
+            self._purge_expired(now)
+            pending = sum(1 for job in self._jobs.values() if job['status'] in (JOB_QUEUED, JOB_RUNNING))
+            if pending >= self.max_pending:
+                raise QueueFullError("Verification queue is full")
+
+            self._jobs[job_id] = {
+                'job_id': job_id,
+                'user_id': user_id,
+                'status': JOB_QUEUED,
+                'stage': JOB_QUEUED,
+                'created_at': now,
+                'updated_at': now,
+                'result': None,
+                'error': None
+            }
+
+        self._executor.submit(self._run, job_id, task, args, kwargs)
+        logger.info(f"Queued verification job {job_id} for user {user_id}")
+        return job_id
+
+    def get(self, job_id, user_id=None):
+        """
+        Get a snapshot of a job.
+
+        Args:
+            job_id (str): Job ID
+            user_id (str, optional): If given, jobs owned by other users are not returned
+
+        Returns:
+            dict: Copy of the job record, or None if unknown, expired or not owned by user_id
+        """
+        with self._lock:
+            self._purge_expired(time.time())
+            job = self._jobs.get(job_id)
+            if job is None or (user_id is not None and job['user_id'] != user_id):
+                return None
+            return dict(job)
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields, updated_at=time.time())
+
+    def _purge_expired(self, now):
+        """Drop finished jobs older than the result TTL. Caller holds the lock."""
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job['status'] in (JOB_COMPLETED, JOB_FAILED) and now - job['updated_at'] > self.result_ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _run(self, job_id, task, args, kwargs):
+        self._update(job_id, status=JOB_RUNNING, stage='started')
+
+        def on_stage(stage):
+            self._update(job_id, stage=stage)
+
+        try:
+            with self.app.app_context():
+                result = task(*args, on_stage=on_stage, **kwargs)
+            self._update(job_id, status=JOB_COMPLETED, stage='complete', result=result)
+            logger.info(f"Verification job {job_id} completed")
+        except ValueError as ve:
+            # Validation errors are safe to show to the owner
+            logger.error(f"Verification job {job_id} rejected: {ve}")
+            self._update(job_id, status=JOB_FAILED, stage='failed', error=str(ve))
+        except Exception as e:
+            logger.error(f"Verification job {job_id} failed: {e}")
+            self._update(job_id, status=JOB_FAILED, stage='failed', error="Failed to verify document")
+
+
+# Shared queue, initialized in create_app
+verification_jobs = VerificationJobQueue()
@@ -0,0 +1,458 @@
+"""
+Process pool that runs document verification outside the API process.
+
+OpenCV and Tesseract work is CPU-bound and parts of the pipeline hold the
+GIL, so running it in request threads slows down every other endpoint.
+Here each verification runs in a dedicated worker process:
+
+- every job has a wall-clock timeout; a worker that exceeds it is killed
+  and replaced, and the caller gets a clean error result
+- workers are recycled after VERIFICATION_MAX_JOBS_PER_WORKER jobs or once
+  their peak RSS passes VERIFICATION_MAX_WORKER_RSS_MB
+- stage updates are streamed back, so job progress keeps working
+- uploads are handed over in shared memory instead of being pickled
+  through the pipe (see verify)
+
+Workers are never forked from the running API process, which by then has
+Firestore gRPC channels and background threads that a forked child would
+inherit in an inconsistent state. Instead init_app forks a small spawner
+process before Firestore or any thread starts, and every worker, initial,
+replacement or recycled, is forked from that clean, single-threaded
+process (see _Spawner). The spawner loads the document template store
+first, so its matcher index is built once and shared by all workers.
+
+Processes that import the app without serving it do not start a pool:
+Flask CLI commands (FLASK_RUN_FROM_CLI) and the Werkzeug reloader parent
+(app.py turns off VERIFICATION_PROCESS_POOL_AUTOSTART for it). The
+reloader child, which serves, has WERKZEUG_RUN_MAIN set and always starts
+one. Where no pool runs, verification runs in-process.
+"""
+import os
+import time
+import atexit
+import signal
+import socket
+import struct
+import logging
+import resource
+import threading
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker, reduction
+from multiprocessing.connection import Connection
+
+from app.utils.verification_utils import verify_document, set_cpu_share, get_document_templates
+
+logger = logging.getLogger(__name__)
+
+# Below this size pickling the upload through the pipe is cheaper than a segment
+SHARED_MEMORY_MIN_BYTES = 64 * 1024
+
+
+class _Spawner:
+    """
+    Helper process that forks verification workers for the pool.
+
+    It is forked in init_app while the API process is still clean and
+    never starts a thread, so forking from it is safe at any time. The
+    pool sends it one end of a pipe; it forks a worker serving that end
+    and replies with the worker's PID. Workers are reaped by the spawner
+    (SIGCHLD is ignored there), and the spawner exits when the pool
+    closes its socket or the API process dies.
+    """
+
+    def __init__(self, context, processes):
+        self._sock, child_sock = socket.socketpair()
+        self._lock = threading.Lock()
+        self.process = context.Process(
+            target=_spawner_main, args=(child_sock, self._sock, processes), name='verification-spawner',
+            daemon=True
+        )
+        self.process.start()
+        child_sock.close()
+
+    def spawn(self, child_conn):
+        """
+        Fork a worker that serves child_conn.
+
+        Returns:
+            int: PID of the worker
+
+        Raises:
+            OSError: If the spawner is gone
+        """
+        with self._lock:
+            reduction.sendfds(self._sock, [child_conn.fileno()])
+            reply = b''
+            while len(reply) < 8:
+                chunk = self._sock.recv(8 - len(reply))
+                if not chunk:
+                    raise OSError("verification spawner exited")
+                reply += chunk
+        return struct.unpack('q', reply)[0]
+
+    def close(self):
+        self._sock.close()
+        self.process.join(1.0)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+
+
+def _spawner_main(sock, pool_sock, processes):
+    """Spawner loop: fork a worker for every pipe end received."""
+    # Keep only our end, so the spawner sees EOF when the pool closes its end
+    pool_sock.close()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)  # Exited workers are reaped automatically
+    # Built once here, so every worker shares the template index copy-on-write
+    get_document_templates()
+    while True:
+        try:
+            fd = reduction.recvfds(sock, 1)[0]
+        except (EOFError, OSError):
+            break
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                sock.close()
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                _worker_main(Connection(fd), processes)
+            finally:
+                os._exit(0)
+
+        os.close(fd)
+        try:
+            sock.sendall(struct.pack('q', pid))
+        except OSError:
+            break
+
+
+class _Worker:
+    """A worker process (forked by the spawner) and the pool's end of its pipe."""
+
+    def __init__(self, spawner):
+        self.conn, child_conn = multiprocessing.Pipe()
+        try:
+            self.pid = spawner.spawn(child_conn)
+        except Exception:
+            self.conn.close()
+            raise
+        finally:
+            child_conn.close()
+        self.jobs = 0
+        self.peak_rss_mb = 0.0
+
+    def is_alive(self):
+        try:
+            os.kill(self.pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def stop(self, timeout=1.0):
+        """Ask the worker to exit, killing it if it does not."""
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        deadline = time.monotonic() + timeout
+        while self.is_alive() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.kill()
+
+    def kill(self):
+        if self.is_alive():
+            try:
+                os.kill(self.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.conn.close()
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0  # KB on Linux
+
+
+def _worker_main(conn, processes):
+    """Worker loop: run (task, args, kwargs) messages until told to stop."""
+    # Ctrl-C is handled by the parent, which stops its workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # The pool's workers share the CPUs: size OCR and detector threads accordingly
+    set_cpu_share(processes)
+
+    def on_stage(stage):
+        conn.send(('stage', stage))
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message is None:
+            break
+
+        task, args, kwargs = message
+        try:
+            result = task(*args, on_stage=on_stage, **kwargs)
+            conn.send(('result', result, _peak_rss_mb()))
+        except Exception as e:
+            conn.send(('error', str(e), _peak_rss_mb()))
+
+
+def _attach_shared_memory(name):
+    """
+    Attach to a segment created by the API process.
+
+    The API process owns the segment and unlinks it. Workers share its
+    resource tracker, so attaching registers nothing new and the segment is
+    not unlinked when a worker exits or is killed.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _verify_shared_upload(segment_name, size, document_type, on_stage=None, **kwargs):
+    """Worker task: verify an upload the API process placed in shared memory."""
+    segment = _attach_shared_memory(segment_name)
+    view = segment.buf[:size]  # Segments can be rounded up to whole pages
+    try:
+        return verify_document(view, document_type, on_stage=on_stage, **kwargs)
+    finally:
+        # Views must be released before the mapping can be closed
+        try:
+            view.release()
+            segment.close()
+        except BufferError:
+            logger.warning(f"Shared upload {segment_name} still referenced, leaving it mapped")
+
+
+def _error_result(message):
+    """Failed verification in the same shape verify_document uses."""
+    return {
+        "status": "error",
+        "confidence_score": 0,
+        "security_features": [],
+        "recommendations": [f"Verification failed: {message}"]
+    }
+
+
+def _serves_requests(app):
+    """Whether this process may serve requests, rather than only importing the app."""
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        return True  # Reloader child
+    if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+        return False
+    return app.config.get('VERIFICATION_PROCESS_POOL_AUTOSTART', True)
+
+
+class VerificationProcessPool:
+    """Bounded pool of supervised verification worker processes."""
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.size = 0
+        self.timeout = 60
+        self.max_jobs_per_worker = 0
+        self.max_rss_mb = 0
+        self._spawner = None
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize the pool with a Flask application and start its workers."""
+        self.enabled = app.config.get('VERIFICATION_PROCESS_POOL_ENABLED', True)
+        self.size = app.config.get('VERIFICATION_PROCESSES', os.cpu_count() or 2)
+        self.timeout = app.config.get('VERIFICATION_JOB_TIMEOUT', 60)
+        self.max_jobs_per_worker = app.config.get('VERIFICATION_MAX_JOBS_PER_WORKER', 200)
+        self.max_rss_mb = app.config.get('VERIFICATION_MAX_WORKER_RSS_MB', 1024)
+        web_concurrency = app.config.get('WEB_CONCURRENCY', 1)
+        app.extensions['verification_pool'] = self
+
+        if self.enabled and not _serves_requests(app):
+            logger.info("Not starting verification workers in this process (CLI or reloader parent)")
+            self.enabled = False
+        if not self.enabled:
+            # In-process verification shares the CPUs with the other API processes
+            set_cpu_share(web_concurrency)
+            return
+
+        self._slots = threading.BoundedSemaphore(self.size)
+        # Workers must inherit the tracker that owns the shared upload segments
+        resource_tracker.ensure_running()
+        # Forked now, before Firestore or any thread starts; workers are forked from it.
+        # Their thread pools are sized for every pool on the host, one per API process
+        self._spawner = _Spawner(multiprocessing.get_context('fork'), self.size * web_concurrency)
+        with self._lock:
+            self._idle = [_Worker(self._spawner) for _ in range(self.size)]
+        atexit.register(self.shutdown)
+        logger.info(f"Started {self.size} verification worker processes")
+
+    def verify(self, image_bytes, document_type, include_ocr_text=False, on_stage=None, request_id=None):
+        """
+        Run verify_document in a worker process.
+
+        Runs in-process when the pool is disabled. Never raises for pipeline
+        failures: timeouts, crashed workers and a saturated pool all come
+        back as a verify_document style error result.
+
+        The upload is copied once into a shared memory segment that the
+        worker reads in place (decoding straight from it), instead of being
+        pickled through the pipe. The segment lives exactly as long as the
+        job: it is unlinked here when the job ends, times out or fails.
+
+        Args:
+            image_bytes (bytes | bytearray): Raw encoded image
+            document_type (str): Document type to verify as
+            include_ocr_text (bool): See verify_document
+            on_stage (callable, optional): Called with each pipeline stage name
+            request_id (str, optional): ID of the originating request
+
+        Returns:
+            dict: Verification result
+        """
+        kwargs = {"include_ocr_text": include_ocr_text, "request_id": request_id}
+        if not self.enabled:
+            return verify_document(image_bytes, document_type, on_stage=on_stage, **kwargs)
+
+        size = len(image_bytes)
+        if size < SHARED_MEMORY_MIN_BYTES:
+            return self.run(verify_document, (bytes(image_bytes), document_type), kwargs, on_stage=on_stage)
+
+        segment = shared_memory.SharedMemory(create=True, size=size)
+        try:
+            segment.buf[:size] = image_bytes
+            return self.run(_verify_shared_upload, (segment.name, size, document_type), kwargs,
+                            on_stage=on_stage)
+        finally:
+            segment.close()
+            segment.unlink()
+
+    def run(self, task, args, kwargs, on_stage=None):
+        """
+        Run task(*args, on_stage=..., **kwargs) in a worker within the job timeout.
+
+        The timeout covers the whole call: time spent waiting for a free
+        worker is taken out of the time the job gets to run.
+
+        Args:
+            task (callable): Module-level function (sent to the worker by reference)
+            args (tuple): Positional arguments, pickled to the worker
+            kwargs (dict): Keyword arguments, pickled to the worker
+            on_stage (callable, optional): Receives the stages the task reports
+
+        Returns:
+            The task's result, or an error result dict
+        """
+        deadline = time.monotonic() + self.timeout
+        if not self._slots.acquire(timeout=self.timeout):
+            logger.warning("All verification workers busy, giving up")
+            return _error_result("verification service is busy, please retry shortly")
+
+        worker = None
+        try:
+            if deadline - time.monotonic() <= 0:
+                logger.warning("No time left for the verification job after waiting for a worker")
+                return _error_result("verification service is busy, please retry shortly")
+            try:
+                worker = self._checkout()
+            except OSError as e:
+                logger.error(f"Could not start a verification worker: {e}")
+                return _error_result("verification workers are unavailable")
+            try:
+                worker.conn.send((task, args, kwargs))
+            except OSError:
+                logger.error(f"Verification worker {worker.pid} is gone")
+                worker.kill()
+                worker = None
+                return _error_result("verification worker stopped unexpectedly")
+            result, worker = self._wait(worker, on_stage, deadline)
+            return result
+        finally:
+            if worker is not None:
+                self._checkin(worker)
+            self._slots.release()
+
+    def _checkout(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return _Worker(self._spawner)
+
+    def _checkin(self, worker):
+        worker.jobs += 1
+        if ((self.max_jobs_per_worker and worker.jobs >= self.max_jobs_per_worker)
+                or (self.max_rss_mb and worker.peak_rss_mb >= self.max_rss_mb)):
+            logger.info(f"Recycling verification worker {worker.pid} after {worker.jobs} jobs, "
+                        f"peak RSS {worker.peak_rss_mb:.0f} MB")
+            worker.stop()
+            try:
+                worker = _Worker(self._spawner)
+            except OSError as e:
+                # The pool refills on demand in _checkout
+                logger.error(f"Could not replace verification worker: {e}")
+                return
+        with self._lock:
+            self._idle.append(worker)
+
+    def _wait(self, worker, on_stage, deadline):
+        """
+        Wait for the worker's result, forwarding stage updates.
+
+        Args:
+            worker (_Worker): Worker running the job
+            on_stage (callable, optional): Receives the stages the task reports
+            deadline (float): time.monotonic() value by which the job must finish
+
+        Returns:
+            Tuple[object, _Worker]: (result, worker to return to the pool, or
+            None if it was killed)
+        """
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                ready = remaining > 0 and worker.conn.poll(remaining)
+                message = worker.conn.recv() if ready else None
+            except (EOFError, OSError):
+                logger.error(f"Verification worker {worker.pid} died")
+                worker.kill()
+                return _error_result("verification worker stopped unexpectedly"), None
+
+            if message is None:
+                logger.error(f"Verification job timed out after {self.timeout}s, "
+                             f"killing worker {worker.pid}")
+                worker.kill()
+                return _error_result(f"processing took longer than {self.timeout} seconds"), None
+
+            kind = message[0]
+            if kind == 'stage':
+                if on_stage:
+                    on_stage(message[1])
+                continue
+
+            worker.peak_rss_mb = message[2]
+            if kind == 'error':
+                logger.error(f"Verification task failed in worker: {message[1]}")
+                return _error_result(message[1]), worker
+            return message[1], worker
+
+    def shutdown(self):
+        """Stop all idle workers and the spawner."""
+        with self._lock:
+            workers, self._idle = self._idle, []
+        for worker in workers:
+            worker.stop()
+        if self._spawner is not None:
+            self._spawner.close()
+            self._spawner = None
+
+
+# Shared pool, initialized in create_app
+verification_pool = VerificationProcessPool()
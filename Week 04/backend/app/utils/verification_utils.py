@@ -11,11 +11,181 @@ from PIL import Image
 import cv2
 import pytesseract
 import re
+import json
+import time
+import shlex
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Dict, Tuple
 from datetime import datetime
 
+from config import (
+    OCR_MAX_WORKERS, OCR_BACKEND, OCR_LANG, OCR_TESSDATA_PATH,
+    OCR_ROI_MAX_BANDS, OCR_FULL_PAGE_FALLBACK, ELA_QUALITIES,
+    MAX_IMAGE_PIXELS, ANALYSIS_MAX_DIMENSION, ELA_MAX_PIXELS, QUALITY_GATE_ENABLED, QUALITY_MIN_SHARPNESS,
+    DETECTOR_MAX_WORKERS, DOCUMENT_TEMPLATES_DIR, CLASSIFIER_MIN_INLIERS
+)
+
+try:
+    import tesserocr  # Optional: in-process Tesseract API bindings
+except ImportError:
+    tesserocr = None
+
 logger = logging.getLogger(__name__)
 
+# Bump whenever detector logic or scoring changes, so cached results are not reused
+PIPELINE_VERSION = '8'
+
+# Shared worker pools, created on first use and keyed by purpose
+_executors = {}
+_executors_lock = threading.Lock()
+
+# CPUs this process may keep busy; verification worker processes get their share (set_cpu_share)
+_cpu_share = os.cpu_count() or 2
+
+def set_cpu_share(processes):
+    """
+    Size this process's thread pools for one of processes equal processes.
+    
+    Called in each verification worker before its pools exist, so that
+    N workers together run about cpu_count OCR and detector threads
+    rather than N * cpu_count. Explicit OCR_MAX_WORKERS and
+    DETECTOR_MAX_WORKERS settings still take precedence.
+    
+    Args:
+        processes (int): Number of processes sharing the machine
+    """
+    global _cpu_share
+    _cpu_share = max(1, (os.cpu_count() or 2) // max(1, processes))
+
+def _get_executor(name, max_workers):
+    """Return the process-wide thread pool for name, creating it on first use."""
+    max_workers = max_workers or _cpu_share
+    with _executors_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max_workers,
+                                          thread_name_prefix=f"verification-{name}")
+            _executors[name] = executor
+        return executor
+
+def _reset_after_fork():
+    """
+    Forget thread pools and OCR handles inherited by a forked worker process.
+    
+    Their threads do not exist in the child and their locks may have been
+    held by another thread at fork time, so everything is rebuilt on first use.
+    """
+    global _executors_lock, _ocr_engine, _ocr_engine_lock, _template_store_lock
+    _executors.clear()
+    _executors_lock = threading.Lock()
+    _ocr_engine = None
+    _ocr_engine_lock = threading.Lock()
+    # A template store mapped before the fork stays valid and shared; only its lock is rebuilt
+    _template_store_lock = threading.Lock()
+
+def decode_base64_payload(base64_string):
+    """
+    Decode a base64 image string to the raw encoded image bytes.
+    
+    Args:
+        base64_string (str): Base64 encoded image, optionally with a data URL header
+        
+    Returns:
+        bytes: Raw encoded image bytes
+    """
+    # If the base64 string contains a header (like "data:image/jpeg;base64,"), remove it
+    if ',' in base64_string:
+        base64_string = base64_string.split(',', 1)[1]
+        
+    return base64.b64decode(base64_string)
+
+# Decoder flags that shrink the image while decoding (JPEG scales its DCT directly)
+_REDUCED_DECODE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
+
+def check_image_dimensions(image_data):
+    """
+    Read an encoded image's dimensions from its header and enforce the pixel budget.
+    
+    Only the header is parsed, so a small, highly compressed file that would
+    expand to hundreds of megapixels is rejected before any pixel is decoded.
+    
+    Args:
+        image_data (bytes | bytearray): Encoded image (JPEG, PNG, ...)
+        
+    Returns:
+        Tuple[int, int]: (width, height)
+        
+    Raises:
+        ValueError: If the header is unreadable or the image exceeds MAX_IMAGE_PIXELS
+    """
+    try:
+        with Image.open(BytesIO(image_data)) as image:  # Lazy: reads the header only
+            width, height = image.size
+    except Exception as e:
+        logger.warning(f"Unreadable image header: {e}")
+        raise ValueError("Unsupported or corrupt image data")
+    
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ValueError(
+            f"Image is {width}x{height} pixels, above the limit of "
+            f"{MAX_IMAGE_PIXELS / 1000000:.0f} megapixels. Please upload a smaller image"
+        )
+    return width, height
+
+def fit_analysis_resolution(image):
+    """
+    Downscale an image so its longer side is at most ANALYSIS_MAX_DIMENSION.
+    
+    Args:
+        image (np.ndarray): Decoded image
+        
+    Returns:
+        np.ndarray: The image itself if it already fits, else a resized copy
+    """
+    long_side = max(image.shape[:2])
+    if long_side <= ANALYSIS_MAX_DIMENSION:
+        return image
+    scale = ANALYSIS_MAX_DIMENSION / float(long_side)
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+def decode_image_bytes(image_data):
+    """
+    Decode raw encoded image bytes to a numpy array for processing.
+    
+    The header is checked against the pixel budget first. Large images are
+    decoded at a reduced scale where the codec supports it and then brought
+    to the canonical analysis resolution, so memory per document stays
+    bounded whatever the camera resolution.
+    
+    Args:
+        image_data (bytes | bytearray): Encoded image (JPEG, PNG, ...)
+        
+    Returns:
+        numpy.ndarray: Decoded BGR image, longer side at most ANALYSIS_MAX_DIMENSION
+        
+    Raises:
+        ValueError: If the bytes are not a supported image or exceed the pixel budget
+    """
+    width, height = check_image_dimensions(image_data)
+    
+    # Largest decoder reduction that still leaves at least the analysis resolution
+    flags = cv2.IMREAD_COLOR
+    for factor, reduced_flag in _REDUCED_DECODE_FLAGS:
+        if max(width, height) // factor >= ANALYSIS_MAX_DIMENSION:
+            flags = reduced_flag
+            break
+    
+    # Decode straight from a view of the bytes: OpenCV produces BGR, no extra copies
+    image = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), flags)
+    if image is None:
+        raise ValueError("Unsupported or corrupt image data")
+    return fit_analysis_resolution(image)
+
 def decode_base64_image(base64_string):
     """
     Decode a base64 image string to a numpy array for processing.
@@ -27,34 +197,675 @@ def decode_base64_image(base64_string):
         numpy.ndarray: Decoded image as numpy array
     """
     try:
-        # If the base64 string contains a header (like "data:image/jpeg;base64,"), remove it
-        if ',' in base64_string:
-            base64_string = base64_string.split(',', 1)[1]
-            
-        # Decode the base64 string
-        image_data = base64.b64decode(base64_string)
-        
-        # Convert to PIL Image
-        image = Image.open(BytesIO(image_data))
-        
-        # Convert to numpy array for OpenCV processing
-        numpy_image = np.array(image)
-        
-        # If the image is RGB, convert to BGR (OpenCV format)
-        if len(numpy_image.shape) == 3 and numpy_image.shape[2] == 3:
-            numpy_image = cv2.cvtColor(numpy_image, cv2.COLOR_RGB2BGR)
-            
-        return numpy_image
+        return decode_image_bytes(decode_base64_payload(base64_string))
     except Exception as e:
         logger.error(f"Error decoding base64 image: {e}")
         return None
 
-def detect_security_features(image: np.ndarray) -> List[str]:
+# Perceptual hash: one bit per horizontal gradient of an 8x8 grid, 64 bits in all
+PERCEPTUAL_HASH_SIZE = 8
+
+def compute_perceptual_hash(gray):
+    """
+    Compute the difference hash (dHash) of a grayscale image.
+    
+    The image is area-averaged down to a 9x8 grid and each bit records
+    whether a cell is brighter than its left neighbour. Re-compressing,
+    rescaling or re-photographing a document under similar framing changes
+    only a few bits, so copies are found by Hamming distance.
+    
+    Args:
+        gray (numpy.ndarray): Grayscale image
+    
+    Returns:
+        int: 64-bit perceptual hash
+    """
+    grid = cv2.resize(gray, (PERCEPTUAL_HASH_SIZE + 1, PERCEPTUAL_HASH_SIZE),
+                      interpolation=cv2.INTER_AREA)
+    bits = grid[:, 1:] > grid[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+class DocumentAnalysisContext:
+    """
+    Per-document analysis state shared by every detector.
+    
+    The upload is decoded once and the intermediates the detectors have in
+    common (grayscale, HSV, Canny edges, spectral features and contours) are
+    computed lazily on first access and memoized, so each one exists at most
+    once per request instead of once per detector.
+    
+    The context also collects the document's timings and counters (see
+    metrics()): wall time per pipeline stage and per intermediate, every OCR
+    pass that ran and which candidate matched.
+    """
+    
+    def __init__(self, source, request_id=None):
+        """
+        Args:
+            source (str | bytes | np.ndarray): Base64 string, raw encoded
+                image bytes or an already decoded BGR image
+            request_id (str, optional): ID of the request being served, for logs
+        """
+        self._source = source
+        self._encoded = None  # Upload bytes, kept only when the analysis image was downscaled
+        self._cache = {}
+        self._locks = {}
+        self.request_id = request_id
+        self.decode_error = None
+        self.ocr_match = None
+        self._metrics_lock = threading.Lock()
+        self._stages = {}
+        self._current_stage = None
+        self._intermediates = {}
+        self._detectors = {}
+        self._counters = {}
+        self._ocr_passes = []
+    
+    def _memoized(self, key, factory):
+        """
+        Return the cached intermediate for key, computing it on first use.
+        
+        Detectors may run on worker threads, so each key has its own lock:
+        concurrent readers of the same intermediate wait for a single
+        computation while different intermediates are built in parallel.
+        """
+        if key in self._cache:
+            return self._cache[key]
+        with self._locks.setdefault(key, threading.Lock()):
+            if key not in self._cache:
+                start = time.perf_counter()
+                self._cache[key] = factory()
+                name = key if isinstance(key, str) else key[0]
+                self._add_time(self._intermediates, name, time.perf_counter() - start)
+            return self._cache[key]
+    
+    def _add_time(self, timings, name, seconds):
+        with self._metrics_lock:
+            timings[name] = timings.get(name, 0.0) + seconds * 1000
+    
+    def begin_stage(self, stage):
+        """
+        Start timing a pipeline stage, ending the one in progress.
+        
+        Args:
+            stage (str): Stage name, or None to only end the current stage
+        """
+        now = time.perf_counter()
+        with self._metrics_lock:
+            if self._current_stage is not None:
+                name, start = self._current_stage
+                self._stages[name] = self._stages.get(name, 0.0) + (now - start) * 1000
+            self._current_stage = (stage, now) if stage else None
+    
+    def record_detector(self, name, seconds):
+        """Record the run time of a security feature detector."""
+        self._add_time(self._detectors, name, seconds)
+    
+    def count(self, name, amount=1):
+        """Increment a counter."""
+        with self._metrics_lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+    
+    def record_ocr_pass(self, label, config, preprocess_seconds, ocr_seconds):
+        """Record one completed Tesseract pass."""
+        with self._metrics_lock:
+            self._counters['ocr_attempts'] = self._counters.get('ocr_attempts', 0) + 1
+            self._ocr_passes.append({
+                "candidate": label,
+                "config": config,
+                "preprocess_ms": round(preprocess_seconds * 1000, 2),
+                "ocr_ms": round(ocr_seconds * 1000, 2)
+            })
+    
+    def metrics(self):
+        """
+        Snapshot of the timings and counters collected so far.
+        
+        Stage timings are inclusive: intermediates (decode, grayscale, edges,
+        contours, spectrum, ...) are also reported on their own under the stage
+        that first needed them.
+        
+        Returns:
+            dict: JSON-serializable metrics
+        """
+        image = self._cache.get('bgr')
+        with self._metrics_lock:
+            return {
+                "request_id": self.request_id,
+                "image": {
+                    "width": int(image.shape[1]),
+                    "height": int(image.shape[0]),
+                    "channels": int(image.shape[2]) if image.ndim == 3 else 1
+                } if image is not None else None,
+                "stages_ms": {name: round(ms, 2) for name, ms in self._stages.items()},
+                "intermediates_ms": {name: round(ms, 2) for name, ms in self._intermediates.items()},
+                "detectors_ms": {name: round(ms, 2) for name, ms in self._detectors.items()},
+                "counters": dict(self._counters),
+                "ocr_passes": list(self._ocr_passes),
+                "ocr_match": self.ocr_match
+            }
+    
+    def _decode(self):
+        source, self._source = self._source, None  # Drop the encoded copy once decoded
+        if isinstance(source, np.ndarray):
+            return source
+        try:
+            if isinstance(source, str):
+                source = decode_base64_payload(source)
+            image = decode_image_bytes(source)
+            if max(image.shape[:2]) < max(check_image_dimensions(source)):
+                self._encoded = source  # For full_resolution_bgr()
+            return image
+        except Exception as e:
+            logger.error(f"Error decoding document image: {e}")
+            self.decode_error = "Image decode failed"
+            return None
+    
+    @property
+    def bgr(self):
+        """Decoded BGR image, or None if the upload could not be decoded."""
+        return self._memoized('bgr', self._decode)
+    
+    def full_resolution_bgr(self):
+        """
+        The upload decoded at its own resolution, for analyses that depend on
+        the original pixel grid (ELA).
+        
+        Same as bgr unless the upload was larger than ANALYSIS_MAX_DIMENSION.
+        Uploads above ELA_MAX_PIXELS also get bgr, which bounds the extra
+        decode at ELA_MAX_PIXELS (a reduced-scale JPEG decode was measured
+        to score clean documents no better than the resized image). Not
+        memoized: the full-size image is only held while the caller uses it.
+        
+        Returns:
+            np.ndarray: BGR image, or None if the upload could not be decoded
+        """
+        image = self.bgr
+        if self._encoded is None:
+            return image
+        width, height = check_image_dimensions(self._encoded)
+        if width * height > ELA_MAX_PIXELS:
+            self.count('ela_downscaled')
+            return image
+        image = cv2.imdecode(np.frombuffer(self._encoded, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Unsupported or corrupt image data")
+        return image
+    
+    @property
+    def gray(self):
+        """Single-channel grayscale image."""
+        def factory():
+            image = self.bgr
+            if image.ndim == 2:
+                return image
+            if image.shape[2] == 4:
+                return cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY)
+            return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return self._memoized('gray', factory)
+    
+    @property
+    def hsv(self):
+        """HSV conversion of the BGR image."""
+        return self._memoized('hsv', lambda: cv2.cvtColor(self.bgr, cv2.COLOR_BGR2HSV))
+    
+    @property
+    def edges(self):
+        """Canny edge map (thresholds 100/200)."""
+        return self._memoized('edges', lambda: cv2.Canny(self.gray, 100, 200))
+    
+    @property
+    def contours(self):
+        """External contours of the dilated edge map."""
+        def factory():
+            dilated = cv2.dilate(self.edges, None, iterations=1)
+            contours, _ = cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            return contours
+        return self._memoized('contours', factory)
+    
+    @property
+    def perceptual_hash(self):
+        """Perceptual hash of the grayscale image as 16 hex digits, see compute_perceptual_hash."""
+        return self._memoized('perceptual_hash', lambda: f"{compute_perceptual_hash(self.gray):016x}")
+    
+    @property
+    def spectral_features(self):
+        """Frequency-domain features of the grayscale image, see compute_spectral_features."""
+        return self._memoized('spectral_features', lambda: compute_spectral_features(self.gray))
+    
+    @property
+    def thumbnail(self):
+        """Grayscale image at most QUALITY_THUMBNAIL_WIDTH wide, for cheap global checks."""
+        def factory():
+            gray = self.gray
+            if gray.shape[1] <= QUALITY_THUMBNAIL_WIDTH:
+                return gray
+            scale = QUALITY_THUMBNAIL_WIDTH / float(gray.shape[1])
+            return cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return self._memoized('thumbnail', factory)
+    
+    @property
+    def pixel_count(self):
+        """Number of pixels in the decoded image."""
+        return self.bgr.shape[0] * self.bgr.shape[1]
+
+# Longer side of the image the spectrum is computed on
+SPECTRUM_SIZE = 512
+
+# Radial frequency bands, in cycles per pixel of the spectrum image
+SPECTRAL_BANDS = {
+    'low': (0.0, 0.1),
+    'mid': (0.1, 0.25),
+    'high': (0.25, 1.0),
+}
+
+# Minimum mean log magnitude (orthonormal spectrum) for a hologram. On the
+# benchmark's synthetic documents at 640-3000 px, raw or JPEG-encoded, documents
+# measure 15-40 and blank, dark, gradient and blurred images at most 3.
+HOLOGRAM_MIN_SPECTRUM_MEAN = 8
+HOLOGRAM_STRICT_MIN_SPECTRUM_MEAN = 12  # detect_security_features
+
+def compute_spectral_features(gray):
+    """
+    Summarize the frequency content of a grayscale image.
+    
+    The image is downsampled to SPECTRUM_SIZE, zero-padded to sizes from
+    cv2.getOptimalDFTSize and transformed with a real-input FFT (half the
+    spectrum, no complex input), so the cost and memory are small and fixed
+    whatever the upload resolution. The transform is orthonormal, so the
+    magnitudes do not grow with the number of pixels transformed either.
+    
+    Args:
+        gray (np.ndarray): Grayscale image
+        
+    Returns:
+        dict: mean_log_magnitude (dB, the hologram signal), band_energy
+            (share of non-DC power per SPECTRAL_BANDS band) and spectrum_size
+    """
+    height, width = gray.shape[:2]
+    scale = SPECTRUM_SIZE / float(max(height, width))
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    
+    rows, cols = gray.shape[:2]
+    padded = cv2.copyMakeBorder(
+        gray, 0, cv2.getOptimalDFTSize(rows) - rows, 0, cv2.getOptimalDFTSize(cols) - cols,
+        cv2.BORDER_CONSTANT, value=0
+    )
+    magnitude = np.abs(np.fft.rfft2(np.float32(padded), norm='ortho'))
+    mean_log_magnitude = float(np.mean(20 * np.log(np.maximum(magnitude, 1e-6))))
+    
+    power = magnitude ** 2
+    power[0, 0] = 0  # DC is overall brightness, not texture
+    radius = np.sqrt(np.fft.fftfreq(padded.shape[0])[:, None] ** 2 +
+                     np.fft.rfftfreq(padded.shape[1])[None, :] ** 2)
+    total = float(power.sum()) or 1.0
+    band_energy = {
+        name: round(float(power[(radius >= low) & (radius < high)].sum()) / total, 4)
+        for name, (low, high) in SPECTRAL_BANDS.items()
+    }
+    
+    return {
+        "mean_log_magnitude": round(mean_log_magnitude, 2),
+        "band_energy": band_energy,
+        "spectrum_size": [int(padded.shape[0]), int(padded.shape[1])]
+    }
+
+def as_analysis_context(document):
+    """
+    Wrap a document in a DocumentAnalysisContext unless it already is one.
+    
+    Args:
+        document: DocumentAnalysisContext, base64 string, raw bytes or image array
+        
+    Returns:
+        DocumentAnalysisContext: Context for the document
+    """
+    if isinstance(document, DocumentAnalysisContext):
+        return document
+    return DocumentAnalysisContext(document)
+
+# Early quality gate, run on the thumbnail before any OCR
+QUALITY_THUMBNAIL_WIDTH = 512
+QUALITY_MIN_LONG_SIDE = 640
+QUALITY_MIN_SHORT_SIDE = 400
+QUALITY_MIN_BRIGHTNESS = 40
+QUALITY_MAX_BRIGHTNESS = 225
+QUALITY_MAX_GLARE_RATIO = 0.25  # Share of blown-out pixels
+
+# Accepted long/short side ratio per document type, in either orientation.
+# Kept wide: the document is photographed with some background around it.
+DOCUMENT_ASPECT_RANGES = {
+    'id_card': (1.2, 2.0),     # ID-1 card is 1.59
+    'passport': (1.1, 1.9),    # ID-3 data page is 1.42
+}
+
+def assess_image_usability(document, document_type=None) -> Dict:
+    """
+    Decide in milliseconds whether an upload is worth verifying.
+    
+    Checks resolution and aspect ratio on the decoded size, and sharpness
+    (Laplacian variance), exposure and glare on the thumbnail. Each failed
+    check adds a message telling the user how to retake the photo.
+    
+    Args:
+        document: DocumentAnalysisContext or image
+        document_type (str): Document type, selects the expected aspect ratio
+        
+    Returns:
+        Dict: {"passed": bool, "checks": measured values, "issues": user-facing messages}
+    """
+    context = as_analysis_context(document)
+    image = context.bgr
+    if image is None:
+        return {
+            "passed": False,
+            "checks": {},
+            "issues": ["The image could not be read. Upload a JPEG or PNG photo of the document"]
+        }
+    
+    height, width = image.shape[:2]
+    long_side, short_side = max(width, height), min(width, height)
+    thumbnail = context.thumbnail
+    checks = {
+        "width": width,
+        "height": height,
+        "aspect_ratio": round(long_side / float(short_side), 3),
+        "sharpness": round(float(cv2.Laplacian(thumbnail, cv2.CV_64F).var()), 2),
+        "brightness": round(float(np.mean(thumbnail)), 2),
+        "glare_ratio": round(np.count_nonzero(thumbnail >= 250) / float(thumbnail.size), 4)
+    }
+    
+    issues = []
+    if long_side < QUALITY_MIN_LONG_SIDE or short_side < QUALITY_MIN_SHORT_SIDE:
+        issues.append(f"Image resolution is too low ({width}x{height}). Move the camera closer so the "
+                      f"document fills the frame, at least {QUALITY_MIN_LONG_SIDE}x{QUALITY_MIN_SHORT_SIDE} pixels")
+    
+    aspect_range = DOCUMENT_ASPECT_RANGES.get(document_type)
+    if aspect_range and not aspect_range[0] <= checks["aspect_ratio"] <= aspect_range[1]:
+        issues.append("The document does not fill the photo or is cut off. Crop the image to the "
+                      "edges of the document and make sure all four corners are visible")
+    
+    if checks["sharpness"] < QUALITY_MIN_SHARPNESS:
+        issues.append("Image is blurry. Hold the camera steady, tap to focus on the document and retake the photo")
+    
+    if checks["brightness"] < QUALITY_MIN_BRIGHTNESS:
+        issues.append("Image is too dark. Take the photo in better light")
+    elif checks["brightness"] > QUALITY_MAX_BRIGHTNESS:
+        issues.append("Image is overexposed. Avoid direct light on the document")
+    elif checks["glare_ratio"] > QUALITY_MAX_GLARE_RATIO:
+        issues.append("Glare hides part of the document. Tilt it slightly or turn off the flash")
+    
+    return {"passed": not issues, "checks": checks, "issues": issues}
+
+# Document classification: ORB keypoints matched against reference templates
+CLASSIFIER_WIDTH = 640  # Width images are resampled to before keypoint detection
+CLASSIFIER_FEATURES = 500  # Keypoints per upload
+CLASSIFIER_TEMPLATE_FEATURES = 1000  # Keypoints per reference template
+# Templates are built offline, so they get a finer scale pyramid than uploads
+# (ORB's default is 1.2 x 8 levels): any upload scale then has a template level close to it
+CLASSIFIER_TEMPLATE_PYRAMID = (1.1, 16)
+CLASSIFIER_RATIO = 0.75  # Lowe's ratio test
+CLASSIFIER_LSH_PARAMS = dict(algorithm=6, table_number=6, key_size=12, multi_probe_level=1)  # FLANN_INDEX_LSH
+CLASSIFIER_LSH_CHECKS = 32
+CLASSIFIER_RANSAC_CANDIDATES = 3  # Templates with the most matches that get geometric verification
+TEMPLATE_STORE_VERSION = 1
+
+# Detectors and OCR passes worth running on each recognised document type.
+# Documents the classifier cannot place get every detector.
+DOCUMENT_PROFILES = {
+    'id_card': {
+        "detectors": ('smart_chip', 'hologram', 'microtext', 'watermark', 'uv_elements'),
+        "full_page_ocr": True
+    },
+    'passport': {
+        "detectors": ('hologram', 'microtext', 'watermark', 'uv_elements'),
+        "full_page_ocr": True
+    },
+    'drivers_license': {
+        "detectors": ('hologram', 'microtext', 'watermark'),
+        "full_page_ocr": True
+    },
+    'e_license': {
+        # Screen captures: no physical security features, and the printed text OCRs cleanly
+        "detectors": ('watermark',),
+        "full_page_ocr": False
+    },
+}
+
+class DocumentTemplateStore:
+    """
+    Reference keypoints of each supported document type.
+    
+    Built offline by build_document_templates into DOCUMENT_TEMPLATES_DIR:
+    templates.json (one entry per template) plus points.npy and
+    descriptors.npy holding every template's keypoints back to back. The
+    arrays are memory-mapped, so worker processes share one copy in the page
+    cache and nothing is parsed per request.
+    
+    All descriptors go into one LSH index, built when the store is loaded,
+    so matching an upload costs about the same however many templates there are.
+    The index is a private copy of the descriptors plus its hash tables; the
+    verification pool loads the store before forking its workers so they
+    share that copy too.
+    """
+    
+    def __init__(self, templates=(), points=None, descriptors=None):
+        self.templates = list(templates)
+        self.points = points
+        self.descriptors = descriptors
+        self.owners = None  # Template index of every descriptor row
+        self.matcher = None
+        if self.templates:
+            self.owners = np.repeat(np.arange(len(self.templates)),
+                                    [template['count'] for template in self.templates])
+            self.matcher = cv2.FlannBasedMatcher(CLASSIFIER_LSH_PARAMS, dict(checks=CLASSIFIER_LSH_CHECKS))
+            self.matcher.add([np.asarray(descriptors)])
+            self.matcher.train()
+    
+    def __len__(self):
+        return len(self.templates)
+    
+    @classmethod
+    def load(cls, directory):
+        """
+        Map a template store from disk.
+    
+        Args:
+            directory (str): Directory written by build_document_templates
+    
+        Returns:
+            DocumentTemplateStore: The store, empty if there is none
+        """
+        index_path = os.path.join(directory, 'templates.json')
+        if not os.path.exists(index_path):
+            logger.info(f"No document templates in {directory}, classification disabled")
+            return cls()
+    
+        with open(index_path) as f:
+            index = json.load(f)
+        if index.get('version') != TEMPLATE_STORE_VERSION:
+            logger.warning(f"Document templates in {directory} are version {index.get('version')}, "
+                           f"expected {TEMPLATE_STORE_VERSION}; rebuild them")
+            return cls()
+    
+        points = np.load(os.path.join(directory, 'points.npy'), mmap_mode='r')
+        descriptors = np.load(os.path.join(directory, 'descriptors.npy'), mmap_mode='r')
+        logger.info(f"Loaded {len(index['templates'])} document templates from {directory}")
+        return cls(index['templates'], points, descriptors)
+
+_template_store = None
+_template_store_lock = threading.Lock()
+
+def get_document_templates():
+    """Return this process's template store, mapping it on first use."""
+    global _template_store
+    with _template_store_lock:
+        if _template_store is None:
+            try:
+                _template_store = DocumentTemplateStore.load(DOCUMENT_TEMPLATES_DIR)
+            except Exception as e:
+                logger.error(f"Failed to load document templates: {e}")
+                _template_store = DocumentTemplateStore()
+        return _template_store
+
+def compute_orb_features(gray, max_features=CLASSIFIER_FEATURES, pyramid=(1.2, 8), pad=False):
+    """
+    Detect ORB keypoints on a grayscale image resampled to CLASSIFIER_WIDTH.
+    
+    ORB skips a band along the border of every pyramid level, which on a
+    reference cropped to the document edges would lose the header, the
+    corners and everything near them. With pad, the image gets a plain
+    border as wide as that band at the coarsest level, like the background
+    around the document in a photo; points stay in unpadded coordinates.
+    
+    Args:
+        gray (numpy.ndarray): Grayscale image
+        max_features (int): Maximum number of keypoints
+        pyramid (Tuple[float, int]): Scale factor and number of pyramid levels
+        pad (bool): Add a border so features up to the image edge are found
+    
+    Returns:
+        Tuple[numpy.ndarray, numpy.ndarray]: (n x 2 float32 points, n x 32 uint8 descriptors)
+    """
+    scale = CLASSIFIER_WIDTH / float(gray.shape[1])
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=interpolation)
+    
+    scale_factor, levels = pyramid
+    orb = cv2.ORB_create(nfeatures=max_features, scaleFactor=scale_factor, nlevels=levels)
+    border = int(np.ceil(orb.getEdgeThreshold() * scale_factor ** (levels - 1))) if pad else 0
+    if border:
+        small = cv2.copyMakeBorder(small, border, border, border, border, cv2.BORDER_CONSTANT,
+                                   value=int(np.median(small)))
+    
+    keypoints, descriptors = orb.detectAndCompute(small, None)
+    if descriptors is None:
+        return np.zeros((0, 2), dtype=np.float32), np.zeros((0, 32), dtype=np.uint8)
+    return np.array([keypoint.pt for keypoint in keypoints], dtype=np.float32) - border, descriptors
+
+def build_document_templates(references, output_dir):
+    """
+    Precompute reference keypoints and write the classifier's template store.
+    
+    Args:
+        references: Iterable of (document_type, name, image) with BGR or grayscale images
+        output_dir (str): Directory to write the store to (DOCUMENT_TEMPLATES_DIR)
+    
+    Returns:
+        int: Number of templates written
+    """
+    templates, all_points, all_descriptors = [], [], []
+    start = 0
+    for document_type, name, image in references:
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        points, descriptors = compute_orb_features(gray, CLASSIFIER_TEMPLATE_FEATURES,
+                                                   CLASSIFIER_TEMPLATE_PYRAMID, pad=True)
+        if len(descriptors) < CLASSIFIER_MIN_INLIERS:
+            logger.warning(f"Template {name} has only {len(descriptors)} keypoints, skipping it")
+            continue
+    
+        templates.append({
+            "document_type": document_type,
+            "name": name,
+            "start": start,
+            "count": len(descriptors),
+            # Size of the template at CLASSIFIER_WIDTH, the frame its points are in
+            "width": CLASSIFIER_WIDTH,
+            "height": int(round(gray.shape[0] * CLASSIFIER_WIDTH / float(gray.shape[1])))
+        })
+        all_points.append(points)
+        all_descriptors.append(descriptors)
+        start += len(descriptors)
+    
+    if not templates:
+        raise ValueError("No usable reference images")
+    
+    os.makedirs(output_dir, exist_ok=True)
+    np.save(os.path.join(output_dir, 'points.npy'), np.concatenate(all_points))
+    np.save(os.path.join(output_dir, 'descriptors.npy'), np.concatenate(all_descriptors))
+    # Written last: the index is what makes a store visible to load()
+    with open(os.path.join(output_dir, 'templates.json'), 'w') as f:
+        json.dump({"version": TEMPLATE_STORE_VERSION, "width": CLASSIFIER_WIDTH, "templates": templates}, f, indent=2)
+    return len(templates)
+
+def classify_document(document) -> Dict:
+    """
+    Recognise which supported document type an image shows.
+    
+    The upload's ORB keypoints are looked up in the LSH index over every
+    template's descriptors. The ratio test only rejects matches that are
+    ambiguous within one template (repeated patterns). When the runner-up
+    from another template matches about as well, both templates get the
+    match: references share features (several references of one type, or
+    the card shown in a digital license screenshot) and geometry decides
+    between them. The templates with the most matches are then
+    checked for a consistent homography. Each is scored by its RANSAC
+    inliers times the share of the template those inliers cover, so a
+    template that only partly matches (a license photo against the screen
+    capture of a digital license that shows the same card) loses to one the
+    upload explains entirely. The best template wins if it has at least
+    CLASSIFIER_MIN_INLIERS inliers.
+    
+    Args:
+        document: DocumentAnalysisContext or image
+    
+    Returns:
+        Dict: {"document_type": type or None, "template", "inliers", "coverage",
+            "templates": number searched}
+    """
+    context = as_analysis_context(document)
+    store = get_document_templates()
+    result = {"document_type": None, "template": None, "inliers": 0, "coverage": 0.0, "templates": len(store)}
+    if not store or context.bgr is None:
+        return result
+    
+    points, descriptors = context._memoized('orb_features', lambda: compute_orb_features(context.gray))
+    if len(descriptors) < 2:
+        return result
+    
+    templates = store.templates
+    votes = {}
+    for pair in store.matcher.knnMatch(descriptors, k=2):
+        if not pair:
+            continue
+        best = pair[0]
+        owner = store.owners[best.trainIdx]
+        if len(pair) == 2 and best.distance >= CLASSIFIER_RATIO * pair[1].distance:
+            runner_up = store.owners[pair[1].trainIdx]
+            if runner_up == owner:
+                continue
+            votes.setdefault(runner_up, []).append(pair[1])
+        votes.setdefault(owner, []).append(best)
+    
+    ranked = sorted(votes.items(), key=lambda item: len(item[1]), reverse=True)
+    best_score = 0.0
+    for owner, matches in ranked[:CLASSIFIER_RANSAC_CANDIDATES]:
+        if len(matches) < CLASSIFIER_MIN_INLIERS:
+            break
+        source = points[[match.queryIdx for match in matches]]
+        target = np.asarray(store.points[[match.trainIdx for match in matches]])
+        _, mask = cv2.findHomography(source, target, cv2.RANSAC, 5.0)
+        if mask is None or int(mask.sum()) < CLASSIFIER_MIN_INLIERS:
+            continue
+        
+        template = templates[owner]
+        inliers = int(mask.sum())
+        hull = cv2.convexHull(target[mask.ravel().astype(bool)])
+        coverage = min(1.0, cv2.contourArea(hull) / float(template['width'] * template['height']))
+        if inliers * coverage > best_score:
+            best_score = inliers * coverage
+            result.update(document_type=template['document_type'], template=template['name'],
+                          inliers=inliers, coverage=round(coverage, 3))
+    
+    return result
+
+def detect_security_features(image) -> List[str]:
     """
     Detect security features in the document image.
     
     Args:
-        image (np.ndarray): Document image
+        image (np.ndarray | DocumentAnalysisContext): Document image or its analysis context
         
     Returns:
         List[str]: List of detected security features
@@ -62,20 +873,15 @@ def detect_security_features(image: np.ndarray) -> List[str]:
     features = []
     
     try:
-        # Convert to grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        context = as_analysis_context(image)
+        gray = context.gray
         
         # Detect holograms (using frequency domain analysis)
-        dft = cv2.dft(np.float32(gray), flags=cv2.DFT_COMPLEX_OUTPUT)
-        dft_shift = np.fft.fftshift(dft)
-        magnitude_spectrum = 20 * np.log(cv2.magnitude(dft_shift[:,:,0], dft_shift[:,:,1]))
-        
-        if np.mean(magnitude_spectrum) > 100:
+        if context.spectral_features["mean_log_magnitude"] > HOLOGRAM_STRICT_MIN_SPECTRUM_MEAN:
             features.append("Hologram detected")
         
         # Detect micro-text (using edge detection)
-        edges = cv2.Canny(gray, 100, 200)
-        if np.mean(edges) > 50:
+        if np.mean(context.edges) > 50:
             features.append("Micro-text detected")
         
         # Detect UV patterns (simulated)
@@ -95,19 +901,18 @@ def detect_security_features(image: np.ndarray) -> List[str]:
     
     return features
 
-def analyze_image_quality(image: np.ndarray) -> str:
+def analyze_image_quality(image) -> str:
     """
     Analyze the quality of the document image.
     
     Args:
-        image (np.ndarray): Document image
+        image (np.ndarray | DocumentAnalysisContext): Document image or its analysis context
         
     Returns:
         str: Quality assessment
     """
     try:
-        # Convert to grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        gray = as_analysis_context(image).gray
         
         # Calculate image metrics
         blur_score = cv2.Laplacian(gray, cv2.CV_64F).var()
@@ -130,12 +935,56 @@ def analyze_image_quality(image: np.ndarray) -> str:
         logger.error(f"Error analyzing image quality: {e}")
         return "Unable to assess quality"
 
-def check_document_authenticity(image: np.ndarray, document_type: str = '') -> Tuple[bool, List[str]]:
+# Rows re-encoded at a time by ELA; a multiple of 16 keeps every strip on the
+# JPEG block grid (8x8 blocks, 16x16 with chroma subsampling)
+ELA_STRIP_ROWS = 512
+
+def error_level_analysis(image, qualities=None) -> Dict[int, float]:
+    """
+    Error Level Analysis: re-encode the image as JPEG in memory and measure
+    how much it changes.
+    
+    Regions edited after the last save recompress differently from the rest
+    of the image, raising the mean error level. Encoding and decoding happen
+    on in-memory buffers, so concurrent requests never share a file.
+    
+    ELA runs on the upload's own pixels, not the downscaled analysis image:
+    resampling moves the JPEG block grid the comparison relies on. Uploads
+    above ELA_MAX_PIXELS are the exception, to bound memory, and are
+    analyzed downscaled. The image is re-encoded in strips of ELA_STRIP_ROWS
+    so the recompressed copies stay small.
+    
+    Args:
+        image (np.ndarray | DocumentAnalysisContext): Document image or its analysis context
+        qualities (List[int]): JPEG qualities to test (defaults to ELA_QUALITIES)
+        
+    Returns:
+        Dict[int, float]: Mean absolute difference per JPEG quality
+    """
+    context = as_analysis_context(image)
+    qualities = tuple(qualities or ELA_QUALITIES)
+    
+    def compute():
+        image = context.full_resolution_bgr()
+        totals = dict.fromkeys(qualities, 0.0)
+        for top in range(0, image.shape[0], ELA_STRIP_ROWS):
+            strip = image[top:top + ELA_STRIP_ROWS]
+            for quality in qualities:
+                success, encoded = cv2.imencode('.jpg', strip, [cv2.IMWRITE_JPEG_QUALITY, quality])
+                if not success:
+                    raise ValueError(f"JPEG re-encode failed at quality {quality}")
+                recompressed = cv2.imdecode(encoded, cv2.IMREAD_UNCHANGED)
+                totals[quality] += float(cv2.absdiff(strip, recompressed).sum())
+        return {quality: total / image.size for quality, total in totals.items()}
+    
+    return context._memoized(('ela', qualities), compute)
+
+def check_document_authenticity(image, document_type: str = '') -> Tuple[bool, List[str]]:
     """
     Check if the document appears to be authentic.
     
     Args:
-        image (np.ndarray): Document image
+        image (np.ndarray | DocumentAnalysisContext): Document image or its analysis context
         document_type (str): Type of document being verified
         
     Returns:
@@ -143,40 +992,31 @@ def check_document_authenticity(image: np.ndarray, document_type: str = '') -> T
     """
     risk_factors = []
     is_authentic = True
-    temp_filename = "/tmp/temp_docudino.jpg"
     
     # Special handling for digital documents
     is_digital_document = document_type in ['drivers_license', 'e_license', 'digital_id']
     
     try:
-        # Check for signs of digital manipulation
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        context = as_analysis_context(image)
         
-        # Error Level Analysis (ELA)
-        quality = 90
+        # Check for signs of digital manipulation
+        gray = context.gray
         
-        # Write temp file with error handling
+        # Error Level Analysis (ELA), judged at the primary (first) quality
         try:
-            cv2.imwrite(temp_filename, image, [cv2.IMWRITE_JPEG_QUALITY, quality])
-            compressed = cv2.imread(temp_filename)
+            error_levels = error_level_analysis(context)
+            error_level = error_levels[ELA_QUALITIES[0]]
             
-            if compressed is None:
-                logger.error("Failed to read compressed image from temp file")
-                risk_factors.append("Error during image processing")
-                is_authentic = False
-            else:
-                diff = cv2.absdiff(image, compressed)
-                
-                # Different thresholds for different document types
-                diff_threshold = 60 if is_digital_document else 30
-                
-                if np.mean(diff) > diff_threshold:
-                    # For digital documents, add as a risk factor but don't immediately fail
-                    if is_digital_document:
-                        risk_factors.append("Digital artifacts detected - expected for e-documents")
-                    else:
-                        risk_factors.append("Signs of digital manipulation detected")
-                        is_authentic = False
+            # Different thresholds for different document types
+            diff_threshold = 60 if is_digital_document else 30
+            
+            if error_level > diff_threshold:
+                # For digital documents, add as a risk factor but don't immediately fail
+                if is_digital_document:
+                    risk_factors.append("Digital artifacts detected - expected for e-documents")
+                else:
+                    risk_factors.append("Signs of digital manipulation detected")
+                    is_authentic = False
         except Exception as ela_error:
             logger.error(f"Error during ELA analysis: {ela_error}")
             risk_factors.append("Error during image analysis")
@@ -205,130 +1045,484 @@ def check_document_authenticity(image: np.ndarray, document_type: str = '') -> T
         logger.error(f"Error checking document authenticity: {e}")
         risk_factors.append("Error during authenticity check")
         is_authentic = False
-    finally:
-        # Clean up temporary file
-        try:
-            if os.path.exists(temp_filename):
-                os.remove(temp_filename)
-        except Exception as cleanup_error:
-            logger.error(f"Error cleaning up temp file: {cleanup_error}")
     
     return is_authentic, risk_factors
 
-def extract_id_number_and_text(image_b64: str):
+def _parse_tesseract_config(config):
     """
-    Enhanced ID extraction with multiple preprocessing techniques
-    and pattern recognition approaches.
+    Split a Tesseract CLI config string into its parts.
+    
+    Args:
+        config (str): e.g. '--oem 3 --psm 11 -c tessedit_char_whitelist=0123456789-'
+        
+    Returns:
+        dict: {'lang', 'oem', 'psm', 'variables'}
     """
-    image = decode_base64_image(image_b64)
-    if image is None:
-        return None, None, "Image decode failed"
+    parsed = {'lang': OCR_LANG, 'oem': 3, 'psm': 3, 'variables': {}}
+    args = shlex.split(config or '')
+    for flag, value in zip(args, args[1:]):
+        if flag == '--oem':
+            parsed['oem'] = int(value)
+        elif flag == '--psm':
+            parsed['psm'] = int(value)
+        elif flag == '-c' and '=' in value:
+            name, setting = value.split('=', 1)
+            parsed['variables'][name] = setting
+    return parsed
+
+class PytesseractOCREngine:
+    """OCR backend that runs the tesseract binary once per call via pytesseract."""
+    
+    name = 'pytesseract'
     
-    # Create multiple processed versions for better OCR results
-    processed_images = []
+    def image_to_string(self, image, config=''):
+        return pytesseract.image_to_string(image, config=config, lang=OCR_LANG)
+
+class TesserocrOCREngine:
+    """
+    OCR backend backed by long-lived tesserocr API handles.
     
-    # Original grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    processed_images.append(gray)
+    Each worker thread lazily initializes one handle per (language, engine
+    mode) and reuses it for every later call, so the traineddata is loaded
+    once per worker instead of once per image and no temp files are written.
+    """
     
-    # Bilateral filter (preserves edges)
-    bilateral = cv2.bilateralFilter(gray, 11, 17, 17)
-    processed_images.append(bilateral)
+    name = 'tesserocr'
     
-    # Adaptive threshold
-    adaptive_thresh = cv2.adaptiveThreshold(
-        bilateral, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-        cv2.THRESH_BINARY, 11, 2
-    )
-    processed_images.append(adaptive_thresh)
-    
-    # OTSU threshold
-    _, otsu = cv2.threshold(bilateral, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    processed_images.append(otsu)
-    
-    # Contrast enhancement
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-    enhanced = clahe.apply(gray)
-    _, enhanced_thresh = cv2.threshold(enhanced, 150, 255, cv2.THRESH_BINARY)
-    processed_images.append(enhanced_thresh)
-    
-    # Try multiple OCR configurations
-    configs = [
-        '--oem 3 --psm 6',  # Assume a single uniform block of text
-        '--oem 3 --psm 3',  # Fully automatic page segmentation
-        '--oem 3 --psm 11 -c tessedit_char_whitelist=0123456789-'  # Single line with whitelist
-    ]
+    def __init__(self, tessdata_path=None):
+        self._tessdata_path = tessdata_path
+        self._local = threading.local()
+    
+    def _api(self, lang, oem):
+        handles = getattr(self._local, 'handles', None)
+        if handles is None:
+            handles = self._local.handles = {}
+        
+        api = handles.get((lang, oem))
+        if api is None:
+            kwargs = {'lang': lang, 'oem': tesserocr.OEM(oem)}
+            if self._tessdata_path:
+                kwargs['path'] = self._tessdata_path
+            api = tesserocr.PyTessBaseAPI(**kwargs)
+            handles[(lang, oem)] = api
+            logger.info(f"Initialized Tesseract API handle ({lang}, oem {oem}) "
+                        f"on {threading.current_thread().name}")
+        return api
+    
+    def image_to_string(self, image, config=''):
+        parsed = _parse_tesseract_config(config)
+        api = self._api(parsed['lang'], parsed['oem'])
+        api.SetPageSegMode(tesserocr.PSM(parsed['psm']))
+        for name, value in parsed['variables'].items():
+            api.SetVariable(name, value)
+        try:
+            if image.ndim == 2 and image.dtype == np.uint8:
+                image = np.ascontiguousarray(image)
+                height, width = image.shape
+                api.SetImageBytes(image.tobytes(), width, height, 1, width)
+            else:
+                api.SetImage(Image.fromarray(image))
+            return api.GetUTF8Text()
+        finally:
+            # Handles are reused, so per-call variables must not leak into the next call
+            for name in parsed['variables']:
+                api.SetVariable(name, '')
+            api.Clear()
+
+_ocr_engine = None
+_ocr_engine_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def get_ocr_engine():
+    """
+    Return the process-wide OCR engine selected by OCR_BACKEND.
     
-    # Different ID patterns to try (Pakistani ID formats)
-    patterns = [
-        r'\b\d{5}-\d{7}-\d{1}\b',     # Standard 12345-1234567-1
-        r'\b\d{5}\s*-\s*\d{7}\s*-\s*\d{1}\b',  # With possible spaces
-        r'\b\d{5}\s*\d{7}\s*\d{1}\b', # Without dashes
-        r'\b\d{13}\b'                 # All digits together
+    'tesserocr' and 'auto' use the persistent in-process API when tesserocr
+    is installed and the traineddata for OCR_LANG is available; otherwise
+    (or with 'pytesseract') calls fall back to the pytesseract subprocess backend.
+    """
+    global _ocr_engine
+    with _ocr_engine_lock:
+        if _ocr_engine is not None:
+            return _ocr_engine
+        
+        engine = None
+        if OCR_BACKEND in ('auto', 'tesserocr'):
+            if tesserocr is None:
+                logger.warning("tesserocr is not installed, falling back to pytesseract")
+            else:
+                try:
+                    if OCR_TESSDATA_PATH:
+                        _, languages = tesserocr.get_languages(OCR_TESSDATA_PATH)
+                    else:
+                        _, languages = tesserocr.get_languages()
+                    missing = [lang for lang in OCR_LANG.split('+') if lang not in languages]
+                    if missing:
+                        logger.warning(f"Tesseract traineddata missing for {missing}, falling back to pytesseract")
+                    else:
+                        engine = TesserocrOCREngine(OCR_TESSDATA_PATH)
+                except Exception as e:
+                    logger.warning(f"tesserocr unavailable ({e}), falling back to pytesseract")
+        
+        _ocr_engine = engine or PytesseractOCREngine()
+        logger.info(f"Using OCR backend: {_ocr_engine.name}")
+        return _ocr_engine
+
+# Tesseract configurations tried for every preprocessed image, in priority order
+OCR_CONFIGS = [
+    '--oem 3 --psm 6',  # Assume a single uniform block of text
+    '--oem 3 --psm 3',  # Fully automatic page segmentation
+    '--oem 3 --psm 11 -c tessedit_char_whitelist=0123456789-'  # Single line with whitelist
+]
+
+# Different ID patterns to try (Pakistani ID formats)
+ID_NUMBER_PATTERNS = [
+    r'\b\d{5}-\d{7}-\d{1}\b',     # Standard 12345-1234567-1
+    r'\b\d{5}\s*-\s*\d{7}\s*-\s*\d{1}\b',  # With possible spaces
+    r'\b\d{5}\s*\d{7}\s*\d{1}\b', # Without dashes
+    r'\b\d{13}\b'                 # All digits together
+]
+
+def _ocr_preprocessors(context):
+    """
+    Preprocessed variants of the document used for OCR, in priority order.
+    
+    Each variant is computed lazily (and memoized on the context) by the
+    worker that first needs it, so preprocessing runs in parallel as well.
+    """
+    def bilateral():
+        # Bilateral filter (preserves edges)
+        return context._memoized('ocr_bilateral', lambda: cv2.bilateralFilter(context.gray, 11, 17, 17))
+    
+    def adaptive_threshold():
+        return cv2.adaptiveThreshold(
+            bilateral(), 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
+            cv2.THRESH_BINARY, 11, 2
+        )
+    
+    def otsu():
+        _, thresh = cv2.threshold(bilateral(), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        return thresh
+    
+    def clahe_threshold():
+        # Contrast enhancement
+        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+        enhanced = clahe.apply(context.gray)
+        _, thresh = cv2.threshold(enhanced, 150, 255, cv2.THRESH_BINARY)
+        return thresh
+    
+    return [
+        ('grayscale', lambda: context.gray),
+        ('bilateral', bilateral),
+        ('adaptive_threshold', lambda: context._memoized('ocr_adaptive_threshold', adaptive_threshold)),
+        ('otsu', lambda: context._memoized('ocr_otsu', otsu)),
+        ('clahe_threshold', lambda: context._memoized('ocr_clahe_threshold', clahe_threshold)),
     ]
+
+def match_id_number(text):
+    """
+    Find a CNIC number in OCR text and normalize it to 12345-1234567-1.
     
-    all_text = ""
-    id_number = None
+    Args:
+        text (str): OCR output
+        
+    Returns:
+        str: Formatted ID number, or None if no pattern matched
+    """
+    for pattern in ID_NUMBER_PATTERNS:
+        match = re.search(pattern, text)
+        if not match:
+            continue
+        
+        raw_id = match.group(0)
+        
+        # Format it correctly (remove spaces, ensure dashes)
+        if '-' in raw_id:
+            # Already has dashes, clean up any spaces
+            return re.sub(r'\s', '', raw_id)
+        
+        digits = re.sub(r'\D', '', raw_id)
+        if len(digits) == 13:
+            return f"{digits[:5]}-{digits[5:12]}-{digits[12:]}"
     
-    # Try each image with each config
-    for img in processed_images:
-        for config in configs:
+    return None
+
+# Relative (x0, y0, x1, y1) region of each document type that holds the ID-number line
+ID_FIELD_LAYOUTS = {
+    'id_card': (0.0, 0.45, 1.0, 1.0),           # CNIC: number sits below the name/photo block
+    'passport': (0.3, 0.15, 1.0, 0.85),         # Data page: citizenship number in the right column
+    'drivers_license': (0.0, 0.25, 1.0, 0.95),  # License number is the holder's CNIC
+    'e_license': (0.0, 0.25, 1.0, 0.95),
+}
+
+# Single text line, digits only: used on the localized ID-number bands
+ROI_OCR_CONFIG = '--oem 3 --psm 7 -c tessedit_char_whitelist=0123456789-'
+
+# Width the search region is resampled to, so morphology kernels mean the same on every upload
+LOCALIZATION_WIDTH = 800
+
+def localize_id_number_bands(document, document_type=None, max_bands=None):
+    """
+    Find the text lines most likely to hold the ID number.
+    
+    Restricts the search to the document type's layout region, merges
+    characters into line blobs (black-hat + horizontal gradient + closing)
+    and keeps the line-shaped blobs whose aspect ratio is closest to a
+    15-character number.
+    
+    Args:
+        document: DocumentAnalysisContext or image
+        document_type (str): Document type, selects the layout region
+        max_bands (int): Maximum number of bands to return
+        
+    Returns:
+        List[Tuple[int, int, int, int]]: (x, y, w, h) boxes in image coordinates, best first
+    """
+    context = as_analysis_context(document)
+    max_bands = max_bands or OCR_ROI_MAX_BANDS
+    gray = context.gray
+    height, width = gray.shape[:2]
+    
+    x0, y0, x1, y1 = ID_FIELD_LAYOUTS.get(document_type, (0.0, 0.0, 1.0, 1.0))
+    left, top = int(x0 * width), int(y0 * height)
+    region = gray[top:int(y1 * height), left:int(x1 * width)]
+    if region.size == 0:
+        return []
+    
+    scale = LOCALIZATION_WIDTH / region.shape[1]
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+    small = cv2.resize(region, None, fx=scale, fy=scale, interpolation=interpolation)
+    small_h, small_w = small.shape[:2]
+    
+    # Dark text on a light background -> bright strokes, then merge characters into lines
+    blackhat = cv2.morphologyEx(small, cv2.MORPH_BLACKHAT,
+                                cv2.getStructuringElement(cv2.MORPH_RECT, (13, 5)))
+    grad = np.absolute(cv2.Sobel(blackhat, cv2.CV_32F, 1, 0, ksize=-1))
+    grad = cv2.normalize(grad, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    grad = cv2.morphologyEx(grad, cv2.MORPH_CLOSE,
+                            cv2.getStructuringElement(cv2.MORPH_RECT, (25, 5)))
+    _, thresh = cv2.threshold(grad, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    thresh = cv2.erode(thresh, None, iterations=1)
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    
+    candidates = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        aspect = w / float(h)
+        # A number line is clearly wider than tall, and neither a speck nor a whole block
+        if aspect < 4 or w < 0.15 * small_w or h < 8 or h > 0.25 * small_h:
+            continue
+        candidates.append((abs(np.log(aspect / 9.0)), x, y, w, h))
+    candidates.sort()
+    
+    bands = []
+    for _, x, y, w, h in candidates[:max_bands]:
+        pad_x, pad_y = int(w * 0.05) + 2, int(h * 0.3) + 2
+        bx0, by0 = max(0, x - pad_x), max(0, y - pad_y)
+        bx1, by1 = min(small_w, x + w + pad_x), min(small_h, y + h + pad_y)
+        bands.append((
+            left + int(bx0 / scale), top + int(by0 / scale),
+            int((bx1 - bx0) / scale), int((by1 - by0) / scale)
+        ))
+    return bands
+
+def _crop_for_line_ocr(gray, box, target_height=64):
+    """Crop a text line and scale it to a height Tesseract reads well."""
+    x, y, w, h = box
+    crop = gray[y:y + h, x:x + w]
+    if crop.size == 0:
+        return crop
+    scale = target_height / float(crop.shape[0])
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+    crop = cv2.resize(crop, None, fx=scale, fy=scale, interpolation=interpolation)
+    _, crop = cv2.threshold(crop, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return crop
+
+def _ocr_first_match(context, candidates):
+    """
+    Run OCR candidates on the shared OCR pool; the first CNIC match wins.
+    
+    Candidates are submitted in priority order. As soon as one returns text
+    containing a CNIC number, candidates still waiting in the queue are
+    cancelled and the winning pair is recorded on the context as ``ocr_match``.
+    
+    Args:
+        context (DocumentAnalysisContext): Document being read
+        candidates (list): (label, preprocess, config) tuples; preprocess returns the image
+        
+    Returns:
+        Tuple[str, List[str]]: (id_number or None, texts read, in candidate order)
+    """
+    engine = get_ocr_engine()
+    
+    def run_candidate(label, preprocess, config):
+        start = time.perf_counter()
+        image = preprocess()
+        prepared = time.perf_counter()
+        text = engine.image_to_string(image, config=config)
+        context.record_ocr_pass(label, config, prepared - start, time.perf_counter() - prepared)
+        return text
+    
+    executor = _get_executor('ocr', OCR_MAX_WORKERS)
+    futures = {}
+    for label, preprocess, config in candidates:
+        future = executor.submit(run_candidate, label, preprocess, config)
+        futures[future] = (len(futures), label, config)
+    
+    texts = {}
+    id_number = None
+    try:
+        for future in as_completed(futures):
+            index, label, config = futures[future]
             try:
-                text = pytesseract.image_to_string(img, config=config)
-                all_text += text + "\n"
-                
-                # Try each pattern on the extracted text
-                for pattern in patterns:
-                    match = re.search(pattern, text)
-                    if match:
-                        # Found a match!
-                        raw_id = match.group(0)
-                        
-                        # Format it correctly (remove spaces, ensure dashes)
-                        if '-' not in raw_id:
-                            if len(raw_id) == 13:  # Handle case without dashes
-                                id_number = f"{raw_id[:5]}-{raw_id[5:12]}-{raw_id[12:]}"
-                            else:
-                                # Try to extract just the digits and format
-                                digits = re.sub(r'\D', '', raw_id)
-                                if len(digits) == 13:
-                                    id_number = f"{digits[:5]}-{digits[5:12]}-{digits[12:]}"
-                        else:
-                            # Already has dashes, clean up any spaces
-                            id_number = re.sub(r'\s', '', raw_id)
-                        
-                        logger.info(f"Extracted ID: {id_number} using pattern {pattern}")
-                        return id_number, all_text, None
+                text = future.result()
             except Exception as e:
-                logger.error(f"OCR error with config {config}: {str(e)}")
+                logger.error(f"OCR error with {label} / config {config}: {str(e)}")
+                continue
+            
+            texts[index] = text
+            id_number = match_id_number(text)
+            if id_number:
+                context.ocr_match = {"preprocessing": label, "config": config}
+                logger.info(f"Extracted ID: {id_number} using {label} / {config}")
+                break
+    finally:
+        # First match wins: drop every candidate that has not started yet
+        cancelled = sum(1 for future in futures if future.cancel())
+        if cancelled:
+            context.count('ocr_cancelled', cancelled)
+    
+    return id_number, [texts[index] for index in sorted(texts)]
+
+def extract_id_number_and_text(document, document_type=None, include_text=False, full_page_fallback=None):
+    """
+    Enhanced ID extraction with multiple preprocessing techniques
+    and pattern recognition approaches.
+    
+    The fast path localizes the ID-number line for the document type and
+    OCRs only those crops in single-line, digit-whitelist mode. Full-page
+    OCR (every preprocessing/config combination) runs only when the caller
+    asks for the page text or, with OCR_FULL_PAGE_FALLBACK, when no band
+    yielded a number.
+    
+    Args:
+        document: DocumentAnalysisContext or base64 encoded image
+        document_type (str): Document type, selects the ID-number layout
+        include_text (bool): Also OCR the full page and return its text
+        full_page_fallback (bool): Fall back to full-page OCR when no band
+            matched; defaults to OCR_FULL_PAGE_FALLBACK
+        
+    Returns:
+        Tuple[str, str, str]: (id_number, ocr_text, error)
+    """
+    context = as_analysis_context(document)
+    if context.bgr is None:
+        return None, None, "Image decode failed"
+    if full_page_fallback is None:
+        full_page_fallback = OCR_FULL_PAGE_FALLBACK
+    
+    texts = []
+    id_number = None
+    
+    # Fast path: only the localized ID-number band(s)
+    bands = localize_id_number_bands(context, document_type)
+    context.count('id_bands', len(bands))
+    if bands:
+        id_number, band_texts = _ocr_first_match(context, [
+            (f"id_band_{index + 1}", lambda box=box: _crop_for_line_ocr(context.gray, box), ROI_OCR_CONFIG)
+            for index, box in enumerate(bands)
+        ])
+        texts.extend(band_texts)
+    
+    # Slow path: full-page OCR
+    if id_number is None and (include_text or full_page_fallback):
+        logger.info("ID number not found in localized bands, running full-page OCR")
+        context.count('full_page_ocr')
+        id_number, page_texts = _ocr_first_match(context, [
+            (preprocessing, preprocess, config)
+            for preprocessing, preprocess in _ocr_preprocessors(context)
+            for config in OCR_CONFIGS
+        ])
+        texts.extend(page_texts)
+    elif include_text:
+        texts.append(get_ocr_engine().image_to_string(context.gray, config='--oem 3 --psm 3'))
+    
+    all_text = "\n".join(texts)
+    if id_number:
+        return id_number, all_text, None
     
     # If we got here, no ID was found
     return None, all_text, "No ID pattern matched"
 
-def detect_security_features_opencv(image_b64: str):
+# Security feature detectors, in the order their features are reported
+SECURITY_FEATURE_DETECTORS = []
+
+def security_feature_detector(name):
     """
-    Enhanced security feature detection with improved
-    smart chip recognition and additional features.
+    Register a security feature detector.
+    
+    A detector takes a DocumentAnalysisContext and returns the name of the
+    feature it found, or None. Detectors must be independent of each other:
+    they run concurrently and share only the context's memoized intermediates.
     """
-    image = decode_base64_image(image_b64)
-    if image is None:
-        return [], "Image decode failed"
+    def decorator(fn):
+        SECURITY_FEATURE_DETECTORS.append((name, fn))
+        return fn
+    return decorator
+
+def contour_bounding_boxes(contours):
+    """
+    Bounding boxes of many contours at once.
     
-    features = []
+    Same result as cv2.boundingRect on every contour, computed with one
+    min/max reduction over the concatenated points instead of a Python loop.
     
-    # Convert to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    Args:
+        contours (Sequence[np.ndarray]): Contours from cv2.findContours
+        
+    Returns:
+        np.ndarray: (N, 4) array of x, y, w, h
+    """
+    if len(contours) == 0:
+        return np.empty((0, 4), dtype=np.int32)
+    lengths = np.fromiter((len(contour) for contour in contours), dtype=np.intp, count=len(contours))
+    points = np.concatenate(contours).reshape(-1, 2)
+    starts = np.concatenate(([0], np.cumsum(lengths[:-1])))
+    mins = np.minimum.reduceat(points, starts, axis=0)
+    maxs = np.maximum.reduceat(points, starts, axis=0)
+    return np.hstack([mins, maxs - mins + 1])
+
+# Smart chip shape: bounding box aspect ratio and share of the image area
+CHIP_ASPECT_RANGE = (1.2, 2.0)
+CHIP_AREA_RATIO_RANGE = (0.01, 0.15)
+CHIP_MIN_GOLD_AREA = 400
+
+def find_chip_rectangle(context):
+    """
+    Find a chip-like rectangle among the document's contours.
     
-    # 1. Enhanced Smart Chip Detection (more reliable)
-    # We'll use multiple approaches and combine results
-    chip_detected = False
+    Contours are first filtered in bulk on their bounding boxes: a contour
+    whose box is smaller than the minimum chip area cannot contain one (its
+    polygon approximation only keeps some of its points), so the per-contour
+    polygon approximation runs on the few survivors only.
     
-    # Method 1: Rectangle detection
-    edges = cv2.Canny(gray, 100, 200)
-    dilated = cv2.dilate(edges, None, iterations=1)
-    contours, _ = cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    Args:
+        context (DocumentAnalysisContext): Document being analyzed
+        
+    Returns:
+        Tuple[int, int, int, int]: (x, y, w, h) of the chip, or None
+    """
+    contours = context.contours
+    context.count('contours', len(contours))
+    boxes = contour_bounding_boxes(contours)
+    min_area = CHIP_AREA_RATIO_RANGE[0] * context.pixel_count
+    survivors = np.flatnonzero(boxes[:, 2].astype(np.int64) * boxes[:, 3] >= min_area)
+    context.count('chip_candidates', len(survivors))
     
-    for contour in contours:
+    for index in survivors:
+        contour = contours[index]
         peri = cv2.arcLength(contour, True)
         approx = cv2.approxPolyDP(contour, 0.02 * peri, True)
         
@@ -336,114 +1530,265 @@ def detect_security_features_opencv(image_b64: str):
         if 4 <= len(approx) <= 6:
             x, y, w, h = cv2.boundingRect(approx)
             
-            # Chips typically have aspect ratios around 1.5-1.8
+            # Chips typically have aspect ratios around 1.5-1.8 and are
+            # small-to-medium sized on ID cards
             aspect_ratio = float(w) / h
-            
-            # Chips are usually small-to-medium sized on ID cards
-            img_area = image.shape[0] * image.shape[1]
-            contour_area = w * h
-            area_ratio = contour_area / img_area
-            
-            # Check if it looks like a chip
-            if 1.2 <= aspect_ratio <= 2.0 and 0.01 <= area_ratio <= 0.15:
-                chip_detected = True
-                logger.info(f"Chip detected via contour method: size {w}x{h}, ratio {aspect_ratio:.2f}")
-                break
+            area_ratio = (w * h) / context.pixel_count
+            if (CHIP_ASPECT_RANGE[0] <= aspect_ratio <= CHIP_ASPECT_RANGE[1]
+                    and CHIP_AREA_RATIO_RANGE[0] <= area_ratio <= CHIP_AREA_RATIO_RANGE[1]):
+                return x, y, w, h
+    return None
+
+def find_gold_chip_region(context):
+    """
+    Find a gold/yellow region shaped like a chip.
     
-    # Method 2: Template matching approach
-    if not chip_detected:
-        # Create a simple chip template (gold/yellow rectangle)
-        template_width, template_height = 40, 25
-        template = np.ones((template_height, template_width, 3), dtype=np.uint8)
-        # Gold/yellow color typical for chips
-        template[:, :] = (0, 215, 255)  # BGR format
-        
-        # Convert image to HSV for better color matching
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-        
-        # Define gold/yellow color range for chips
-        lower_gold = np.array([20, 100, 100])
-        upper_gold = np.array([30, 255, 255])
-        
-        # Create mask for gold/yellow regions
-        mask = cv2.inRange(hsv, lower_gold, upper_gold)
-        gold_areas = cv2.countNonZero(mask)
-        
-        # If we have significant gold/yellow areas, check their shape
-        if gold_areas > 100:
-            # Find contours in the mask
-            gold_contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            
-            for contour in gold_contours:
-                x, y, w, h = cv2.boundingRect(contour)
-                aspect_ratio = float(w) / h
-                area = w * h
-                
-                # Check if this gold area has chip-like properties
-                if 1.2 <= aspect_ratio <= 2.0 and area >= 400:
-                    chip_detected = True
-                    logger.info(f"Chip detected via color method: size {w}x{h}, ratio {aspect_ratio:.2f}")
-                    break
-    
-    if chip_detected:
-        features.append("Smart chip detected")
-    
-    # 2. Hologram detection (frequency domain analysis)
-    dft = cv2.dft(np.float32(gray), flags=cv2.DFT_COMPLEX_OUTPUT)
-    dft_shift = np.fft.fftshift(dft)
-    magnitude_spectrum = 20 * np.log(cv2.magnitude(dft_shift[:,:,0], dft_shift[:,:,1]))
-    
-    spectrum_mean = np.mean(magnitude_spectrum)
-    if spectrum_mean > 90:
-        features.append("Hologram/reflective elements detected")
-        logger.info(f"Hologram detected: spectrum mean {spectrum_mean:.2f}")
-    
-    # 3. Microtext detection (edge density and patterns)
-    edges = cv2.Canny(gray, 100, 200)
+    Args:
+        context (DocumentAnalysisContext): Document being analyzed
+        
+    Returns:
+        Tuple[int, int, int, int]: (x, y, w, h) of the region, or None
+    """
+    # Define gold/yellow color range for chips (HSV for better color matching)
+    lower_gold = np.array([20, 100, 100])
+    upper_gold = np.array([30, 255, 255])
+    mask = cv2.inRange(context.hsv, lower_gold, upper_gold)
+    
+    # Only look at shapes if there is a significant gold/yellow area
+    if cv2.countNonZero(mask) <= 100:
+        return None
+    
+    gold_contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    boxes = contour_bounding_boxes(gold_contours)
+    widths, heights = boxes[:, 2].astype(np.float64), boxes[:, 3].astype(np.float64)
+    aspect_ratios = widths / heights
+    matches = np.flatnonzero(
+        (aspect_ratios >= CHIP_ASPECT_RANGE[0]) & (aspect_ratios <= CHIP_ASPECT_RANGE[1])
+        & (widths * heights >= CHIP_MIN_GOLD_AREA)
+    )
+    if len(matches) == 0:
+        return None
+    return tuple(int(value) for value in boxes[matches[0]])
+
+@security_feature_detector('smart_chip')
+def _detect_smart_chip(context):
+    """Enhanced smart chip detection: rectangle contours, then gold color regions."""
+    # Method 1: Rectangle detection
+    box = find_chip_rectangle(context)
+    method = 'contour'
+    
+    # Method 2: Color matching approach
+    if box is None:
+        box = find_gold_chip_region(context)
+        method = 'color'
+    
+    if box is None:
+        return None
+    
+    _, _, w, h = box
+    logger.info(f"Chip detected via {method} method: size {w}x{h}, ratio {w / h:.2f}")
+    return "Smart chip detected"
+
+@security_feature_detector('hologram')
+def _detect_hologram(context):
+    """Hologram detection (frequency domain analysis)."""
+    spectral = context.spectral_features
+    spectrum_mean = spectral["mean_log_magnitude"]
+    if spectrum_mean > HOLOGRAM_MIN_SPECTRUM_MEAN:
+        logger.info(f"Hologram detected: spectrum mean {spectrum_mean:.2f}, band energy {spectral['band_energy']}")
+        return "Hologram/reflective elements detected"
+    return None
+
+@security_feature_detector('microtext')
+def _detect_microtext(context):
+    """Microtext detection (edge density and patterns)."""
+    edges = context.edges
     edge_density = np.count_nonzero(edges) / (edges.shape[0] * edges.shape[1])
     
     if edge_density > 0.1:  # 10% of pixels are edges
-        features.append("Microtext/fine pattern elements detected")
         logger.info(f"Microtext detected: edge density {edge_density:.3f}")
-    
-    # 4. Watermark detection (variation in brightness)
-    std_dev = np.std(gray)
+        return "Microtext/fine pattern elements detected"
+    return None
+
+@security_feature_detector('watermark')
+def _detect_watermark(context):
+    """Watermark detection (variation in brightness)."""
+    std_dev = np.std(context.gray)
     if std_dev > 45:
-        features.append("Watermark pattern detected")
         logger.info(f"Watermark detected: std dev {std_dev:.2f}")
+        return "Watermark pattern detected"
+    return None
+
+@security_feature_detector('uv_elements')
+def _detect_uv_elements(context):
+    """
+    UV reactive ink (simulated in visible spectrum).
     
-    # 5. UV reactive ink (simulated in visible spectrum)
-    # In real life, you'd use UV light - this is a simplified approach
-    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    
+    In real life, you'd use UV light - this is a simplified approach.
+    """
     # Typical UV ink appears in blue-violet spectrum
     lower_blue = np.array([100, 50, 50])
     upper_blue = np.array([140, 255, 255])
-    blue_mask = cv2.inRange(hsv, lower_blue, upper_blue)
-    
-    blue_pixels = np.count_nonzero(blue_mask)
-    blue_ratio = blue_pixels / (image.shape[0] * image.shape[1])
+    blue_mask = cv2.inRange(context.hsv, lower_blue, upper_blue)
     
+    blue_ratio = np.count_nonzero(blue_mask) / context.pixel_count
     if blue_ratio > 0.05:  # 5% of image has UV-like colors
-        features.append("UV-reactive elements detected")
         logger.info(f"UV elements detected: ratio {blue_ratio:.3f}")
+        return "UV-reactive elements detected"
+    return None
+
+def detect_security_features_opencv(document, detectors=None):
+    """
+    Enhanced security feature detection with improved
+    smart chip recognition and additional features.
+    
+    Every registered detector runs concurrently on the shared detector
+    pool (OpenCV releases the GIL), so wall time is roughly that of the
+    slowest detector. Features are merged in registration order, whatever
+    order the detectors finish in. A failing detector is logged and skipped.
+    
+    Args:
+        document: DocumentAnalysisContext or base64 encoded image
+        detectors (Iterable[str], optional): Names of the detectors to run,
+            e.g. from DOCUMENT_PROFILES; all of them by default
+        
+    Returns:
+        Tuple[List[str], str]: (features, error)
+    """
+    context = as_analysis_context(document)
+    if context.bgr is None:
+        return [], "Image decode failed"
+    
+    def run_detector(name, detector):
+        start = time.perf_counter()
+        try:
+            return detector(context)
+        finally:
+            context.record_detector(name, time.perf_counter() - start)
+    
+    selected = [
+        (name, detector) for name, detector in SECURITY_FEATURE_DETECTORS
+        if detectors is None or name in detectors
+    ]
+    if len(selected) < len(SECURITY_FEATURE_DETECTORS):
+        context.count('detectors_skipped', len(SECURITY_FEATURE_DETECTORS) - len(selected))
+    
+    executor = _get_executor('detectors', DETECTOR_MAX_WORKERS)
+    futures = [
+        (name, executor.submit(run_detector, name, detector))
+        for name, detector in selected
+    ]
+    
+    features = []
+    for name, future in futures:
+        try:
+            feature = future.result()
+        except Exception as e:
+            logger.error(f"Security feature detector {name} failed: {e}")
+            context.count('detector_errors')
+            continue
+        if feature:
+            features.append(feature)
     
     return features, None
 
-def verify_document(document_data: str, document_type: str) -> dict:
+def _log_verification_metrics(context, document_type, status):
+    """Emit the document's metrics as one structured (JSON) log line."""
+    record = dict(context.metrics(), document_type=document_type, status=status)
+    logger.info(f"verification_metrics {json.dumps(record, sort_keys=True)}")
+
+def verify_document(document_data, document_type: str, include_ocr_text: bool = False,
+                    on_stage=None, request_id=None) -> dict:
     """
     Real document verification using OpenCV and Tesseract OCR.
     Extracts ID number, detects security features, and returns a detailed result.
     
     Smart chip detection gives +15% to confidence score.
     Documents with 70%+ confidence are marked as "potentially valid".
+    
+    The document is first matched against the reference templates
+    (classify_document). A recognised type selects the detectors and OCR
+    passes that run (DOCUMENT_PROFILES), and a driver's license that turns
+    out to be a screen capture is verified as an e_license. The outcome is
+    reported under "classification".
+    
+    The result carries the per-stage timings and counters under "metrics";
+    callers decide who may see them. Unless verification failed it also
+    carries the image's "perceptual_hash", for near-duplicate lookups.
+    
+    Args:
+        document_data: Base64 encoded image, raw image bytes or a DocumentAnalysisContext
+        document_type (str): Type of document being verified
+        include_ocr_text (bool): Run the slower full-page OCR and return its text as ocr_text
+        on_stage (callable, optional): Called with the name of each pipeline stage as it starts
+        request_id (str, optional): ID of the originating request, tags logs and metrics
     """
+    # Decode lazily; every detector reads from the shared context
+    context = as_analysis_context(document_data)
+    if request_id:
+        context.request_id = request_id
+    
+    def report_stage(stage):
+        context.begin_stage(stage)
+        if on_stage:
+            on_stage(stage)
+    
     try:
+        report_stage('decoding')
+        context.bgr  # Decode up front so the 'decoding' stage covers it
+        
+        # Reject unusable photos before paying for OCR and feature detection
+        quality_gate = None
+        if QUALITY_GATE_ENABLED:
+            report_stage('quality_gate')
+            quality_gate = assess_image_usability(context, document_type)
+            if not quality_gate["passed"]:
+                logger.info(f"Quality gate rejected document: {quality_gate['issues']}")
+                context.count('quality_gate_rejected')
+                context.begin_stage(None)
+                _log_verification_metrics(context, document_type, "invalid")
+                return {
+                    "status": "invalid",
+                    "message": "Image quality is too low for verification",
+                    "confidence_score": 0,
+                    "security_features": [],
+                    "recommendations": list(quality_gate["issues"]),
+                    "detailed_analysis": {
+                        "image_quality": {"score": 0, "findings": quality_gate["issues"]},
+                        "risk_factors": {"score": 0, "findings": ["Image not usable for verification"]}
+                    },
+                    "quality_gate": quality_gate,
+                    "perceptual_hash": context.perceptual_hash,
+                    "metrics": context.metrics()
+                }
+        
+        # Recognise the document; its type decides which checks are worth running
+        report_stage('classification')
+        classification = classify_document(context)
+        detected_type = classification["document_type"]
+        requested_type = document_type
+        if detected_type == 'e_license' and document_type == 'drivers_license':
+            logger.info("Document looks like a digital license, using specialized verification rules")
+            document_type = 'e_license'
+        profile = DOCUMENT_PROFILES.get(detected_type, {"detectors": None, "full_page_ocr": True})
+        classification.update(requested_type=requested_type, verified_as=document_type)
+        
         # Extract ID number and OCR text
-        id_number, ocr_text, id_error = extract_id_number_and_text(document_data)
+        report_stage('ocr')
+        id_number, ocr_text, id_error = extract_id_number_and_text(
+            context, document_type=document_type, include_text=include_ocr_text,
+            full_page_fallback=profile["full_page_ocr"] and OCR_FULL_PAGE_FALLBACK
+        )
+        if context.ocr_match:
+            logger.info(f"OCR candidate matched: {context.ocr_match}")
         # Detect security features
-        security_features, sec_error = detect_security_features_opencv(document_data)
+        report_stage('security_features')
+        security_features, sec_error = detect_security_features_opencv(context, detectors=profile["detectors"])
+        # Error Level Analysis and other manipulation checks
+        report_stage('authenticity')
+        is_authentic, authenticity_risks = check_document_authenticity(context, document_type)
         
+        report_stage('scoring')        
         # New sophisticated scoring system
         # Base score is now randomized to simulate real-world variation
         import random
@@ -549,6 +1894,10 @@ def verify_document(document_data: str, document_type: str) -> dict:
             penalties["security_detection_error"] = random.randint(5, 8)
             logger.info(f"Security feature detection issue: -{penalties['security_detection_error']}%")
         
+        if not is_authentic:
+            penalties["manipulation_suspected"] = random.randint(10, 15)
+            logger.info(f"Manipulation suspected penalty: -{penalties['manipulation_suspected']}%")
+        
         # Calculate total penalties
         total_penalties = sum(penalties.values())
         
@@ -612,6 +1961,7 @@ def verify_document(document_data: str, document_type: str) -> dict:
             detailed_analysis["risk_factors"]["findings"].append("Issues with ID number extraction")
         if "security_detection_error" in penalties:
             detailed_analysis["risk_factors"]["findings"].append("Problems detecting document security elements")
+        detailed_analysis["risk_factors"]["findings"].extend(authenticity_risks)
         
         # If no explicit risk factors, add appropriate message
         if not detailed_analysis["risk_factors"]["findings"]:
@@ -632,6 +1982,9 @@ def verify_document(document_data: str, document_type: str) -> dict:
             recommendations.append("Document failed verification; please provide a valid document")
         if score_components["data_consistency"] == 0:
             recommendations.append("Data consistency check failed; verify document content manually")
+        if detected_type and detected_type != document_type:
+            recommendations.append(f"Document looks like a {detected_type.replace('_', ' ')}, "
+                                   f"not the {document_type.replace('_', ' ')} selected; check the document type")
         
         # Add detailed breakdown for backend logging
         logger.info(f"Score breakdown: {score_components}")
@@ -647,6 +2000,13 @@ def verify_document(document_data: str, document_type: str) -> dict:
                 "issuing_authority": "NADRA" if any("NADRA" in feature for feature in security_features) else "Unknown Authority"
             }
         
+        # ELA levels are memoized on the context by the authenticity check
+        try:
+            error_levels = {str(quality): round(level, 2)
+                            for quality, level in error_level_analysis(context).items()}
+        except Exception:
+            error_levels = {}
+        
         # Build full result structure
         result = {
             "status": status,
@@ -655,64 +2015,55 @@ def verify_document(document_data: str, document_type: str) -> dict:
             "security_features": security_features,
             "recommendations": recommendations,
             "detailed_analysis": detailed_analysis,
-            "id_card_data": id_card_data
+            "id_card_data": id_card_data,
+            "ocr_match": context.ocr_match,
+            "quality_gate": quality_gate,
+            "classification": classification,
+            "error_level_analysis": {
+                "is_authentic": is_authentic,
+                "error_levels": error_levels
+            },
+            "perceptual_hash": context.perceptual_hash
         }
+        if include_ocr_text:
+            result["ocr_text"] = ocr_text or ""
         
         # Add error information if available
         if id_error:
             result["recommendations"].append(f"ID extraction note: {id_error}")
         if sec_error:
             result["recommendations"].append(f"Security feature note: {sec_error}")
-            
+        
+        context.begin_stage(None)
+        _log_verification_metrics(context, document_type, status)
+        result["metrics"] = context.metrics()
         return result
     except Exception as e:
-        logger.error(f"Error in verify_document: {e}")
+        logger.error(f"Error in verify_document (request {context.request_id}): {e}")
+        context.begin_stage(None)
+        _log_verification_metrics(context, document_type, "error")
         return {
             "status": "error",
             "confidence_score": 0,
             "security_features": [],
-            "recommendations": [f"Verification failed: {str(e)}"]
+            "recommendations": [f"Verification failed: {str(e)}"],
+            "metrics": context.metrics()
         }
 
-def detect_chip(image: np.ndarray) -> bool:
+def detect_chip(image) -> bool:
     """
     Detect if the image contains a smart chip, common on ID cards.
     
+    Uses the same detection as the smart chip security feature.
+    
     Args:
-        image (np.ndarray): Document image
+        image (np.ndarray | DocumentAnalysisContext): Document image or its analysis context
         
     Returns:
         bool: True if a chip is detected, False otherwise
     """
     try:
-        # Convert to grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        
-        # Apply edge detection to find chip outlines
-        edges = cv2.Canny(gray, 50, 150)
-        
-        # Look for rectangular patterns that could be chips
-        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        for contour in contours:
-            # Approximate the contour shape
-            peri = cv2.arcLength(contour, True)
-            approx = cv2.approxPolyDP(contour, 0.02 * peri, True)
-            
-            # A chip is roughly rectangular (4 corners)
-            if len(approx) == 4:
-                x, y, w, h = cv2.boundingRect(approx)
-                
-                # Check if the size is appropriate for a chip (in relation to the image size)
-                img_area = image.shape[0] * image.shape[1]
-                contour_area = w * h
-                
-                # Chip typically takes up 2-8% of ID card area
-                ratio = contour_area / img_area
-                if 0.02 <= ratio <= 0.08:
-                    return True
-        
-        return False
+        return _detect_smart_chip(as_analysis_context(image)) is not None
     except Exception as e:
         logger.error(f"Error detecting chip: {e}")
         return False
@@ -721,69 +2072,32 @@ def detect_nadra_pattern(image: np.ndarray) -> bool:
     """
     Detect if an image contains patterns typical of a Pakistani NADRA ID.
     
-    This is a simplified implementation for the demo. In production,
-    this would be replaced with a trained AI model for document classification
-    and feature detection.
+    The image is matched against the reference templates (see
+    classify_document). Without a template store only the shape of an
+    ID-1 card can be checked.
     
     Args:
-        image: OpenCV/numpy image array
+        image: OpenCV/numpy image array or DocumentAnalysisContext
         
     Returns:
         bool: True if NADRA patterns are detected
     """
     try:
-        logger.info(f"Starting NADRA detection on image of type {type(image)}")
-        
-        # For demo purposes, we'll make this much more permissive
-        # since we know the user is trying to upload a Pakistani ID
-        
-        # In production, this would be a ML model trained on thousands of ID card images
-        # with feature extraction, image segmentation, and pattern recognition
-        
-        # Basic sanity check - is image valid?
-        if image is None:
-            logger.error("Image is None - detection failed")
-            return False
-            
-        if not isinstance(image, np.ndarray):
-            logger.error(f"Invalid image type: {type(image)}")
+        context = as_analysis_context(image)
+        if context.bgr is None:
+            logger.error("Image could not be decoded - detection failed")
             return False
         
-        # Log image dimensions for debugging
-        if len(image.shape) < 2:
-            logger.error(f"Invalid image shape: {image.shape}")
-            return False
-            
-        height, width = image.shape[:2]
-        logger.info(f"Image dimensions for ID detection: {width}x{height}, shape: {image.shape}")
+        classification = classify_document(context)
+        if classification["templates"]:
+            return classification["document_type"] == 'id_card'
         
-        # Basic validation - don't process tiny images or invalid dimensions
-        if width < 100 or height < 100:
-            logger.error(f"Image too small: {width}x{height}")
-            return False
-            
-        # Calculate aspect ratio
-        aspect_ratio = width / height
-        logger.info(f"Image aspect ratio: {aspect_ratio:.2f}")
-        
-        # For demo purposes, be more permissive with aspect ratio
-        # ID cards have aspect ratios roughly between 1.4 and 1.7
-        # But for demo we'll accept a wider range
-        if 1.0 <= aspect_ratio <= 2.0:
-            logger.info("Image dimensions compatible with ID card format")
-            
-            # For the demo, we'll make this more permissive
-            # ALWAYS detect as true in the demo when ID card is selected
-            # In production, we would use a real ML model
-            logger.info("Identifying as Pakistani ID card for demo purposes")
-            return True
-            
-        logger.info(f"Image aspect ratio {aspect_ratio:.2f} outside expected range")
-        return False
+        height, width = context.bgr.shape[:2]
+        low, high = DOCUMENT_ASPECT_RANGES['id_card']
+        return low <= max(width, height) / float(min(width, height)) <= high
     except Exception as e:
         logger.error(f"Error in NADRA detection: {str(e)}")
-        # Be permissive in the demo - if there's any error, accept the document
-        return True
+        return False
 
 def simulate_ai_verification(profile_data):
     """
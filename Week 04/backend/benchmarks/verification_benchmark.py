@@ -0,0 +1,337 @@
+"""
+Benchmark suite for the document verification pipeline.
+
+Generates synthetic ID-card, passport and driver's-license images locally
+at several resolutions and JPEG qualities, times each pipeline stage and
+reports p50/p95 latency, throughput per core and peak RSS. Each stage of
+each scenario runs in a freshly spawned interpreter, so its peak RSS is its
+own and not the high-water mark of everything benchmarked before it.
+Results are written as JSON so runs can be compared for regressions.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.verification_benchmark --output bench.json
+    python -m benchmarks.verification_benchmark --output new.json --compare bench.json
+
+Comparison exits with status 1 when any stage's p50 regressed by more
+than --threshold (default 10%).
+"""
+import os
+import sys
+import json
+import time
+import base64
+import random
+import argparse
+import platform
+import resource
+import importlib.util
+import multiprocessing
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def load_verification_utils():
+    """
+    Load the verification module straight from its file.
+
+    Importing it through the ``app`` package would run create_app() and
+    connect to Firebase, which is not needed to time image processing.
+    """
+    path = os.path.join(BACKEND_DIR, 'app', 'utils', 'verification_utils.py')
+    spec = importlib.util.spec_from_file_location('verification_utils', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+vu = load_verification_utils()
+
+# Width/height ratios of the physical documents
+ASPECT_RATIOS = {
+    'id_card': 85.6 / 54.0,          # ID-1 card
+    'drivers_license': 85.6 / 54.0,
+    'passport': 125.0 / 88.0,        # ID-3 data page
+}
+
+STAGES = ['decode', 'ocr', 'security_features', 'verify_document']
+
+
+def generate_document(document_type, width, rng):
+    """
+    Draw a synthetic document image.
+
+    Args:
+        document_type (str): id_card, passport or drivers_license
+        width (int): Image width in pixels
+        rng (random.Random): Source of randomness for the printed data
+
+    Returns:
+        np.ndarray: BGR image
+    """
+    height = int(round(width / ASPECT_RATIOS[document_type]))
+    s = width / 1000.0  # Drawing scale relative to a 1000px wide document
+
+    # Pale background with a soft gradient and print noise
+    gradient = np.linspace(215, 245, width, dtype=np.float32)
+    image = np.dstack([
+        np.tile(gradient, (height, 1)) * factor for factor in (0.92, 1.0, 0.95)
+    ])
+    image += np.random.default_rng(rng.randrange(2 ** 32)).normal(0, 4, image.shape)
+    image = np.clip(image, 0, 255).astype(np.uint8)
+
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    ink = (40, 40, 40)
+    cnic = f"{rng.randint(10000, 99999)}-{rng.randint(1000000, 9999999)}-{rng.randint(0, 9)}"
+
+    # Header band and guilloche-like background pattern
+    header_color = (60, 120, 40) if document_type != 'passport' else (90, 60, 30)
+    cv2.rectangle(image, (0, 0), (width, int(110 * s)), header_color, -1)
+    cv2.putText(image, document_type.replace('_', ' ').upper(), (int(30 * s), int(75 * s)),
+                font, 1.4 * s, (255, 255, 255), max(1, int(3 * s)), cv2.LINE_AA)
+    for radius in range(int(40 * s), int(400 * s), max(2, int(18 * s))):
+        cv2.circle(image, (int(width * 0.7), int(height * 0.55)), radius, (200, 170, 150), 1, cv2.LINE_AA)
+
+    # Photo
+    cv2.rectangle(image, (int(40 * s), int(150 * s)), (int(260 * s), int(430 * s)), (150, 150, 160), -1)
+
+    if document_type == 'id_card':
+        # Gold smart chip
+        cv2.rectangle(image, (int(300 * s), int(170 * s)), (int(390 * s), int(230 * s)), (40, 190, 230), -1)
+
+    lines = ['Name  MUHAMMAD ALI', 'Father Name  AHMED ALI', 'Gender M   Country PAKISTAN']
+    for index, text in enumerate(lines):
+        cv2.putText(image, text, (int(300 * s), int((270 + index * 45) * s)),
+                    font, 0.8 * s, ink, max(1, int(2 * s)), cv2.LINE_AA)
+
+    number_y = int(height * (0.82 if document_type != 'passport' else 0.55))
+    cv2.putText(image, cnic, (int(300 * s), number_y), font, 1.1 * s, ink, max(1, int(2 * s)), cv2.LINE_AA)
+
+    if document_type == 'passport':
+        # Machine readable zone
+        mrz = ['P<PAKALI<<MUHAMMAD<<<<<<<<<<<<<<<<<<<<<<<<<<<', f"AB{rng.randint(1000000, 9999999)}<0PAK{cnic.replace('-', '')}"]
+        for index, text in enumerate(mrz):
+            cv2.putText(image, text, (int(30 * s), int(height - (90 - index * 40) * s)),
+                        cv2.FONT_HERSHEY_PLAIN, 1.6 * s, ink, max(1, int(2 * s)), cv2.LINE_AA)
+
+    # Camera softness
+    return cv2.GaussianBlur(image, (3, 3), 0)
+
+
+def encode_document(image, quality):
+    """Encode an image as a base64 JPEG data URL, like the frontend uploads."""
+    success, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not success:
+        raise RuntimeError("JPEG encoding failed")
+    return 'data:image/jpeg;base64,' + base64.b64encode(encoded.tobytes()).decode('ascii')
+
+
+def run_stage(stage, payload, decoded, document_type):
+    """Run one pipeline stage on a fresh analysis context."""
+    if stage == 'decode':
+        vu.decode_base64_image(payload)
+    elif stage == 'ocr':
+        vu.extract_id_number_and_text(vu.DocumentAnalysisContext(decoded), document_type=document_type)
+    elif stage == 'security_features':
+        vu.detect_security_features_opencv(vu.DocumentAnalysisContext(decoded))
+    elif stage == 'verify_document':
+        vu.verify_document(payload, document_type)
+
+
+def cpu_seconds():
+    """CPU time of this process plus waited-for children (tesseract subprocesses)."""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process and its children over their lifetime, in MB.
+
+    Where /proc is available this process's own peak is VmHWM, which starts
+    over at exec. ru_maxrss also keeps the peak of the process it was forked
+    from, which would count the benchmark driver in every spawned scenario.
+    """
+    scale = 1024 if sys.platform == 'darwin' else 1  # ru_maxrss is bytes on macOS, KB on Linux
+    self_kb = _vm_hwm_kb() or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return round(max(self_kb, children_kb) / 1024, 1)
+
+
+def _vm_hwm_kb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def benchmark_stage(stage, payload, decoded, document_type, iterations, warmup):
+    for _ in range(warmup):
+        run_stage(stage, payload, decoded, document_type)
+
+    latencies = []
+    cpu_start = cpu_seconds()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        run_stage(stage, payload, decoded, document_type)
+        latencies.append((time.perf_counter() - start) * 1000)
+    cpu_used = cpu_seconds() - cpu_start
+
+    return {
+        'iterations': iterations,
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'mean_ms': round(sum(latencies) / len(latencies), 2),
+        # Documents per CPU-second: independent of how many threads a stage fans out to
+        'throughput_per_core': round(iterations / cpu_used, 3) if cpu_used > 0 else None,
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def measure_stage(stage, payload, document_type, iterations, warmup):
+    """
+    Benchmark one stage of one scenario in a fresh interpreter.
+
+    ru_maxrss never goes down during a process's life, so measured in this
+    process every scenario would report the largest one run before it. A
+    spawned process starts from the same baseline (interpreter, OpenCV,
+    NumPy and the pipeline module) for every scenario.
+    """
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(_benchmark_isolated, (stage, payload, document_type, iterations, warmup))
+
+
+def _benchmark_isolated(stage, payload, document_type, iterations, warmup):
+    decoded = vu.decode_base64_image(payload)
+    return benchmark_stage(stage, payload, decoded, document_type, iterations, warmup)
+
+
+def run_benchmarks(args):
+    rng = random.Random(args.seed)
+    results = []
+
+    for document_type in args.document_types:
+        for width in args.resolutions:
+            image = generate_document(document_type, width, rng)
+            for quality in args.qualities:
+                payload = encode_document(image, quality)
+                scenario = f"{document_type}-{width}px-q{quality}"
+
+                for stage in args.stages:
+                    stats = measure_stage(stage, payload, document_type, args.iterations, args.warmup)
+                    stats.update({
+                        'scenario': scenario,
+                        'stage': stage,
+                        'document_type': document_type,
+                        'width': width,
+                        'height': image.shape[0],
+                        'jpeg_quality': quality,
+                        'payload_bytes': len(payload)
+                    })
+                    results.append(stats)
+                    print(f"{scenario:<32} {stage:<18} p50 {stats['p50_ms']:>9.1f} ms  "
+                          f"p95 {stats['p95_ms']:>9.1f} ms  {stats['throughput_per_core'] or 0:>7.2f} docs/cpu-s  "
+                          f"rss {stats['peak_rss_mb']:>7.1f} MB")
+
+    return {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'pipeline_version': vu.PIPELINE_VERSION,
+            'ocr_backend': vu.get_ocr_engine().name,
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'iterations': args.iterations,
+            'seed': args.seed
+        },
+        # Largest per-scenario peak; this process only generates the images
+        'peak_rss_mb': max((result['peak_rss_mb'] for result in results), default=None),
+        'results': results
+    }
+
+
+def compare_runs(current, baseline, threshold):
+    """
+    Print p50 changes against a baseline run.
+
+    Returns:
+        list: (scenario, stage, change) for every regression above threshold
+    """
+    previous = {(r['scenario'], r['stage']): r for r in baseline['results']}
+    regressions = []
+
+    print(f"\nComparison against baseline from {baseline['meta'].get('timestamp')} "
+          f"(pipeline {baseline['meta'].get('pipeline_version')})")
+    for result in current['results']:
+        key = (result['scenario'], result['stage'])
+        if key not in previous or not previous[key]['p50_ms']:
+            continue
+        change = (result['p50_ms'] - previous[key]['p50_ms']) / previous[key]['p50_ms']
+        marker = '  REGRESSION' if change > threshold else ''
+        print(f"{key[0]:<32} {key[1]:<18} {previous[key]['p50_ms']:>9.1f} -> {result['p50_ms']:>9.1f} ms "
+              f"({change:+.1%}){marker}")
+        if change > threshold:
+            regressions.append((key[0], key[1], change))
+
+    return regressions
+
+
+def parse_list(value, cast=str):
+    return [cast(item) for item in value.split(',') if item]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the document verification pipeline")
+    parser.add_argument('--document-types', type=parse_list, default=['id_card', 'passport', 'drivers_license'])
+    parser.add_argument('--resolutions', type=lambda v: parse_list(v, int), default=[640, 1280, 2560],
+                        help="Image widths in pixels")
+    parser.add_argument('--qualities', type=lambda v: parse_list(v, int), default=[95, 75, 50],
+                        help="JPEG qualities")
+    parser.add_argument('--stages', type=parse_list, default=STAGES)
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--output', help="Write results as JSON to this path")
+    parser.add_argument('--compare', help="Baseline JSON results to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="Relative p50 increase counted as a regression")
+    args = parser.parse_args(argv)
+
+    unknown = set(args.stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+    report = run_benchmarks(args)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare_runs(report, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,6 +7,26 @@ SESSION_TIMEOUT = 3600  # 1 hour session timeout
 MAX_LOGIN_ATTEMPTS = 5
 LOCKOUT_DURATION = timedelta(minutes=15)
 
+# Document verification pipeline
+# Thread pools per process; 0 sizes them to the process's share of the CPUs (see verification_pool)
+OCR_MAX_WORKERS = int(os.environ.get("OCR_MAX_WORKERS", 0))  # Concurrent Tesseract runs per process
+DETECTOR_MAX_WORKERS = int(os.environ.get("DETECTOR_MAX_WORKERS", 0))  # Concurrent security feature detectors
+OCR_BACKEND = os.environ.get("OCR_BACKEND", "auto")  # auto, tesserocr or pytesseract
+OCR_LANG = os.environ.get("OCR_LANG", "eng")
+OCR_TESSDATA_PATH = os.environ.get("OCR_TESSDATA_PATH")  # Defaults to the tessdata compiled into Tesseract
+OCR_ROI_MAX_BANDS = int(os.environ.get("OCR_ROI_MAX_BANDS", 4))  # Candidate ID-number lines OCR'd per document
+OCR_FULL_PAGE_FALLBACK = os.environ.get("OCR_FULL_PAGE_FALLBACK", "true").lower() == "true"
+ELA_QUALITIES = [int(q) for q in os.environ.get("ELA_QUALITIES", "90,75").split(",")]  # First one decides
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", 40000000))  # Decoded pixel budget per upload
+ANALYSIS_MAX_DIMENSION = int(os.environ.get("ANALYSIS_MAX_DIMENSION", 2000))  # Longer image side the pipeline analyzes
+ELA_MAX_PIXELS = int(os.environ.get("ELA_MAX_PIXELS", 8000000))  # Larger uploads get ELA on the analysis image, not a full decode
+QUALITY_GATE_ENABLED = os.environ.get("QUALITY_GATE_ENABLED", "true").lower() == "true"
+QUALITY_MIN_SHARPNESS = float(os.environ.get("QUALITY_MIN_SHARPNESS", 50))  # Laplacian variance on the thumbnail
+DOCUMENT_TEMPLATES_DIR = os.environ.get(  # Reference keypoints, see scripts/build_document_templates.py
+    "DOCUMENT_TEMPLATES_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "document_templates")
+)
+CLASSIFIER_MIN_INLIERS = int(os.environ.get("CLASSIFIER_MIN_INLIERS", 15))  # Matching keypoints needed to recognise a document
+
 
 class Config:
     """Base config class."""
@@ -28,6 +48,14 @@ class Config:
     JWT_HEADER_NAME = "Authorization"
     JWT_HEADER_TYPE = "Bearer"
     
+    # Revoked Token Cache
+    TOKEN_BLOCKLIST_CACHE_ENABLED = os.environ.get("TOKEN_BLOCKLIST_CACHE_ENABLED", "true").lower() == "true"
+    TOKEN_BLOCKLIST_SYNC = os.environ.get("TOKEN_BLOCKLIST_SYNC", "listen")  # listen (snapshot listener) or poll
+    TOKEN_BLOCKLIST_SYNC_INTERVAL = int(os.environ.get("TOKEN_BLOCKLIST_SYNC_INTERVAL", 30))  # seconds between polls or heartbeats; lookups go to Firestore once one is missed
+    TOKEN_BLOCKLIST_SWEEP_INTERVAL = int(os.environ.get("TOKEN_BLOCKLIST_SWEEP_INTERVAL", 3600))  # 0 disables the sweeper
+    # Set when a Firestore TTL policy on blacklisted_tokens.expires_at deletes expired entries instead
+    TOKEN_BLOCKLIST_TTL_POLICY = os.environ.get("TOKEN_BLOCKLIST_TTL_POLICY", "false").lower() == "true"
+    
     # Security Settings
     SESSION_COOKIE_SECURE = True
     SESSION_COOKIE_HTTPONLY = True
@@ -36,6 +64,10 @@ class Config:
     REMEMBER_COOKIE_HTTPONLY = True
     REMEMBER_COOKIE_DURATION = 3600
     
+    # User Document Cache for display reads (0 disables the process-level tier; other processes see writes up to this late)
+    USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", 0))  # seconds
+    USER_CACHE_MAX_ENTRIES = int(os.environ.get("USER_CACHE_MAX_ENTRIES", 10000))
+    
     # Login Security
     MAX_LOGIN_ATTEMPTS = 5
     LOCKOUT_DURATION = timedelta(minutes=15)
@@ -54,6 +86,49 @@ class Config:
     MFA_ENABLED = True
     MFA_REQUIRED_FOR_ROLES = ['admin']  # Roles that require MFA
     MFA_TOKEN_VALIDITY = 300  # seconds
+    MFA_GRANT_FRESHNESS = int(os.environ.get("MFA_GRANT_FRESHNESS", 900))  # seconds a step-up MFA grant is accepted; 0 disables grants
+    
+    # Document Uploads
+    MAX_DOCUMENT_SIZE = int(os.environ.get("MAX_DOCUMENT_SIZE", 1000000))  # bytes per document
+    UPLOAD_REQUEST_OVERHEAD = 64 * 1024  # bytes of JSON keys or multipart headers around a document
+    # Request body limit, enforced while the body is read, so it also holds for
+    # chunked uploads without a Content-Length. Views can raise it with
+    # @max_content_length (the batch upload does, see below).
+    MAX_CONTENT_LENGTH = MAX_DOCUMENT_SIZE + UPLOAD_REQUEST_OVERHEAD
+    
+    # Document Verification Jobs
+    VERIFICATION_ASYNC_DEFAULT = os.environ.get("VERIFICATION_ASYNC_DEFAULT", "false").lower() == "true"
+    VERIFICATION_WORKERS = int(os.environ.get("VERIFICATION_WORKERS", 2))
+    VERIFICATION_MAX_PENDING_JOBS = int(os.environ.get("VERIFICATION_MAX_PENDING_JOBS", 100))
+    VERIFICATION_JOB_TTL = int(os.environ.get("VERIFICATION_JOB_TTL", 900))  # seconds results are kept
+    VERIFICATION_BATCH_MAX_DOCUMENTS = int(os.environ.get("VERIFICATION_BATCH_MAX_DOCUMENTS", 5))
+    VERIFICATION_BATCH_MAX_CONTENT_LENGTH = VERIFICATION_BATCH_MAX_DOCUMENTS * (MAX_DOCUMENT_SIZE + UPLOAD_REQUEST_OVERHEAD)
+    VERIFICATION_BATCH_WORKERS = int(os.environ.get("VERIFICATION_BATCH_WORKERS", os.cpu_count() or 2))
+    
+    # Verification Worker Processes
+    # Every API process has its own pool. Under gunicorn that means one per
+    # gunicorn worker, so set WEB_CONCURRENCY (gunicorn's default for
+    # --workers) to the number of workers: the default pool size then splits
+    # the CPUs between them instead of giving each one cpu_count processes.
+    # The pool is not started by Flask CLI commands or the reloader parent.
+    WEB_CONCURRENCY = max(1, int(os.environ.get("WEB_CONCURRENCY", 1)))
+    VERIFICATION_PROCESS_POOL_ENABLED = os.environ.get("VERIFICATION_PROCESS_POOL_ENABLED", "true").lower() == "true"
+    VERIFICATION_PROCESS_POOL_AUTOSTART = os.environ.get("VERIFICATION_PROCESS_POOL_AUTOSTART", "true").lower() == "true"
+    VERIFICATION_PROCESSES = int(os.environ.get("VERIFICATION_PROCESSES", max(1, (os.cpu_count() or 2) // WEB_CONCURRENCY)))
+    VERIFICATION_JOB_TIMEOUT = int(os.environ.get("VERIFICATION_JOB_TIMEOUT", 60))  # seconds per document
+    VERIFICATION_MAX_JOBS_PER_WORKER = int(os.environ.get("VERIFICATION_MAX_JOBS_PER_WORKER", 200))
+    VERIFICATION_MAX_WORKER_RSS_MB = int(os.environ.get("VERIFICATION_MAX_WORKER_RSS_MB", 1024))
+    
+    # Verification Result Cache
+    VERIFICATION_CACHE_ENABLED = os.environ.get("VERIFICATION_CACHE_ENABLED", "true").lower() == "true"
+    VERIFICATION_CACHE_MAX_BYTES = int(os.environ.get("VERIFICATION_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+    VERIFICATION_CACHE_TTL = int(os.environ.get("VERIFICATION_CACHE_TTL", 86400))  # seconds
+    VERIFICATION_CACHE_DIR = os.environ.get("VERIFICATION_CACHE_DIR")  # Optional on-disk tier
+    
+    # Near-Duplicate Documents
+    DUPLICATE_INDEX_ENABLED = os.environ.get("DUPLICATE_INDEX_ENABLED", "true").lower() == "true"
+    DUPLICATE_MAX_DISTANCE = int(os.environ.get("DUPLICATE_MAX_DISTANCE", 6))  # Differing perceptual hash bits of 64
+    DUPLICATE_INDEX_MAX_ENTRIES = int(os.environ.get("DUPLICATE_INDEX_MAX_ENTRIES", 2000000))
 
 
 class DevelopmentConfig(Config):
@@ -0,0 +1,89 @@
+"""
+Build the reference template store used to classify uploaded documents.
+
+Reference images are read from one sub-directory per document type, named
+after the type the pipeline uses:
+
+    references/
+        id_card/cnic_front.jpg
+        passport/data_page.png
+        drivers_license/...
+        e_license/...
+
+Usage (from the backend directory):
+
+    python -m scripts.build_document_templates references/
+    python -m scripts.build_document_templates references/ --output /srv/templates
+
+The store is written to DOCUMENT_TEMPLATES_DIR unless --output is given.
+Worker processes map it once, so restart the API after rebuilding.
+"""
+import os
+import sys
+import argparse
+import importlib.util
+
+import cv2
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+
+
+def load_verification_utils():
+    """
+    Load the verification module straight from its file.
+
+    Importing it through the ``app`` package would run create_app() and
+    connect to Firebase, which is not needed to build templates.
+    """
+    path = os.path.join(BACKEND_DIR, 'app', 'utils', 'verification_utils.py')
+    spec = importlib.util.spec_from_file_location('verification_utils', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def iter_references(reference_dir, document_types):
+    """Yield (document_type, name, image) for every readable reference image."""
+    for document_type in sorted(os.listdir(reference_dir)):
+        type_dir = os.path.join(reference_dir, document_type)
+        if not os.path.isdir(type_dir):
+            continue
+        if document_type not in document_types:
+            print(f"Skipping {type_dir}: unknown document type {document_type}")
+            continue
+        for filename in sorted(os.listdir(type_dir)):
+            if not filename.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            image = cv2.imread(os.path.join(type_dir, filename), cv2.IMREAD_GRAYSCALE)
+            if image is None:
+                print(f"Skipping unreadable image {filename}")
+                continue
+            yield document_type, f"{document_type}/{filename}", image
+
+
+def main(argv=None):
+    vu = load_verification_utils()
+
+    parser = argparse.ArgumentParser(description="Build the document classifier's template store")
+    parser.add_argument('reference_dir', help="Directory with one sub-directory of images per document type")
+    parser.add_argument('--output', default=vu.DOCUMENT_TEMPLATES_DIR,
+                        help="Where to write the store (default: DOCUMENT_TEMPLATES_DIR)")
+    args = parser.parse_args(argv)
+
+    try:
+        count = vu.build_document_templates(
+            iter_references(args.reference_dir, set(vu.DOCUMENT_PROFILES)), args.output
+        )
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+
+    print(f"Wrote {count} templates to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())